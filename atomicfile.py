@@ -0,0 +1,37 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+
+"""
+Module that contains the code related to the atomic writing of the files of
+the bot (the datasets, the Streets graph and the tiles of the maps): a file
+is written under a temporary name in its directory, flushed to disk and
+then renamed over the final name, so it is never read half written, not
+even after a crash.
+"""
+
+
+@contextmanager
+def atomic_write(filename: str) -> Iterator[BinaryIO]:
+    """Returns (as a context manager) a binary file where the new contents of
+    filename are written. When the block ends, the file is flushed to disk
+    and replaces filename; if the block raises an exception, the file is
+    removed and filename is left as it was. Every call uses its own
+    temporary file, so several threads can write the same file at once (the
+    last one to finish wins)."""
+
+    directory: str = os.path.dirname(os.path.abspath(filename))
+    fd, temporary = tempfile.mkstemp(
+        dir=directory, prefix='.%s.' % os.path.basename(filename),
+        suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, filename)
+    except BaseException:
+        os.remove(temporary)
+        raise
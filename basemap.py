@@ -0,0 +1,234 @@
+import os
+import city
+import shutil
+import atomicfile
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import Future
+from PIL import Image, ImageDraw
+from staticmap import StaticMap
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+from typing_extensions import TypeAlias
+
+
+"""
+Module that contains the code related to the pre-rendered base layer of the
+maps: OSM tiles with a network (usually the Metro graph) already drawn on
+them. Each tile is rendered once, stored on disk and then only cropped and
+composed with the route of each request.
+"""
+
+
+# Zoom levels of the base layer.
+MIN_ZOOM: int = 11
+MAX_ZOOM: int = 16
+
+# Tiles kept in memory.
+CACHE_SIZE: int = 256
+
+# URL of the tiles drawn under the network, as in staticmap.
+TILE_SERVER: str = 'http://a.tile.osm.org/{z}/{x}/{y}.png'
+
+# Segments of the network in pixels of the world map: (E, 4) array of
+# (x0, y0, x1, y1) and the color of each one.
+Segments: TypeAlias = Tuple[np.ndarray, List[str]]
+
+
+class BaseLayer:
+    """Tile pyramid of OSM tiles with the graph g drawn over them, stored in
+    directory as <zoom>/<x>/<y>.png. Missing tiles are rendered (and stored)
+    over the tiles of url_template the first time they are needed. Tiles
+    are used by several threads: each one is loaded or rendered by the
+    first thread that needs it, without holding the lock, and the others
+    wait for its result."""
+
+    def __init__(self, g: city.CityGraph, directory: str,
+                 url_template: str = TILE_SERVER) -> None:
+        self.directory: str = directory
+        self.url_template: str = url_template
+        self._tiles: OrderedDict = OrderedDict()
+        self._loading: Dict[Tuple[int, int, int], Future] = {}
+        self._lock = threading.Lock()
+
+        nodes = list(g.nodes)
+        index: Dict = {node: i for i, node in enumerate(nodes)}
+        self._coords = np.array([city.node_pos(g, node) for node in nodes],
+                                dtype=np.float64)
+        edges = list(g.edges(data='color'))
+        self._ends = np.array([(index[u], index[v]) for u, v, _ in edges],
+                              dtype=np.int32).reshape(-1, 2)
+        self._colors: List[str] = [color for _, _, color in edges]
+        self._segments: Dict[int, Segments] = {}
+
+    def build(self) -> None:
+        """Renders every tile of the network at every zoom level that is not
+        stored yet. The stored ones are not loaded. Around 2,000 tiles are
+        downloaded the first time, so the tile server must allow bulk
+        downloads (the OSM ones do not)."""
+
+        for zoom in range(MIN_ZOOM, MAX_ZOOM + 1):
+            pixels = city.to_pixels(self._coords, zoom)
+            first = np.floor(pixels.min(axis=0) / city.TILE_SIZE).astype(int)
+            last = np.floor(pixels.max(axis=0) / city.TILE_SIZE).astype(int)
+            for x in range(first[0], last[0] + 1):
+                for y in range(first[1], last[1] + 1):
+                    if not os.path.exists(self._filename(zoom, x, y)):
+                        self.tile(zoom, x, y)
+
+    def clear(self) -> None:
+        """Removes all the rendered tiles, e.g. after the network changes."""
+
+        with self._lock:
+            self._tiles.clear()
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def tile(self, zoom: int, x: int, y: int) -> Image.Image:
+        """Returns the tile (x, y) of the given zoom level."""
+
+        key: Tuple[int, int, int] = (zoom, x, y)
+        with self._lock:
+            image: Optional[Image.Image] = self._tiles.get(key)
+            if image is not None:
+                self._tiles.move_to_end(key)
+                return image
+            future: Optional[Future] = self._loading.get(key)
+            loading: bool = future is None
+            if future is None:
+                future = self._loading[key] = Future()
+        if not loading:
+            # Another thread is already loading it.
+            return future.result()
+
+        try:
+            image = self._load_tile(zoom, x, y)
+        except BaseException as error:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(error)
+            raise
+
+        with self._lock:
+            self._tiles[key] = image
+            while len(self._tiles) > CACHE_SIZE:
+                self._tiles.popitem(last=False)
+            del self._loading[key]
+        future.set_result(image)
+        return image
+
+    def viewport(self, zoom: int, left: int, top: int, width: int,
+                 height: int) -> Image.Image:
+        """Returns the image of the base layer at the given zoom whose top
+        left corner is the pixel (left, top) of the world map."""
+
+        image = Image.new('RGB', (width, height), '#ffffff')
+        size: int = city.TILE_SIZE
+        for x in range(left // size, (left + width - 1) // size + 1):
+            for y in range(top // size, (top + height - 1) // size + 1):
+                image.paste(self.tile(zoom, x, y),
+                            (x * size - left, y * size - top))
+        return image
+
+    def _filename(self, zoom: int, x: int, y: int) -> str:
+        """Returns the file where the tile (x, y) of the given zoom is
+        stored."""
+
+        return os.path.join(self.directory, str(zoom), str(x), "%d.png" % y)
+
+    def _load_tile(self, zoom: int, x: int, y: int) -> Image.Image:
+        """Reads the tile (x, y) of the given zoom from its file or, if it
+        does not exist, renders and stores it (atomically, so it is never
+        read half written)."""
+
+        filename: str = self._filename(zoom, x, y)
+        if os.path.exists(filename):
+            image: Image.Image = Image.open(filename)
+            image.load()
+            return image
+
+        image = self._render_tile(zoom, x, y)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with atomicfile.atomic_write(filename) as file:
+            image.save(file, format='PNG')
+        return image
+
+    def _render_tile(self, zoom: int, x: int, y: int) -> Image.Image:
+        """Renders the OSM tile (x, y) of the given zoom with the segments of
+        the network that cross it."""
+
+        size: int = city.TILE_SIZE
+        center = np.array([(x + 0.5) * size, (y + 0.5) * size])
+        map = StaticMap(size, size, url_template=self.url_template)
+        image: Image.Image = map.render(zoom=zoom,
+                                        center=list(city.to_coord(center,
+                                                                  zoom)))
+
+        segments, colors = self._zoom_segments(zoom)
+        left, top = x * size, y * size
+        inside = np.flatnonzero(
+            (np.maximum(segments[:, 0], segments[:, 2]) >= left) &
+            (np.minimum(segments[:, 0], segments[:, 2]) < left + size) &
+            (np.maximum(segments[:, 1], segments[:, 3]) >= top) &
+            (np.minimum(segments[:, 1], segments[:, 3]) < top + size))
+
+        draw = ImageDraw.Draw(image)
+        for i in inside:
+            x0, y0, x1, y1 = segments[i]
+            draw.line([(x0 - left, y0 - top), (x1 - left, y1 - top)],
+                      fill=colors[i], width=3)
+        return image
+
+    def _zoom_segments(self, zoom: int) -> Segments:
+        """Returns the segments of the network at the given zoom."""
+
+        with self._lock:
+            if zoom in self._segments:
+                return self._segments[zoom]
+        pixels = np.rint(city.to_pixels(self._coords, zoom))
+        segments = np.hstack((pixels[self._ends[:, 0]],
+                              pixels[self._ends[:, 1]]))
+        with self._lock:
+            return self._segments.setdefault(zoom, (segments, self._colors))
+
+
+def plot_path(base: BaseLayer, g: city.CityGraph, p: city.Path,
+              filename: Union[str, BinaryIO],
+              edges_from_path: List[Tuple[city.NodeID]]) -> None:
+    """Same as city.plot_path, but the path is drawn over a viewport cropped
+    from the base layer, so the work done only depends on the length of the
+    path. Paths that do not fit at any zoom of the base layer are drawn by
+    city.plot_path."""
+
+    coords = np.array([city.node_pos(g, node) for node in p],
+                      dtype=np.float64)
+    zoom: int = min(city.fit_zoom(coords, city.MAP_SIZE, city.MAP_SIZE),
+                    MAX_ZOOM)
+    if zoom < MIN_ZOOM:
+        city.plot_path(g, p, filename, edges_from_path)
+        return
+
+    pixels = city.to_pixels(coords, zoom)
+    center = (pixels.min(axis=0) + pixels.max(axis=0)) / 2
+    left: int = int(round(center[0])) - city.MAP_SIZE // 2
+    top: int = int(round(center[1])) - city.MAP_SIZE // 2
+    image = base.viewport(zoom, left, top, city.MAP_SIZE, city.MAP_SIZE)
+    draw = ImageDraw.Draw(image)
+
+    # The edges of the path, merged and simplified as in city.plot_path.
+    for color, coordinates in city.merge_path_lines(g, edges_from_path):
+        points = city.to_pixels(np.array(coordinates, dtype=np.float64),
+                                zoom)
+        points = points[city.douglas_peucker(points,
+                                             city.SIMPLIFY_TOLERANCE)]
+        draw.line([(px - left, py - top) for px, py in points],
+                  fill=color, width=6, joint='curve')
+
+    # The starting point in red and the destination in purple, both with a
+    # white border.
+    for node, color in ((p[0], "#FF0000"), (p[-1], "#800080")):
+        px, py = city.to_pixels(np.array([city.node_pos(g, node)]), zoom)[0]
+        px, py = px - left, py - top
+        draw.ellipse((px - 10, py - 10, px + 10, py + 10), fill="#FFFFFF")
+        draw.ellipse((px - 7.5, py - 7.5, px + 7.5, py + 7.5), fill=color)
+
+    image.save(filename, format='PNG')
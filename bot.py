@@ -1,13 +1,30 @@
+import io
+import os
 import city
+import time
+import zlib
+import logging
 import metro
+import basemap
+import routing
+import storage
+import startup
+import prefetch
+import itinerary
+import networkx
 import restaurants as rs
-from typing import List, Tuple, Optional
+from array import array
+from itertools import islice
+from dataclasses import dataclass
+from typing import Iterator, List, Tuple, Optional
 from telegram.update import Update
+from telegram.error import BadRequest
 from telegram.ext.filters import Filters
 from telegram.ext.messagehandler import MessageHandler
 from telegram.ext.callbackcontext import CallbackContext
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Updater, CommandHandler, CallbackQueryHandler
+from telegram.ext import Updater, Dispatcher, CommandHandler, \
+    CallbackQueryHandler
 
 
 """
@@ -22,37 +39,355 @@ guide them. Uses the city and restaurants modules.
 """
 
 
-TOKEN = open('token.txt').read().strip()
-updater = Updater(token=TOKEN, use_context=True)
-dispatcher = updater.dispatcher
-
+def build_city(streets: city.OsmnxGraph,
+               metro_graph: metro.MetroGraph) -> city.CityGraph:
+    """Merges a copy of the Metro graph into the City graph (the Metro graph
+    is not modified) and compacts and freezes the City graph."""
+
+    City: city.CityGraph = city.build_city_graph(streets, metro_graph.copy())
+    city.compact_node_attributes(City)
+    return networkx.freeze(City)
+
+
+# Tile server of the base layer of the maps. Pre-rendering the whole base
+# layer in the background when the bot starts downloads around 2,000 tiles,
+# which the tile usage policy of OSM forbids on its servers, so it is only
+# done if PRERENDER_TILES is enabled with another TILE_SERVER (e.g. a
+# self-hosted one). Otherwise each tile is rendered the first time a map
+# needs it.
+TILE_SERVER: str = basemap.TILE_SERVER
+PRERENDER_TILES: bool = False
+
+
+# Stages of the startup of the bot (see the startup module). A stage never
+# modifies the result of another one. The graphs are shared by the handlers
+# running in different threads, so they are frozen: routes are searched in
+# the (immutable) routing graph.
+STARTUP_STAGES: List[startup.Stage] = [
+    startup.Stage('restaurants', rs.read_dataset),
+    startup.Stage('streets', city.get_osmnx_graph),
+    startup.Stage('stations', metro.read_stations),
+    startup.Stage('accesses', metro.read_accesses),
+    startup.Stage('metro', metro.build_metro_graph,
+                  ('stations', 'accesses')),
+    startup.Stage('base', lambda g: basemap.BaseLayer(g, 'base', TILE_SERVER),
+                  ('metro',)),
+    startup.Stage('city', build_city, ('streets', 'metro')),
+    startup.Stage('routes', routing.build_routing_graph, ('city',)),
+    startup.Stage('table', metro.build_metro_table, ('metro',))]
+
+logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
+                    level=logging.INFO)
 
 # Global variables with the escencial information for the bot
-restaurants: rs.Restaurants = rs.read()
-Streets: city.OsmnxGraph = city.get_osmnx_graph()
-Metro: metro.MetroGraph = metro.get_metro_graph()
-City: city.CityGraph = city.build_city_graph(Streets, Metro)
+stages, stage_times = startup.run_stages(STARTUP_STAGES)
+startup.log_times(stage_times)
+restaurants: rs.Restaurants
+dataset_fingerprint: int  # Of the binary file of the restaurants.
+restaurants, dataset_fingerprint = stages['restaurants']
+Metro: metro.MetroGraph = stages['metro']
+Base: basemap.BaseLayer = stages['base']
+Table: metro.MetroTable = stages['table']
+
+
+@dataclass(frozen=True)
+class Network:
+    """Graphs where the routes are searched and drawn: the Streets graph,
+    the (reduced) City graph built from it and its routing graph. They are
+    replaced together when the streets are refreshed, so a handler takes
+    the current Network once and only uses its graphs."""
+
+    streets: city.OsmnxGraph
+    graph: city.CityGraph
+    routes: routing.RoutingGraph
+
+
+network: Network = Network(networkx.freeze(stages['streets']),
+                           stages['city'], stages['routes'])
+
+# Seconds of inactivity after which the results of a user are dropped (they
+# are regenerated from the stored query if needed again).
+RESULTS_TTL: float = 30 * 60
+EVICTION_INTERVAL: float = 5 * 60
+
+# Store of the users' state, loaded lazily for each user. It keeps nothing
+# until main() opens the database, so that importing the module (e.g. from
+# loadtest.py) does not open it; other stores can be assigned instead.
+USERS_FILE: str = 'users.db'
+users: storage.UserStore = storage.UserStore()
+
+# Number of restaurants shown in each page of results of /find.
+PAGE_SIZE: int = 12
+
+# Routing of /guide and /steps: FASTEST finds the exact fastest route,
+# TABLE composes it with the MetroTable (see routing.table_path), which is
+# approximate but explores less of the graph on long trips, and TIMETABLE
+# finds the fastest route leaving now, waiting for the trains (see
+# routing.time_dependent_path).
+FASTEST: str = 'fastest'
+TABLE: str = 'table'
+TIMETABLE: str = 'timetable'
+ROUTING_MODES: Tuple[str, ...] = (FASTEST, TABLE, TIMETABLE)
+ROUTING_MODE: str = FASTEST
+
+# Whether /info starts computing the route of /guide to the restaurant in
+# the background, so that a following /guide is answered at once.
+PREFETCH_GUIDES: bool = False
+guides: prefetch.Prefetcher = prefetch.Prefetcher()
+
+
+# Local OSM extract of Barcelona (see city.refresh_osmnx_graph). When it
+# changes, the streets are refreshed from it, checking every
+# REFRESH_INTERVAL seconds.
+STREETS_EXTRACT: str = 'barcelona.osm'
+REFRESH_INTERVAL: float = 10 * 60
+extract_time: float = 0.0  # Modification time of the last extract used.
+
+
+def refresh_streets(extract: str) -> city.OsmnxDiff:
+    """Updates the Streets graph with a local OSM extract and saves it (see
+    city.refresh_osmnx_graph). Only the differences are applied to the
+    Streets graph, but the City graph of the bot is reduced and frozen, so
+    it is fully rebuilt from the updated Streets graph (reduction, node
+    registry and routing graph included). The new Network replaces the
+    current one once it is built; meanwhile the handlers keep using the old
+    one. Returns the applied differences."""
+
+    global network
+    streets: city.OsmnxGraph = network.streets.copy()
+    diff: city.OsmnxDiff = city.refresh_osmnx_graph(streets, None, extract)
+    if diff.is_empty():
+        return diff
+
+    graph: city.CityGraph = build_city(streets, Metro)
+    network = Network(networkx.freeze(streets), graph,
+                      routing.build_routing_graph(graph))
+    return diff
+
+
+def refresh_job(context: CallbackContext) -> None:
+    """Refreshes the streets from STREETS_EXTRACT if it has changed since it
+    was last used."""
+
+    global extract_time
+    if not os.path.exists(STREETS_EXTRACT) or \
+            os.path.getmtime(STREETS_EXTRACT) <= extract_time:
+        return
+    extract_time = os.path.getmtime(STREETS_EXTRACT)
+    start: float = time.perf_counter()
+    diff: city.OsmnxDiff = refresh_streets(STREETS_EXTRACT)
+    logging.info("Streets refreshed from %s in %.1f s: %d nodes and %d "
+                 "edges added, %d nodes and %d edges removed",
+                 STREETS_EXTRACT, time.perf_counter() - start,
+                 len(diff.added_nodes), len(diff.added_edges),
+                 len(diff.removed_nodes), len(diff.removed_edges))
 
 
 def register_user(update: Update, context: CallbackContext):
     """Registers a new user (with some basic attributes) in the bot's user
-    dictionary."""
+    dictionary. The results of the last search are stored as the indices
+    of the matching restaurants in the global list of restaurants."""
 
     user_id = update.effective_chat.id
     user_name = update.effective_chat.first_name
-    matching_restaurants: rs.Restaurants = []
     context.user_data[user_id] = {'Name': user_name,
-                                  'User restaurants': matching_restaurants,
-                                  'Coordinates': [0.0, 0.0]}
+                                  'Query': "",
+                                  'User restaurants': array('i'),
+                                  'Coordinates': [0.0, 0.0],
+                                  'Last seen': time.monotonic()}
+    persist_user(update, context)
 
 
 def verify_user(update: Update, context: CallbackContext):
     """It checks if the user already exists within the bot's dictionary
-    and, if not, adds it."""
+    and, if not, loads it from the store or adds it. It also records the
+    user's activity."""
 
     user_id = update.effective_chat.id
     if user_id not in context.user_data:
-        register_user(update, context)
+        user: Optional[storage.User] = users.load(user_id)
+        if user is None:
+            register_user(update, context)
+        else:
+            context.user_data[user_id] = user
+    context.user_data[user_id]['Last seen'] = time.monotonic()
+
+
+def persist_user(update: Update, context: CallbackContext):
+    """Queues the current state of the user to be saved in the store."""
+
+    user_id = update.effective_chat.id
+    users.save(user_id, context.user_data[user_id])
+
+
+def get_user_restaurants(update: Update, context: CallbackContext) -> array:
+    """Returns the indices of the restaurants found with the last /find of
+    the user. If they were evicted, they are searched again."""
+
+    user = context.user_data[update.effective_chat.id]
+    if user['User restaurants'] is None:
+        matching = rs.search(user['Query'].split(), restaurants)
+        user['User restaurants'] = array('i', matching)
+    return user['User restaurants']
+
+
+def result_lines(user_restaurants: array, first: int) -> Iterator[str]:
+    """Yields the numbered names of the restaurants of the results of a
+    user, starting at the position first."""
+
+    for i in range(first, len(user_restaurants)):
+        yield "%d. %s" % (i + 1, restaurants[user_restaurants[i]].name)
+
+
+def search_id(query: str) -> int:
+    """Returns the identifier of the results of a /find with the given query,
+    carried by the buttons of their pages so that the buttons of an older
+    search can be recognized. The results only depend on the query, so the
+    identifier is derived from it and survives restarts and evictions."""
+
+    return zlib.crc32(query.encode())
+
+
+def page_data(first: int, search: int) -> str:
+    """Returns the data of the inline button that shows the page of the
+    results of the search that starts at the position first."""
+
+    return "page %d %08x" % (first, search)
+
+
+def parse_page_data(data: str) -> Optional[Tuple[int, int]]:
+    """Returns the first position and the search of the data of an inline
+    button, or None if it is not valid (e.g. buttons sent by older versions
+    of the bot)."""
+
+    parts: List[str] = data.split()
+    if len(parts) != 3 or parts[0] != "page":
+        return None
+    try:
+        return int(parts[1]), int(parts[2], 16)
+    except ValueError:
+        return None
+
+
+def result_page(user_restaurants: array, first: int,
+                search: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Returns the text of the page of results of the search that starts at
+    the position first and the inline buttons to move to the previous and
+    next pages (None if there are no other pages). Only the restaurants of
+    the page are read."""
+
+    total: int = len(user_restaurants)
+    lines: List[str] = ["Choose your restaurant:"]
+    lines.extend(islice(result_lines(user_restaurants, first), PAGE_SIZE))
+    pages: int = (total - 1) // PAGE_SIZE + 1
+    lines.append("\nPage %d of %d." % (first // PAGE_SIZE + 1, pages))
+
+    buttons: List[InlineKeyboardButton] = []
+    if first > 0:
+        previous: int = max(first - PAGE_SIZE, 0)
+        buttons.append(InlineKeyboardButton(
+            "⬅️ Previous", callback_data=page_data(previous, search)))
+    if first + PAGE_SIZE < total:
+        following: str = page_data(first + PAGE_SIZE, search)
+        buttons.append(InlineKeyboardButton("Next ➡️",
+                                            callback_data=following))
+    markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    return "\n".join(lines), markup
+
+
+def evict_inactive_users(context: CallbackContext):
+    """Drops the stored results of the users that have been inactive for
+    longer than RESULTS_TTL."""
+
+    now: float = time.monotonic()
+    for data in list(context.dispatcher.user_data.values()):
+        for user in list(data.values()):
+            if now - user['Last seen'] > RESULTS_TTL:
+                user['User restaurants'] = None
+    guides.evict()
+
+
+def guide_key(src: city.Coord, index: int) -> Tuple[float, float, int]:
+    """Returns the key of the route from src to the restaurant with the given
+    index in the prefetched guides."""
+
+    return src[0], src[1], index
+
+
+def restaurant_location(index: int) -> city.Coord:
+    """Returns the location of the restaurant with the given index."""
+
+    restaurant: rs.Restaurant = restaurants[index]
+    return [float(restaurant.longitude), float(restaurant.latitude)]
+
+
+def minute_of_day() -> float:
+    """Returns the current (local) minute of the day."""
+
+    now: time.struct_time = time.localtime()
+    return now.tm_hour * 60 + now.tm_min + now.tm_sec / 60
+
+
+def restaurant_route(net: Network, src: city.Coord,
+                     index: int) -> Tuple[float, city.Path, city.Coord]:
+    """Returns the estimated minutes and the path (of the reduced City
+    graph of net) of the fastest route from src to the restaurant with the
+    given index, and the location of the restaurant."""
+
+    dst: city.Coord = restaurant_location(index)
+    table: Optional[metro.MetroTable] = Table if ROUTING_MODE == TABLE \
+        else None
+    departure: Optional[float] = minute_of_day() \
+        if ROUTING_MODE == TIMETABLE else None
+    minutes, path = routing.find_route(net.routes, net.streets, src, dst,
+                                       table, departure)
+    return minutes, path, dst
+
+
+def restaurant_routes(net: Network, src: city.Coord, index: int,
+                      accessible_only: bool) -> List[routing.Route]:
+    """Returns the alternative routes from src to the restaurant with the
+    given index (see routing.find_routes), with the paths of the reduced
+    City graph of net."""
+
+    return routing.find_routes(net.routes, net.streets, src,
+                               restaurant_location(index), accessible_only)
+
+
+def route_summary(number: int, route: routing.Route) -> str:
+    """Returns the line with the number, minutes, meters walked and line
+    changes of the route."""
+
+    changes: str = "1 line change" if route.transfers == 1 \
+        else "%d line changes" % route.transfers
+    return "Route %d: %d min, %d m walking, %s." % (
+        number, int(route.time), int(route.walking), changes)
+
+
+def route_directions(net: Network, path: city.Path) -> str:
+    """Returns the step by step directions of the path of the reduced City
+    graph of net."""
+
+    return itinerary.describe(itinerary.build_itinerary(net.graph, path))
+
+
+def route_image(src: city.Coord, index: int) -> Tuple[float, bytes, str]:
+    """Returns the estimated minutes of the fastest route from src to the
+    restaurant with the given index, the PNG image of the route drawn on
+    the map and its step by step directions."""
+
+    net: Network = network
+    minutes, path, dst = restaurant_route(net, src, index)
+    directions: str = route_directions(net, path)
+    path = city.expand_path(net.graph, path)  # as in the unreduced graph.
+    path_graph: city.CityGraph = city.path_graph(net.graph, path, src, dst)
+    path = [1] + path + [2]
+    path_edges: List[Tuple[city.NodeID]] = city.get_edges_from_path(path)
+
+    # path image generated in memory.
+    image = io.BytesIO()
+    basemap.plot_path(Base, path_graph, path, image, path_edges)
+    return minutes, image.getvalue(), directions
 
 
 def start(update: Update, context: CallbackContext):
@@ -92,10 +427,10 @@ def help(update: Update, context: CallbackContext):
 */author:* Writes a message with the names of the authors of Metro-Bot.
 
 */find: <query>* Finds the restaurants that satisfy the query(s) and saves
-them in a list of matching restaurants. Returns the name of the
-first 12 restaurants in the list of matching restaurants. If you want,
-there is an option to see the whole list of matching restaurants. If an
-error occurs, it displays an error text.
+them in a list of matching restaurants. Returns the names of the
+restaurants in the list of matching restaurants, in pages of 12. Use the
+buttons to see the next and previous pages. If an error occurs, it
+displays an error text.
 
 */info: <number>* Shows the complete information of the restaurant
 specified by its number (index) that appears in the list of
@@ -106,10 +441,19 @@ displays an error text.
 (in time) to the restaurant specified by its number (index) that appears
 in the list of results obtained with the /find command. Sends an image
 of the route. The starting point is red and the destination is indicated
-in purple. The estimated time of the route is also displayed.
-(Remember, this is just an estimate).
+in purple. The estimated time of the route and the step by step
+directions are also displayed. (Remember, this is just an estimate).
 If an error occurs, it displays an error text.
 
+*/steps: <number>* Same as /guide, but only sends the step by step
+directions of the route (streets, accesses and metro lines), without the
+map.
+
+*/routes: <number> [accessible]* Sends the step by step directions of up
+to 4 alternative routes to the restaurant, trading time for less walking
+or fewer line changes. With "accessible", the routes only use the
+accesses for people with reduced mobility.
+
 Remember, I need your location to work correctly...
 
 '''
@@ -130,48 +474,31 @@ Universitat Politècnica de Catalunya, 2022.
 
 def find(update: Update, context: CallbackContext):
     """Finds the restaurants that satisfy the query and saves them in a list
-    of matching restaurants. Returns the name of the first 12 restaurants in
-    the list of matching restaurants. If an error occurs, it displays an error
-    text."""
+    of matching restaurants. Returns the first page of names of the list of
+    matching restaurants, with buttons to see the other pages. If an error
+    occurs, it displays an error text."""
 
     verify_user(update, context)
 
     try:
-        user_restaurants: rs.Restaurant = []
         # finds matching restaurants for all query arguments.
-        for i in range(len(context.args)):
-            query = str(context.args[i])
-            if i == 0:
-                user_restaurants = rs.find(query, restaurants)
-            else:
-                user_restaurants = rs.find(query, user_restaurants)
-
-        if len(user_restaurants) == 0:
+        matching = array('i', rs.search(context.args, restaurants))
+        query: str = " ".join(context.args)
+
+        if len(matching) == 0:
             text: str = "No results were found, sorry.\nTry another word."
             update.message.reply_text(text)
             context.bot.send_message(chat_id=update.effective_chat.id, text="😔")
         else:
-            i: int = 0
-            txt: str = "Choose your restaurant:\n"
-            while i < len(user_restaurants) and i < 12:
-                txt += str(i + 1) + ". "
-                txt += str(user_restaurants[i].name) + "\n"
-                i += 1
-            update.message.reply_text(txt)
-
-            txt2: str = "Do you need more options?\n"
-            txt2 += "Click 'Yes' to see some other results."
-
-            # Option to show the whole list of matching restaurants.
-            if (len(user_restaurants) >= 12):
-                buttons = [[InlineKeyboardButton("Yes", callback_data='y')],
-                           [InlineKeyboardButton("No", callback_data='n')]]
-                update.message.reply_text(
-                    txt2, reply_markup=InlineKeyboardMarkup(buttons))
+            # First page, with the buttons to move to the other ones.
+            txt, markup = result_page(matching, 0, search_id(query))
+            update.message.reply_text(txt, reply_markup=markup)
 
         # Updates the list of matching restaurants for each bot user.
         user_id = update.effective_chat.id
-        context.user_data[user_id]['User restaurants'] = user_restaurants
+        context.user_data[user_id]['Query'] = query
+        context.user_data[user_id]['User restaurants'] = matching
+        persist_user(update, context)
 
     except Exception as e:
         error = str(e)
@@ -180,8 +507,10 @@ def find(update: Update, context: CallbackContext):
 
 
 def queryHandler(update: Update, context: CallbackContext):
-    """Writes the rest of the list of restaurants obtained with the /find
-    command, if the user has requested it by clicking the 'Yes' in-line-button."""
+    """Shows another page of the list of restaurants obtained with the /find
+    command, when the user clicks one of the in-line-buttons of the page
+    shown. The message of the page is edited in place. The buttons of the
+    pages of an older search are no longer valid."""
 
     query = update.callback_query.data
     update.callback_query.answer()
@@ -189,21 +518,26 @@ def queryHandler(update: Update, context: CallbackContext):
     verify_user(update, context)
 
     try:
-        if 'y' in query:
-            i: int = 12
-            txt: str = ""
-            user_id = update.effective_chat.id
-            restaurants = context.user_data[user_id]['User restaurants']
-            while i < len(restaurants):
-                txt += str(i+1) + '. '
-                txt += str(restaurants[i].name) + '\n'
-                i += 1
-            txt += "\nThere you go!"
-            context.bot.send_message(chat_id=update.effective_chat.id,
-                                     text=txt)
-        if 'n' in query:
-            context.bot.send_message(chat_id=update.effective_chat.id,
-                                     text="Fine!")
+        user_id = update.effective_chat.id
+        search: int = search_id(context.user_data[user_id]['Query'])
+        page: Optional[Tuple[int, int]] = parse_page_data(query)
+        if page is None or page[1] != search:
+            text: str = "These results are no longer available.\n" \
+                "Please search again with /find."
+            context.bot.send_message(chat_id=user_id, text=text)
+            return
+
+        first: int = page[0]
+        user_restaurants = get_user_restaurants(update, context)
+        if first < len(user_restaurants):
+            txt, markup = result_page(user_restaurants, first, search)
+            try:
+                update.callback_query.edit_message_text(txt,
+                                                        reply_markup=markup)
+            except BadRequest as e:
+                # A double click asks for the page that is already shown.
+                if "Message is not modified" not in e.message:
+                    raise
 
     except Exception as e:
         error = str(e)
@@ -225,23 +559,30 @@ def info(update: Update, context: CallbackContext):
         verify_user(update, context)
 
         num = int(context.args[0]) - 1
+        user_restaurants = get_user_restaurants(update, context)
+        restaurant: rs.Restaurant = restaurants[user_restaurants[num]]
+
+        # The user will probably ask for the guide to this restaurant next.
         user_id = update.effective_chat.id
-        restaurants = context.user_data[user_id]['User restaurants']
+        src: city.Coord = context.user_data[user_id]['Coordinates']
+        if PREFETCH_GUIDES and src != [0.0, 0.0]:
+            guides.submit(user_id, guide_key(src, user_restaurants[num]),
+                          route_image, list(src), user_restaurants[num])
 
         txt: str = "Restaurant information: \n"
         txt += "Restaurant name 🍴: "
-        txt += str(restaurants[num].name) + "\n"
+        txt += str(restaurant.name) + "\n"
         txt += "Restaurant address 🗺: "
-        txt += str(restaurants[num].addresses_road_name)
+        txt += str(restaurant.addresses_road_name)
         txt += ", "
         add: str
-        add = str(int(restaurants[num].addresses_start_street_number))
+        add = str(int(restaurant.addresses_start_street_number))
         txt += add  # This is done to respect pycodestyle format.
         txt += "\n"
         txt += "Restaurant district 🗺: "
-        txt += str(restaurants[num].addresses_district_name) + '\n'
+        txt += str(restaurant.addresses_district_name) + '\n'
         txt += "Restaurant phone number ☎️: "
-        txt += str(restaurants[num].values_value) + "\n"
+        txt += str(restaurant.values_value) + "\n"
         txt += "\nRemeber, "
         txt += "I need your location to guide you to this restaurant."
         update.message.reply_text(txt)
@@ -264,51 +605,70 @@ def where(update: Update, context: CallbackContext):
                                                             lat))
     user_id = update.effective_chat.id
     context.user_data[user_id]['Coordinates'] = [lon, lat]
+    guides.discard(user_id)  # The prefetched routes start elsewhere.
+    persist_user(update, context)
 
 
-def guide(update: Update, context: CallbackContext):
-    """Calculates the fastest route in terms of time from user's location to
-    the chosen restaurant location (restaurant is chosen with its
-    number (index) that appears in the list of results obtained with the
-    /find command.). Sends a photo with the route drawn on a map of the
-    City graph."""
+def route_request(update: Update,
+                  context: CallbackContext) -> Optional[Tuple[city.Coord,
+                                                              int]]:
+    """Checks the request of a route (/guide, /steps and /routes): the user
+    must have sent their location and the first argument must be the number
+    (index) of a restaurant of the list of results obtained with the /find
+    command.
+    Returns the location of the user and the index of the restaurant, or
+    None if the user has been told what is missing. Raises an exception if
+    the argument is not a number of the list."""
 
     verify_user(update, context)
     user_id = update.effective_chat.id
     lon, lat = context.user_data[user_id]['Coordinates']
-    restaurants = context.user_data[user_id]['User restaurants']
 
     if lon == 0.0 and lat == 0.0:
         update.message.reply_text("You need to send me your location first.\nPlease")
         context.bot.send_message(chat_id=update.effective_chat.id, text="😖")
-        return
+        return None
 
-    try:
-        if int(context.args[0]) <= 0:
-            update.message.reply_text("Index must be a positive integer.")
-            context.bot.send_message(chat_id=update.effective_chat.id, text="🤯")
-            return
-        num = int(context.args[0]) - 1
+    if int(context.args[0]) <= 0:
+        update.message.reply_text("Index must be a positive integer.")
+        context.bot.send_message(chat_id=update.effective_chat.id, text="🤯")
+        return None
+    num = int(context.args[0]) - 1
 
-        update.message.reply_text("Give me just a sec...")
+    user_restaurants = get_user_restaurants(update, context)
+    return [lon, lat], user_restaurants[num]
 
-        # User and restaurant location.
-        src: city.Coord = [lon, lat]
-        dst_lat = restaurants[num].latitude
-        dst_lon = restaurants[num].longitude
-        dst: city.Coord = [float(dst_lon), float(dst_lat)]
 
-        path: city.Path = city.find_path(Streets, City, src, dst)
-        path_edges: List[Tuple[city.NodeID]] = city.get_edges_from_path(path)
+def guide(update: Update, context: CallbackContext):
+    """Calculates the fastest route in terms of time from user's location to
+    the chosen restaurant location (restaurant is chosen with its
+    number (index) that appears in the list of results obtained with the
+    /find command.). Sends a photo with the route drawn on a map of the
+    City graph."""
 
-        city.plot_path(City, path, 'path.png', path_edges)  # path image generated.
-        context.bot.send_photo(chat_id=update.effective_chat.id,
-                               photo=open('path.png', 'rb'))
+    try:
+        # User location and restaurant.
+        request = route_request(update, context)
+        if request is None:
+            return
+        src, index = request
+        user_id = update.effective_chat.id
+
+        # The route may have been prefetched by /info (and may be still
+        # being computed).
+        prefetched = guides.claim(user_id, guide_key(src, index))
+        if prefetched is None or not prefetched.done():
+            update.message.reply_text("Give me just a sec...")
+        if prefetched is None:
+            minutes, image, directions = route_image(src, index)
+        else:
+            minutes, image, directions = prefetched.result()
+
+        context.bot.send_photo(chat_id=update.effective_chat.id, photo=image)
 
-        time: float = city.travel_time(City)
-        city.remove_src_and_dst_nodes(City)
         context.bot.send_message(chat_id=update.effective_chat.id, text="You: 🔴, Restaurant: 🟣")
-        txt: str = "Estimated time of %s min.\nGood luck!" % int(time)
+        context.bot.send_message(chat_id=update.effective_chat.id, text=directions)
+        txt: str = "Estimated time of %s min.\nGood luck!" % int(minutes)
         context.bot.send_message(chat_id=update.effective_chat.id, text=txt)
 
     except Exception as e:
@@ -317,6 +677,57 @@ def guide(update: Update, context: CallbackContext):
         context.bot.send_message(chat_id=update.effective_chat.id, text="🤯")
 
 
+def steps(update: Update, context: CallbackContext):
+    """Same as guide, but only sends the step by step directions of the
+    route (streets to walk along, accesses and metro lines), without drawing
+    the map."""
+
+    try:
+        request = route_request(update, context)
+        if request is None:
+            return
+        src, index = request
+        net: Network = network
+        _, path, _ = restaurant_route(net, src, index)
+        update.message.reply_text(route_directions(net, path))
+
+    except Exception as e:
+        error = str(e)
+        update.message.reply_text(error)
+        context.bot.send_message(chat_id=update.effective_chat.id, text="🤯")
+
+
+def routes(update: Update, context: CallbackContext):
+    """Sends the step by step directions of the alternative routes to the
+    chosen restaurant (the fastest one, and the ones that walk less or
+    change lines fewer times), only through accessible accesses if the
+    second argument is 'accessible'."""
+
+    try:
+        request = route_request(update, context)
+        if request is None:
+            return
+        src, index = request
+        accessible_only: bool = context.args[1:2] == ['accessible']
+        net: Network = network
+        found = restaurant_routes(net, src, index, accessible_only)
+        if not found:
+            update.message.reply_text("I could not find any route.")
+            context.bot.send_message(chat_id=update.effective_chat.id, text="😖")
+            return
+
+        for number, route in enumerate(found, 1):
+            context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text=route_summary(number, route) + "\n\n" +
+                route_directions(net, route.path))
+
+    except Exception as e:
+        error = str(e)
+        update.message.reply_text(error)
+        context.bot.send_message(chat_id=update.effective_chat.id, text="🤯")
+
+
 def unknown_text(update: Update, context: CallbackContext):
     """Send an error message to the user in case of receiving an
     unrecognized message."""
@@ -333,19 +744,58 @@ def unknown(update: Update, context: CallbackContext):
         "Sorry %s is not a valid command" % update.message.text)
 
 
-updater.dispatcher.add_handler(CommandHandler('start', start))
-updater.dispatcher.add_handler(CommandHandler('help', help))
-updater.dispatcher.add_handler(CommandHandler('find', find))
-updater.dispatcher.add_handler(CommandHandler('info', info))
-updater.dispatcher.add_handler(CommandHandler('guide', guide))
-updater.dispatcher.add_handler(CommandHandler('author', author))
+def add_handlers(dispatcher: Dispatcher) -> None:
+    """Adds the handlers of all the commands and messages of the bot to the
+    dispatcher."""
+
+    dispatcher.add_handler(CommandHandler('start', start))
+    dispatcher.add_handler(CommandHandler('help', help))
+    dispatcher.add_handler(CommandHandler('find', find))
+    dispatcher.add_handler(CommandHandler('info', info))
+    dispatcher.add_handler(CommandHandler('guide', guide, run_async=True))
+    dispatcher.add_handler(CommandHandler('steps', steps, run_async=True))
+    dispatcher.add_handler(CommandHandler('routes', routes, run_async=True))
+    dispatcher.add_handler(CommandHandler('author', author))
+
+    dispatcher.add_handler(MessageHandler(Filters.location, where))
+    dispatcher.add_handler(MessageHandler(Filters.text, unknown))
+    dispatcher.add_handler(MessageHandler(Filters.command, unknown))
+    dispatcher.add_handler(MessageHandler(Filters.text, unknown_text))
+
+    dispatcher.add_handler(CallbackQueryHandler(queryHandler))
+
+
+def build_base_layer(context: CallbackContext) -> None:
+    """Renders the tiles of the base layer that are not stored yet (only if
+    PRERENDER_TILES). It takes long the first time, so it runs as a job
+    while the bot answers (the tiles needed meanwhile are rendered on
+    demand)."""
+
+    Base.build()
+
+
+def main() -> None:
+    """Starts the bot and keeps it running until it is interrupted."""
+
+    global users
+    users = storage.SQLiteUserStore(USERS_FILE, dataset_fingerprint)
+    TOKEN = open('token.txt').read().strip()
+    updater = Updater(token=TOKEN, use_context=True)
+    add_handlers(updater.dispatcher)
+
+    updater.job_queue.run_repeating(evict_inactive_users,
+                                    interval=EVICTION_INTERVAL,
+                                    first=EVICTION_INTERVAL)
+    if PRERENDER_TILES:
+        updater.job_queue.run_once(build_base_layer, when=0)
+    updater.job_queue.run_repeating(refresh_job, interval=REFRESH_INTERVAL,
+                                    first=0)
 
-updater.dispatcher.add_handler(MessageHandler(Filters.location, where))
-updater.dispatcher.add_handler(MessageHandler(Filters.text, unknown))
-updater.dispatcher.add_handler(MessageHandler(Filters.command, unknown))
-updater.dispatcher.add_handler(MessageHandler(Filters.text, unknown_text))
+    updater.start_polling()
+    updater.idle()
+    guides.shutdown()
+    users.close()
 
-updater.dispatcher.add_handler(CallbackQueryHandler(queryHandler))
 
-updater.start_polling()
-updater.idle()
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,15 @@
 import os
-import metro
 import networkx
+import atomicfile
+import numpy as np
 import osmnx as ox
 import pickle as pk
 from cmath import inf
 import matplotlib.pyplot as plt
-from typing import List, Tuple, Union
+from enum import IntEnum
+from dataclasses import dataclass, field
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple, Union
+from PIL import Image, ImageDraw
 from typing_extensions import TypeAlias
 from staticmap import StaticMap, CircleMarker, Line
 
@@ -32,36 +36,362 @@ OsmnxGraph: TypeAlias = networkx.MultiDiGraph
 
 Coord = Tuple[float, float]  # (latitude, longitude)
 
+# Parameters of the OSM map images: size of the tiles, greatest zoom level,
+# size of the images and margin left around the drawn features (pixels).
+TILE_SIZE: int = 256
+MAX_ZOOM: int = 17
+MAP_SIZE: int = 1000
+MAP_PADDING: int = 20
+
+# Greatest distance (pixels of the image) between a drawn path and the
+# simplified line that replaces it.
+SIMPLIFY_TOLERANCE: float = 1.0
+
+# Attributes of the OSM edges that are copied into the City graph.
+STREET_ATTRIBUTES: Tuple[str, ...] = ('length', 'name', 'osmid')
+
+# Attributes of the Streets that replace a chain of contracted crossings:
+# the crossings (in order from 'via_from') and the travel time from
+# 'via_from' to each of them.
+CHAIN_ATTRIBUTES: Tuple[str, ...] = ('via', 'via_from', 'offsets')
+
+
+@dataclass
+class OsmnxDiff:
+    """Representation of the differences between two OSM graphs. Nodes that
+    have been moved and edges whose attributes have changed are considered
+    as added, since they have to be (re)inserted."""
+
+    added_nodes: Dict[NodeID, Dict] = field(default_factory=dict)
+    removed_nodes: List[NodeID] = field(default_factory=list)
+    added_edges: List[Tuple[NodeID, NodeID, int, Dict]] = field(
+        default_factory=list)
+    removed_edges: List[Tuple[NodeID, NodeID, int]] = field(
+        default_factory=list)
+
+    def is_empty(self) -> bool:
+        """Returns True if both graphs are the same."""
+
+        return not (self.added_nodes or self.removed_nodes or
+                    self.added_edges or self.removed_edges)
+
+
+@dataclass
+class ContractedCrossing:
+    """Crossing of the Streets graph removed from the City graph by
+    contract_chains. It lies on the Street between u and v of the City
+    graph, at the given position of its 'via' list (u is its 'via_from')."""
+
+    u: NodeID
+    v: NodeID
+    index: int
+    pos: Coord
+
+
+class NodeType(IntEnum):
+    """Types of the nodes of the City graph."""
+
+    START = 0
+    DESTINATION = 1
+    CROSSING = 2
+    STATION = 3
+    ACCESS = 4
+
+
+# Names of the node types, as stored in the 'type' attribute of the nodes.
+NODE_TYPE_NAMES: Dict[NodeType, str] = {NodeType.START: "Start",
+                                        NodeType.DESTINATION: "Destination",
+                                        NodeType.CROSSING: "Crossing",
+                                        NodeType.STATION: "Station",
+                                        NodeType.ACCESS: "Access"}
+NODE_TYPES: Dict[str, NodeType] = {name: node_type for node_type, name
+                                   in NODE_TYPE_NAMES.items()}
+
+# Node attributes that are moved into the NodeRegistry.
+REGISTRY_ATTRIBUTES: Tuple[str, ...] = ('type', 'pos', 'color')
+
+
+@dataclass
+class NodeRegistry:
+    """Compact representation of the nodes of a City graph. Every node (OSM
+    crossings, stations, accesses and the source and destination nodes 1
+    and 2) gets a dense int32 id, which indexes the arrays of types,
+    coordinates and colors. The source and destination always get the ids
+    0 and 1, even if they are not in the graph."""
+
+    ids: List[NodeID]  # External id of each dense id.
+    index: Dict[NodeID, int]  # Dense id of each external id.
+    types: np.ndarray  # int8 array of NodeType.
+    coords: np.ndarray  # float64 (N, 2) array of positions.
+    colors: np.ndarray  # uint8 array of indices into palette.
+    palette: List[str]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, node: NodeID) -> bool:
+        return node in self.index
+
+    def dense(self, node: NodeID) -> int:
+        """Returns the dense id of the node."""
+
+        return self.index[node]
+
+    def external(self, i: int) -> NodeID:
+        """Returns the original id of the node with dense id i."""
+
+        return self.ids[i]
+
+    def pos(self, node: NodeID) -> Coord:
+        """Returns the position of the node."""
+
+        x, y = self.coords[self.index[node]]
+        return (float(x), float(y))
+
+    def color(self, node: NodeID) -> str:
+        """Returns the color of the node."""
+
+        return self.palette[self.colors[self.index[node]]]
+
+    def type(self, node: NodeID) -> str:
+        """Returns the name of the type of the node."""
+
+        return NODE_TYPE_NAMES[NodeType(self.types[self.index[node]])]
+
+    def nearest(self, coord: Coord, node_type: NodeType) -> NodeID:
+        """Returns the node of the given type nearest to coord (using an
+        equirectangular approximation, enough at the scale of a city)."""
+
+        candidates = np.flatnonzero(self.types == node_type)
+        lon, lat = coord
+        dx = (self.coords[candidates, 0] - lon) * np.cos(np.radians(lat))
+        dy = self.coords[candidates, 1] - lat
+        return self.ids[candidates[np.argmin(dx * dx + dy * dy)]]
+
+
+def build_node_registry(g: CityGraph) -> NodeRegistry:
+    """Returns the NodeRegistry of the nodes of the graph g."""
+
+    ids: List[NodeID] = [1, 2]
+    ids.extend(node for node in g if node != 1 and node != 2)
+    n: int = len(ids)
+
+    types = np.empty(n, dtype=np.int8)
+    coords = np.full((n, 2), np.nan, dtype=np.float64)
+    colors = np.zeros(n, dtype=np.uint8)
+    palette: List[str] = ["#000000"]
+    palette_index: Dict[str, int] = {"#000000": 0}
+
+    types[0] = NodeType.START
+    types[1] = NodeType.DESTINATION
+    for i in range(n):
+        node: NodeID = ids[i]
+        if node not in g:  # Source or destination outside the graph.
+            continue
+        types[i] = NODE_TYPES[node_type(g, node)]
+        coords[i] = node_pos(g, node)
+        color: str = node_color(g, node)
+        if color not in palette_index:
+            palette_index[color] = len(palette)
+            palette.append(color)
+        colors[i] = palette_index[color]
+
+    index: Dict[NodeID, int] = {ids[i]: i for i in range(n)}
+    return NodeRegistry(ids, index, types, coords, colors, palette)
+
+
+def compact_node_attributes(g: CityGraph) -> NodeRegistry:
+    """Moves the type, position and color of the nodes of g into a
+    NodeRegistry stored as the 'registry' graph attribute, removing them
+    from the per node attribute dictionaries. Nodes added afterwards (such
+    as the source and destination) keep their own attributes. Returns the
+    registry."""
+
+    registry: NodeRegistry = build_node_registry(g)
+    for node, attr in g.nodes(data=True):
+        if node != 1 and node != 2:
+            # The dictionary is cleared (and not just popped) so that its
+            # memory is released.
+            remaining: Dict = {key: value for key, value in attr.items()
+                               if key not in REGISTRY_ATTRIBUTES}
+            attr.clear()
+            attr.update(remaining)
+    g.graph['registry'] = registry
+    return registry
+
+
+def node_attribute(g: CityGraph, node: NodeID, attribute: str):
+    """Returns the attribute of the node, looking for it in the registry of
+    g if it was moved there. Crossings contracted into Streets are also
+    accepted."""
+
+    if node not in g:
+        crossing: ContractedCrossing = g.graph['contracted'][node]
+        return {'type': "Crossing", 'pos': crossing.pos,
+                'color': "#2DBF11"}[attribute]
+
+    attr: Dict = g.nodes[node]
+    if attribute in attr:
+        return attr[attribute]
+    registry: NodeRegistry = g.graph['registry']
+    return getattr(registry, attribute)(node)
+
+
+def node_pos(g: CityGraph, node: NodeID) -> Coord:
+    """Returns the position of the node of g."""
+
+    return node_attribute(g, node, 'pos')
+
+
+def node_color(g: CityGraph, node: NodeID) -> str:
+    """Returns the color of the node of g."""
+
+    return node_attribute(g, node, 'color')
+
+
+def node_type(g: CityGraph, node: NodeID) -> str:
+    """Returns the name of the type of the node of g."""
+
+    return node_attribute(g, node, 'type')
+
 
 def show(g: CityGraph) -> None:
     """Opens a new window showing the graphic representation of the
     given graph g."""
 
-    networkx.draw(g, pos=networkx.get_node_attributes(g, 'pos'),
+    networkx.draw(g, pos={node: node_pos(g, node) for node in g},
                   with_labels=False, node_size=5)
     plt.show()
 
 
+def to_pixels(coords: np.ndarray, zoom: int) -> np.ndarray:
+    """Transforms an (N, 2) array of (longitude, latitude) coordinates into
+    the pixel coordinates of the OSM world map at the given zoom."""
+
+    scale: float = TILE_SIZE * 2.0 ** zoom
+    lat = np.radians(coords[:, 1])
+    pixels = np.empty((len(coords), 2), dtype=np.float64)
+    pixels[:, 0] = (coords[:, 0] + 180.0) / 360.0 * scale
+    pixels[:, 1] = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) \
+        / 2 * scale
+    return pixels
+
+
+def to_coord(pixel: np.ndarray, zoom: int) -> Coord:
+    """Transforms the pixel coordinates of the OSM world map at the given
+    zoom into (longitude, latitude) coordinates."""
+
+    scale: float = TILE_SIZE * 2.0 ** zoom
+    lon: float = pixel[0] / scale * 360.0 - 180.0
+    lat: float = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * pixel[1] /
+                                                       scale))))
+    return (float(lon), float(lat))
+
+
+def fit_zoom(coords: np.ndarray, width: int, height: int) -> int:
+    """Returns the greatest zoom at which all the coordinates fit in an image
+    of the given size, leaving MAP_PADDING pixels around them."""
+
+    for zoom in range(MAX_ZOOM, -1, -1):
+        extent = np.ptp(to_pixels(coords, zoom), axis=0)
+        if extent[0] <= width - 2 * MAP_PADDING and \
+                extent[1] <= height - 2 * MAP_PADDING:
+            return zoom
+    return 0
+
+
+def douglas_peucker(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Returns the mask of the points of a polyline that are kept when it is
+    simplified with the Douglas-Peucker algorithm, so that the simplified
+    line is never further than tolerance from the original one."""
+
+    keep = np.zeros(len(points), dtype=np.bool_)
+    keep[0] = keep[-1] = True
+    stack: List[Tuple[int, int]] = [(0, len(points) - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        inner = points[first + 1:last]
+        direction = end - start
+        length: float = np.hypot(direction[0], direction[1])
+        if length == 0:
+            distances = np.hypot(inner[:, 0] - start[0],
+                                 inner[:, 1] - start[1])
+        else:
+            distances = np.abs(direction[0] * (inner[:, 1] - start[1]) -
+                               direction[1] * (inner[:, 0] - start[0])) \
+                / length
+        farthest: int = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle: int = first + 1 + farthest
+            keep[middle] = True
+            stack.append((first, middle))
+            stack.append((middle, last))
+
+    return keep
+
+
+def merge_path_lines(g: CityGraph, edges_from_path: List[Tuple[NodeID]]
+                     ) -> List[Tuple[str, List[Coord]]]:
+    """Merges the consecutive edges of a path that have the same color into
+    polylines. Returns the list of (color, coordinates) of the polylines."""
+
+    polylines: List[Tuple[str, List[Coord]]] = []
+    for u, v in edges_from_path:
+        color: str = g[u][v]['color']
+        coords: List[Coord] = [node_pos(g, node)
+                               for node in street_nodes(g, u, v)]
+        if polylines and polylines[-1][0] == color:
+            polylines[-1][1].extend(coords[1:])
+        else:
+            polylines.append((color, coords))
+    return polylines
+
+
 def plot(g: CityGraph, filename: str) -> None:
     """Prints the graph g in a map of Open Street Map,
-    saving the result in a png named 'filename'."""
-
-    # The OSM default world map.
-    map = StaticMap(1000, 1000,
+    saving the result in a png named 'filename'. Instead of adding every
+    node and edge as a staticmap feature, only the OSM tiles are rendered
+    by staticmap and the graph is rasterized directly over them."""
+
+    nodes: List[NodeID] = list(g.nodes)
+    index: Dict[NodeID, int] = {node: i for i, node in enumerate(nodes)}
+    coords = np.array([node_pos(g, node) for node in nodes],
+                      dtype=np.float64)
+
+    zoom: int = fit_zoom(coords, MAP_SIZE, MAP_SIZE)
+    pixels = to_pixels(coords, zoom)
+    center = (pixels.min(axis=0) + pixels.max(axis=0)) / 2
+    pixels = np.rint(pixels - center + MAP_SIZE / 2).astype(np.int32)
+
+    # The OSM default world map, centered on the graph.
+    map = StaticMap(MAP_SIZE, MAP_SIZE,
                     url_template='http://a.tile.osm.org/{z}/{x}/{y}.png')
+    image: Image.Image = map.render(zoom=zoom,
+                                    center=list(to_coord(center, zoom)))
+    draw = ImageDraw.Draw(image)
+
+    # The edges of g (with the crossings contracted into them).
+    for u, v, eattr in g.edges(data=True):
+        if 'via' in eattr:
+            street = np.array([node_pos(g, node)
+                               for node in street_nodes(g, u, v)])
+            points: List[Tuple] = [tuple(point) for point in np.rint(
+                to_pixels(street, zoom) - center + MAP_SIZE / 2)]
+        else:
+            points = [tuple(pixels[index[u]]), tuple(pixels[index[v]])]
+        draw.line(points, fill=eattr['color'], width=2)
+
+    # The nodes of g, one call for each color.
+    colors: Dict[str, List[int]] = {}
+    for i, node in enumerate(nodes):
+        colors.setdefault(node_color(g, node), []).append(i)
+    for color, members in colors.items():
+        draw.point([tuple(p) for p in pixels[members]], fill=color)
 
-    # The nodes of g.
-    for node in list(g.nodes):
-        marker = CircleMarker(g.nodes[node]['pos'], g.nodes[node]['color'], 1)
-        map.add_marker(marker)
-
-    # The edges of g.
-    for edge in list(g.edges):
-        coordinates: Tuple = (g.nodes[edge[0]]['pos'], g.nodes[edge[1]]['pos'])
-        line = Line(coordinates, g[edge[0]][edge[1]]['color'], 2)
-        map.add_line(line)
-
-    image = map.render()
     image.save(filename)
 
 
@@ -79,39 +409,47 @@ def get_edges_from_path(path: Path) -> List[Tuple[NodeID]]:
     return edges_from_path
 
 
-def plot_path(g: CityGraph, p: Path, filename: str,
+def plot_path(g: CityGraph, p: Path, filename: Union[str, BinaryIO],
               edges_from_path: List[Tuple[NodeID]]) -> None:
     """Given a path p of the graph g, the function shows the path in a map
-    and stores it in the file filename."""
+    and stores it as a PNG image in the file filename (a name or a binary
+    file object)."""
 
     # The OSM default world map.
-    map = StaticMap(1000, 1000,
+    map = StaticMap(MAP_SIZE, MAP_SIZE,
                     url_template='http://a.tile.osm.org/{z}/{x}/{y}.png')
 
     # The starting point is added in red with a white border.
-    starting_point_1 = CircleMarker(g.nodes[p[0]]['pos'],
+    starting_point_1 = CircleMarker(node_pos(g, p[0]),
                                     "#FFFFFF", 20)
-    starting_point_2 = CircleMarker(g.nodes[p[0]]['pos'],
+    starting_point_2 = CircleMarker(node_pos(g, p[0]),
                                     "#FF0000", 15)
     map.add_marker(starting_point_1)
     map.add_marker(starting_point_2)
 
     # The destination point is added in purple with a white border.
-    destination_1 = CircleMarker(g.nodes[p[-1]]['pos'],
+    destination_1 = CircleMarker(node_pos(g, p[-1]),
                                  "#FFFFFF", 20)
-    destination_2 = CircleMarker(g.nodes[p[-1]]['pos'],
+    destination_2 = CircleMarker(node_pos(g, p[-1]),
                                  "#800080", 15)
     map.add_marker(destination_1)
     map.add_marker(destination_2)
 
-    # The edges of the path.
-    for edge in edges_from_path:
-        coordinates: Tuple = (g.nodes[edge[0]]['pos'], g.nodes[edge[1]]['pos'])
-        line = Line(coordinates, g[edge[0]][edge[1]]['color'], 6)
-        map.add_line(line)
+    # The edges of the path, merged into polylines of the same color and
+    # simplified at the zoom the map will be drawn with.
+    polylines: List[Tuple[str, List[Coord]]] = merge_path_lines(
+        g, edges_from_path)
+    coords = np.array([node_pos(g, node) for node in p], dtype=np.float64)
+    zoom: int = fit_zoom(coords, MAP_SIZE, MAP_SIZE)
+    for color, coordinates in polylines:
+        keep = douglas_peucker(
+            to_pixels(np.array(coordinates, dtype=np.float64), zoom),
+            SIMPLIFY_TOLERANCE)
+        kept: List[Coord] = [coordinates[i] for i in np.flatnonzero(keep)]
+        map.add_line(Line(kept, color, 6))
 
-    image = map.render()
-    image.save(filename)
+    image = map.render(zoom=zoom)
+    image.save(filename, format='PNG')
 
 
 def load_osmnx_graph(filename: str) -> OsmnxGraph:
@@ -126,11 +464,21 @@ def load_osmnx_graph(filename: str) -> OsmnxGraph:
 
 
 def save_osmnx_graph(g: OsmnxGraph, filename: str) -> None:
-    """Saves the City graph g into a given file."""
+    """Saves the City graph g into a given file. The graph is first written
+    into a temporary file that then replaces the given one, so the file is
+    never left half written."""
+
+    with atomicfile.atomic_write(filename) as city_file:  # binary mode.
+        pk.dump(g, city_file)
 
-    city_file = open(filename, 'ab')  # destination file in binary mode.
-    pk.dump(g, city_file)
-    city_file.close()
+
+def remove_geometry(g: OsmnxGraph) -> None:
+    """Removes the geometry attribute from the edges of the graph g, since it
+    won't be of any use."""
+
+    for u, v, key, geom in g.edges(data="geometry", keys=True):
+        if geom is not None:
+            del(g[u][v][key]["geometry"])
 
 
 def get_osmnx_graph() -> OsmnxGraph:
@@ -142,37 +490,90 @@ def get_osmnx_graph() -> OsmnxGraph:
     else:
         City = ox.graph_from_place("Barcelona", network_type='walk',
                                    simplify=True)
-
-        # Remove the geometry attribute from the nodes of the graph, since it
-        # won't be of any use.
-        for u, v, key, geom in City.edges(data="geometry", keys=True):
-            if geom is not None:
-                del(City[u][v][key]["geometry"])
-
+        remove_geometry(City)
         save_osmnx_graph(City, "./barcelona.grf")
 
     return City
 
 
+def read_osm_extract(filename: str) -> OsmnxGraph:
+    """Reads a local OSM extract (.osm XML file) of the walking network and
+    returns it as a simplified graph without geometries. PBF extracts have
+    to be converted to XML first (e.g. with 'osmium cat')."""
+
+    if filename.endswith('.pbf'):
+        raise ValueError("PBF extracts are not supported, convert %s to "
+                         ".osm first." % filename)
+
+    g: OsmnxGraph = ox.graph_from_xml(filename, simplify=True)
+    remove_geometry(g)
+    return g
+
+
+def diff_osmnx_graphs(old: OsmnxGraph, new: OsmnxGraph) -> OsmnxDiff:
+    """Returns the differences needed to transform the graph old into the
+    graph new."""
+
+    diff = OsmnxDiff()
+
+    for node, attr in new.nodes(data=True):
+        if node not in old or (old.nodes[node]['x'], old.nodes[node]['y']) \
+                != (attr['x'], attr['y']):
+            diff.added_nodes[node] = attr
+    diff.removed_nodes = [node for node in old if node not in new]
+
+    for u, v, key, attr in new.edges(keys=True, data=True):
+        if not old.has_edge(u, v, key) or \
+                street_attributes(old[u][v][key]) != street_attributes(attr):
+            diff.added_edges.append((u, v, key, attr))
+    for u, v, key in old.edges(keys=True):
+        if not new.has_edge(u, v, key):
+            diff.removed_edges.append((u, v, key))
+
+    return diff
+
+
+def street_attributes(eattr: Dict) -> Tuple:
+    """Returns the attributes of an OSM edge that matter to the City
+    graph."""
+
+    return tuple(eattr.get(attribute) for attribute in STREET_ATTRIBUTES)
+
+
 def connect_access_to_street(g1: OsmnxGraph, g2: MetroGraph) -> None:
     """Connects the Metro accesses to their respective Streets,
     using the two given graphs g1 and g2."""
 
+    # The accesses are taken from g2 instead of reading them again.
+    connect_accesses(g1, g2, [node for node in g2
+                              if node_type(g2, node) == "Access"])
+
+
+def connect_accesses(g1: OsmnxGraph, g2: MetroGraph,
+                     fids: List[str]) -> None:
+    """Connects the given Metro accesses of g2 to their nearest crossing of
+    the Streets graph g1, replacing their previous connection if any."""
+
+    if not fids:
+        return
+
     lon: List = []
     lat: List = []
-    accesses: metro.Accesses = metro.read_accesses()
 
-    for access in accesses:
-        lon.append(access.geometry[0])
-        lat.append(access.geometry[1])
+    for fid in fids:
+        lon.append(node_pos(g2, fid)[0])
+        lat.append(node_pos(g2, fid)[1])
 
     # Tuple with a list of the nearest nodes and a list with the
     # distance to them.
     connections: Tuple = ox.distance.nearest_nodes(g1, lon, lat,
                                                    return_dist=True)
     a: int = 0
-    while a < 352:
-        g2.add_edge(connections[0][a], accesses[a].fid,
+    while a < len(fids):
+        crossing = access_crossing(g2, fids[a])
+        if crossing is not None:
+            g2.remove_edge(crossing, fids[a])
+        g2.add_edge(connections[0][a], fids[a],
                     type="Access entry",
                     distance=connections[1][a],
                     speed=100,
@@ -181,9 +582,58 @@ def connect_access_to_street(g1: OsmnxGraph, g2: MetroGraph) -> None:
         a += 1
 
 
-def build_city_graph(g1: OsmnxGraph, g2: MetroGraph) -> CityGraph:
+def access_crossing(g: CityGraph, fid: str) -> Union[NodeID, None]:
+    """Returns the crossing the access fid is connected to in the graph g,
+    or None if it is not connected to the Streets."""
+
+    for node, eattr in g[fid].items():
+        if eattr['type'] == "Access entry":
+            return node
+    return None
+
+
+def add_crossing(g1: OsmnxGraph, g2: CityGraph, cross: NodeID) -> None:
+    """Adds the node cross of g1 as a Crossing of g2."""
+
+    coordinates: Coord = (g1.nodes[cross]['x'], g1.nodes[cross]['y'])
+    g2.add_node(cross,
+                type="Crossing",
+                pos=coordinates,
+                color="#2DBF11")
+
+
+def add_street(g2: CityGraph, prev_cross: NodeID, post_cross: NodeID,
+               eattr: Dict) -> None:
+    """Adds the Street between the two crossings to g2, with the given OSM
+    edge attributes."""
+
+    street_name: str = "No name registered"
+    if 'name' in eattr:  # some Streets don't have a name.
+        street_name = eattr['name']
+
+    g2.add_edge(prev_cross, post_cross,
+                type="Street",
+                distance=eattr['length'],
+                speed=100,
+                name=street_name,
+                osm_id=eattr['osmid'],
+                travel_time=eattr['length']/100,
+                color="#000000")
+
+
+def shortest_street(edgesdict: Dict) -> Dict:
+    """Returns the attributes of the shortest of the parallel OSM edges in
+    edgesdict (a dictionary of keys to attributes)."""
+
+    return min(edgesdict.values(), key=lambda eattr: eattr['length'])
+
+
+def build_city_graph(g1: OsmnxGraph, g2: MetroGraph,
+                     reduce: bool = True) -> CityGraph:
     """Merges g1 into g2, modifying the attributes of the nodes and edges of
-    g1. Returns g2 merged with g1."""
+    g1. Returns g2 merged with g1. Between two crossings, only the shortest
+    of the OSM edges (in any direction) is kept. If reduce is True, the
+    graph is reduced with reduce_city_graph."""
 
     # The reason that all the data from g1 to g2 is read is because in this
     # way the nodes and arrests of g1 are purified and only added with the
@@ -193,40 +643,309 @@ def build_city_graph(g1: OsmnxGraph, g2: MetroGraph) -> CityGraph:
     # prev_cross and post_cross are crossings of Streets, i.e. nodes of the
     # OsmnxGraph.
     for prev_cross, nbrsdict in g1.adjacency():
-        coordinates: Coord = (g1.nodes[prev_cross]['x'],
-                              g1.nodes[prev_cross]['y'])
-        g2.add_node(prev_cross,
-                    type="Crossing",
-                    pos=coordinates,
-                    color="#2DBF11")
+        add_crossing(g1, g2, prev_cross)
 
         for post_cross, edgesdict in nbrsdict.items():
-            coordinates = (g1.nodes[post_cross]['x'],
-                           g1.nodes[post_cross]['y'])
-            g2.add_node(post_cross,
-                        type="Crossing",
-                        pos=coordinates,
-                        color="#2DBF11")
-
-            eattr = edgesdict[0]  # first edge attributes.
-            street_name: str = "No name registered"
-            if 'name' in eattr:  # some Streets don't have a name.
-                street_name = eattr['name']
-
-            if prev_cross != post_cross:
-                g2.add_edge(prev_cross, post_cross,
-                            type="Street",
-                            distance=eattr['length'],
-                            speed=100,
-                            name=street_name,
-                            osm_id=eattr['osmid'],
-                            travel_time=eattr['length']/100,
-                            color="#000000")
+            add_crossing(g1, g2, post_cross)
+
+            eattr = shortest_street(edgesdict)
+            if prev_cross != post_cross and \
+                    (not g2.has_edge(prev_cross, post_cross) or
+                     eattr['length'] < g2[prev_cross][post_cross]['distance']):
+                add_street(g2, prev_cross, post_cross, eattr)
 
     connect_access_to_street(g1, g2)
+    if reduce:
+        reduce_city_graph(g2)
     return g2
 
 
+def prune_components(g: CityGraph) -> List[NodeID]:
+    """Removes from g the connected components without any Station, i.e. the
+    crossings that can not be reached from the metro (nor from the crossings
+    that can). Returns the removed nodes."""
+
+    removed: List[NodeID] = []
+    for component in list(networkx.connected_components(g)):
+        if not any(node_type(g, node) == "Station" for node in component):
+            removed.extend(component)
+    g.remove_nodes_from(removed)
+    return removed
+
+
+def contractible(g: CityGraph, node: NodeID) -> bool:
+    """Returns True if the node is a Crossing of g in the middle of a Street:
+    with exactly two Streets and nothing else."""
+
+    return node in g and node_type(g, node) == "Crossing" and \
+        len(g[node]) == 2 and \
+        all(eattr['type'] == "Street" for eattr in g[node].values())
+
+
+def chain_from(g: CityGraph, node: NodeID, nbr: NodeID) -> Path:
+    """Returns the contractible crossings met walking from node towards its
+    neighbour nbr, followed by the first one that is not contractible (or
+    by node itself if the chain is a cycle)."""
+
+    chain: Path = []
+    prev: NodeID = node
+    while contractible(g, nbr) and nbr != node:
+        chain.append(nbr)
+        prev, nbr = nbr, next(n for n in g[nbr] if n != prev)
+    chain.append(nbr)
+    return chain
+
+
+def contract_chains(g: CityGraph) -> Dict[NodeID, ContractedCrossing]:
+    """Replaces every chain of crossings of g in the middle of a Street by a
+    single Street between its ends, with the sum of the distances and travel
+    times. The contracted crossings are recorded in the new Street (see
+    CHAIN_ATTRIBUTES) and returned. Chains that are cycles, or whose ends
+    are already joined by another Street, are not contracted."""
+
+    contracted: Dict[NodeID, ContractedCrossing] = {}
+    kept: Set[NodeID] = set()  # Crossings of chains not contracted.
+    for node in list(g):
+        if node in contracted or node in kept or not contractible(g, node):
+            continue
+
+        first, second = g[node]
+        left: Path = chain_from(g, node, first)
+        right: Path = chain_from(g, node, second)
+        u: NodeID = left.pop()
+        v: NodeID = right.pop()
+        via: Path = left[::-1] + [node] + right
+        if u == node or u == v or g.has_edge(u, v):
+            kept.update(via)
+            continue
+
+        offsets: List[float] = []
+        distance: float = 0.0
+        time: float = 0.0
+        longest: Dict = {}
+        osm_ids: List = []
+        for a, b in get_edges_from_path([u] + via + [v]):
+            eattr: Dict = g[a][b]
+            distance += eattr['distance']
+            time += eattr['travel_time']
+            offsets.append(time)
+            osm_ids.append(eattr['osm_id'])
+            if not longest or eattr['distance'] > longest['distance']:
+                longest = eattr
+        offsets.pop()  # Travel time to v.
+
+        for i, crossing in enumerate(via):
+            contracted[crossing] = ContractedCrossing(u, v, i,
+                                                      node_pos(g, crossing))
+        g.remove_nodes_from(via)
+        g.add_edge(u, v,
+                   type="Street",
+                   distance=distance,
+                   speed=100,
+                   name=longest['name'],  # name of the longest part.
+                   osm_id=osm_ids,
+                   travel_time=time,
+                   color="#000000",
+                   via=via,
+                   via_from=u,
+                   offsets=offsets)
+
+    return contracted
+
+
+def reduce_city_graph(g: CityGraph) -> None:
+    """Reduces the City graph g, keeping the travel times between the
+    remaining nodes: removes the components that can not be reached from
+    the metro (prune_components) and contracts the chains of crossings in
+    the middle of Streets (contract_chains). The contracted crossings are
+    stored as the 'contracted' graph attribute."""
+
+    prune_components(g)
+    g.graph['contracted'] = contract_chains(g)
+
+
+def street_nodes(g: CityGraph, u: NodeID, v: NodeID) -> Path:
+    """Returns the nodes of the edge between u and v of g, in order from u
+    to v, including the crossings contracted into it."""
+
+    eattr: Dict = g[u][v]
+    via: Path = eattr.get('via', [])
+    if via and eattr['via_from'] != u:
+        via = via[::-1]
+    return [u] + via + [v]
+
+
+def street_offsets(g: CityGraph,
+                   node: NodeID) -> Tuple[NodeID, float, NodeID, float]:
+    """Returns the ends of the Street a contracted crossing of g lies on,
+    each one followed by the travel time from the crossing to it."""
+
+    crossing: ContractedCrossing = g.graph['contracted'][node]
+    eattr: Dict = g[crossing.u][crossing.v]
+    offset: float = eattr['offsets'][crossing.index]
+    return crossing.u, offset, crossing.v, eattr['travel_time'] - offset
+
+
+def segment_attributes(g: CityGraph, u: NodeID, v: NodeID) -> Dict:
+    """Returns the attributes of the edge between u and v as it was before
+    the graph was reduced. If one of them is a contracted crossing, those
+    are the attributes of the Street they lie on, with the distance and
+    travel time of the part between them."""
+
+    if u in g and v in g:
+        return {key: value for key, value in g[u][v].items()
+                if key not in CHAIN_ATTRIBUTES}
+
+    crossing: ContractedCrossing = g.graph['contracted'][
+        u if u not in g else v]
+    eattr: Dict = g[crossing.u][crossing.v]
+    times: Dict[NodeID, float] = {crossing.u: 0.0,
+                                  crossing.v: eattr['travel_time']}
+    times.update(zip(eattr['via'], eattr['offsets']))
+    attributes: Dict = segment_attributes(g, crossing.u, crossing.v)
+    attributes['travel_time'] = abs(times[v] - times[u])
+    attributes['distance'] = attributes['travel_time'] * eattr['speed']
+    return attributes
+
+
+def expand_path(g: CityGraph, p: Path) -> Path:
+    """Returns the path p of the reduced graph g with the crossings
+    contracted into its Streets, i.e. the same path in the graph before
+    the reduction. The first and last nodes of p may be contracted
+    crossings themselves."""
+
+    expanded: Path = p[:1]
+    for u, v in get_edges_from_path(p):
+        if u in g and v in g:
+            nodes: Path = street_nodes(g, u, v)
+        else:
+            # The part between u and v of the Street they lie on.
+            crossing: ContractedCrossing = g.graph['contracted'][
+                u if u not in g else v]
+            nodes = street_nodes(g, crossing.u, crossing.v)
+            i, j = nodes.index(u), nodes.index(v)
+            nodes = nodes[i:j + 1] if i <= j else nodes[j:i + 1][::-1]
+        expanded.extend(nodes[1:])
+    return expanded
+
+
+def update_street(g1: OsmnxGraph, g2: CityGraph, u: NodeID,
+                  v: NodeID) -> None:
+    """Makes the Street between u and v in g2 match the OSM edges between
+    them in g1 (in any direction), removing it if there is none."""
+
+    if u == v or u not in g2 or v not in g2:
+        return
+
+    edges: List[Dict] = []
+    if g1.has_edge(u, v):
+        edges.extend(g1[u][v].values())
+    if g1.has_edge(v, u):
+        edges.extend(g1[v][u].values())
+
+    if edges:
+        add_street(g2, u, v, shortest_street(dict(enumerate(edges))))
+    elif g2.has_edge(u, v) and g2[u][v]['type'] == "Street":
+        g2.remove_edge(u, v)
+
+
+def update_osmnx_graph(g1: OsmnxGraph, diff: OsmnxDiff) -> None:
+    """Applies the differences diff to the Streets graph g1 only. A City
+    graph built from g1 has to be built again."""
+
+    g1.remove_nodes_from(diff.removed_nodes)
+    for u, v, key in diff.removed_edges:
+        if g1.has_edge(u, v, key):
+            g1.remove_edge(u, v, key)
+    for node, attr in diff.added_nodes.items():
+        g1.add_node(node, **attr)
+    for u, v, key, attr in diff.added_edges:
+        g1.add_edge(u, v, key=key, **attr)
+
+
+def apply_osmnx_diff(g1: OsmnxGraph, g2: CityGraph, diff: OsmnxDiff) -> None:
+    """Applies the differences diff to the Streets graph g1 and, only where
+    they are affected, to the City graph g2 built from it. The accesses
+    whose nearest crossing may have changed are connected again. The City
+    graph must have been built without reducing it: the chains contracted
+    in a reduced graph can't be updated, so it has to be built again from
+    g1 (see update_osmnx_graph)."""
+
+    if 'contracted' in g2.graph:
+        raise ValueError("The differences can't be applied to a reduced "
+                         "City graph, it has to be built again")
+
+    accesses: List[str] = [node for node in g2
+                           if node_type(g2, node) == "Access"]
+    crossings: Dict[str, NodeID] = {fid: access_crossing(g2, fid)
+                                    for fid in accesses}
+    moved = set(diff.removed_nodes) | set(diff.added_nodes)
+    affected: List[str] = [fid for fid in accesses
+                           if crossings[fid] is None or
+                           crossings[fid] in moved]
+
+    g1.remove_nodes_from(diff.removed_nodes)
+    g2.remove_nodes_from(diff.removed_nodes)
+
+    touched: List[Tuple[NodeID, NodeID]] = []
+    for u, v, key in diff.removed_edges:
+        if g1.has_edge(u, v, key):
+            g1.remove_edge(u, v, key)
+        touched.append((u, v))
+
+    for node, attr in diff.added_nodes.items():
+        g1.add_node(node, **attr)
+        add_crossing(g1, g2, node)
+
+    for u, v, key, attr in diff.added_edges:
+        g1.add_edge(u, v, key=key, **attr)
+        touched.append((u, v))
+
+    for u, v in touched:
+        update_street(g1, g2, u, v)
+
+    # An access is also affected if a new crossing is nearer than its
+    # current one.
+    if diff.added_nodes:
+        new_x = np.array([attr['x'] for attr in diff.added_nodes.values()])
+        new_y = np.array([attr['y'] for attr in diff.added_nodes.values()])
+        for fid in accesses:
+            if fid in affected:
+                continue
+            lon, lat = node_pos(g2, fid)
+            nearest: float = ox.distance.great_circle_vec(
+                lat, lon, new_y, new_x).min()
+            if nearest < g2[fid][crossings[fid]]['distance']:
+                affected.append(fid)
+
+    connect_accesses(g1, g2, affected)
+
+    # The dense ids of the nodes are no longer valid, so the registry of the
+    # whole graph is built again.
+    if 'registry' in g2.graph:
+        compact_node_attributes(g2)
+
+
+def refresh_osmnx_graph(g1: OsmnxGraph, g2: Optional[CityGraph],
+                        extract: str,
+                        filename: str = "./barcelona.grf") -> OsmnxDiff:
+    """Updates the Streets graph g1 with a local OSM extract, applying only
+    the differences between them, and saves the updated Streets graph in
+    filename. Returns the applied differences. The differences are also
+    applied to the City graph g2 built from g1, unless g2 is None or
+    reduced (as the City graph of the bot): then only g1 is updated and the
+    City graph has to be built again from it."""
+
+    diff: OsmnxDiff = diff_osmnx_graphs(g1, read_osm_extract(extract))
+    if not diff.is_empty():
+        if g2 is None or 'contracted' in g2.graph:
+            update_osmnx_graph(g1, diff)
+        else:
+            apply_osmnx_diff(g1, g2, diff)
+        save_osmnx_graph(g1, filename)
+    return diff
+
+
 def travel_time(g: CityGraph) -> float:
     """Returns the smallest amount of time needed to go from
     node 1 (source) to node 2 (destiantion) in te graph g."""
@@ -247,21 +966,91 @@ def remove_src_and_dst_nodes(g: CityGraph) -> None:
     g.remove_nodes_from([1, 2])
 
 
+def path_graph(g: CityGraph, p: Path, src: Coord, dst: Coord) -> CityGraph:
+    """Returns a small graph with only the nodes and edges of the path p of
+    g, plus the source node 1 at src and the destination node 2 at dst
+    connected to its ends. It can be drawn with plot_path (using the path
+    [1] + p + [2]) without modifying g, which may be frozen. If g is
+    reduced, p must be expanded (see expand_path)."""
+
+    h = CityGraph()
+    h.add_node(1, type="Start", pos=src, color="#000000")
+    h.add_node(2, type="Destination", pos=dst, color="#000000")
+    for node in p:
+        h.add_node(node, type=node_type(g, node), pos=node_pos(g, node),
+                   color=node_color(g, node))
+    for u, v in get_edges_from_path(p):
+        h.add_edge(u, v, **segment_attributes(g, u, v))
+    if p:
+        h.add_edge(1, p[0], type="Start edge", distance=0.0,
+                   travel_time=0.0, color="#000000")
+        h.add_edge(p[-1], 2, type="Destination edge", distance=0.0,
+                   travel_time=0.0, color="#000000")
+    return h
+
+
+def nearest_crossing(ox_g: OsmnxGraph, g: CityGraph,
+                     coord: Coord) -> NodeID:
+    """Returns the crossing of the Streets graph ox_g nearest to coord, or,
+    if it was pruned from the (reduced) City graph g, the nearest crossing
+    of g. The crossing returned may have been contracted."""
+
+    node: NodeID = ox.distance.nearest_nodes(ox_g, coord[0], coord[1])
+    if node in g or node in g.graph.get('contracted', {}):
+        return node
+    registry: NodeRegistry = g.graph.get('registry') or \
+        build_node_registry(g)
+    return registry.nearest(coord, NodeType.CROSSING)
+
+
+def connect_location(g: CityGraph, location: NodeID, crossing: NodeID,
+                     edge_type: str) -> None:
+    """Connects the location node (1 or 2) to the given crossing of g. If the
+    crossing was contracted, the location is connected to both ends of its
+    Street, with the travel time from the crossing to each one."""
+
+    ends: List[Tuple[NodeID, float]] = [(crossing, 0.0)]
+    if crossing not in g:
+        u, to_u, v, to_v = street_offsets(g, crossing)
+        ends = [(u, to_u), (v, to_v)]
+    for node, time in ends:
+        g.add_edge(location, node, type=edge_type, distance=time * 100,
+                   travel_time=time, color="#000000")
+
+
+def along_street_time(g: CityGraph, a: NodeID,
+                      b: NodeID) -> Optional[float]:
+    """Returns the travel time between two crossings contracted into the same
+    Street of g, walking along it, or None if they are not."""
+
+    contracted: Dict[NodeID, ContractedCrossing] = g.graph.get('contracted',
+                                                               {})
+    if a not in contracted or b not in contracted or \
+            (contracted[a].u, contracted[a].v) != \
+            (contracted[b].u, contracted[b].v):
+        return None
+    return abs(street_offsets(g, a)[1] - street_offsets(g, b)[1])
+
+
 def find_path(ox_g: OsmnxGraph, g: CityGraph, src: Coord, dst: Coord) -> Path:
     """Adds the source location and the destination location as a nodes to the
     City Graph. In this way, the shortest path in time is sought. Finally it
     returns the shortest path found in terms of travel time."""
 
     g.add_node(1, type="Start", pos=src, color="#000000")  # Start node.
-    nearest_node: NodeID = ox.distance.nearest_nodes(ox_g, src[0], src[1])
-    g.add_edge(1, nearest_node, type="Start edge", distance=0.0,
-               travel_time=0.0, color="#000000")
+    source: NodeID = nearest_crossing(ox_g, g, src)
+    connect_location(g, 1, source, "Start edge")
 
     # Destination node.
     g.add_node(2, type="Destination", pos=dst, color="#000000")
-    nearest_node = ox.distance.nearest_nodes(ox_g, dst[0], dst[1])
-    g.add_edge(2, nearest_node, type="Destination edge",
-               distance=0.0, travel_time=0.0, color="#000000")
+    target: NodeID = nearest_crossing(ox_g, g, dst)
+    connect_location(g, 2, target, "Destination edge")
+
+    # Both crossings may have been contracted into the same Street.
+    time: Optional[float] = along_street_time(g, source, target)
+    if time is not None:
+        g.add_edge(1, 2, type="Street", distance=time * 100,
+                   travel_time=time, color="#000000")
 
     path: Path = ox.distance.shortest_path(g, 1, 2, weight='travel_time')
     return path
@@ -0,0 +1,126 @@
+import os
+import metro
+import dataset
+import numpy as np
+import pandas as pd
+import restaurants as rs
+from typing import Callable, Dict, List
+
+
+"""
+Module that contains the conversion of the CSV files of the datasets into
+the binary format of the dataset module. It is the only module that needs
+pandas. The binary files are also converted automatically when they are
+missing or older than their CSV file. Usage:
+
+    python3 convert.py
+"""
+
+
+def read_csv(filename: str) -> pd.DataFrame:
+    """Reads a CSV file of the datasets into a DataFrame, with None as the
+    value of the missing cells."""
+
+    csv_file = pd.read_csv(filename, encoding='latin1', sep=';')
+    raw_data = pd.DataFrame(csv_file)
+
+    # Assignation of None value to the NA values in the raw DataFrame.
+    return raw_data.replace(to_replace=np.nan, value=None)
+
+
+def plain(value):
+    """Returns the value as a plain Python object (numpy scalars are
+    converted to the equivalent Python number)."""
+
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def restaurant_columns(data: pd.DataFrame) -> dataset.Columns:
+    """Returns the columns of the restaurants of restaurants.csv."""
+
+    columns: dataset.Columns = {name: [] for name in rs.RESTAURANT_COLUMNS}
+    for row in data.itertuples():
+        # The coordinates are converted to the right format.
+        latitude = rs.convert_to_coord(str(row.geo_epgs_4326_x))
+        longitude = rs.convert_to_coord(str(row.geo_epgs_4326_y))
+        values: List = [row.name,
+                        row.institution_name,
+                        row.addresses_road_name,
+                        row.addresses_start_street_number,
+                        row.addresses_neighborhood_name,
+                        row.addresses_district_name,
+                        row.addresses_zip_code,
+                        row.addresses_town,
+                        row.values_value,
+                        longitude,
+                        latitude]
+        for name, value in zip(rs.RESTAURANT_COLUMNS, values):
+            columns[name].append(plain(value))
+    return columns
+
+
+def station_columns(data: pd.DataFrame) -> dataset.Columns:
+    """Returns the columns of the stations of estacions.csv."""
+
+    columns: dataset.Columns = {name: [] for name in metro.STATION_COLUMNS}
+    for row in data.itertuples():
+        location = metro.transform_to_point(row.GEOMETRY)
+        values: List = [row.FID,
+                        row.CODI_GRUP_ESTACIO,
+                        row.NOM_ESTACIO,
+                        row.CODI_LINIA,
+                        row.NOM_LINIA,
+                        row.COLOR_LINIA,
+                        location.x_coord,
+                        location.y_coord]
+        for name, value in zip(metro.STATION_COLUMNS, values):
+            columns[name].append(plain(value))
+    return columns
+
+
+def access_columns(data: pd.DataFrame) -> dataset.Columns:
+    """Returns the columns of the accesses of accessos.csv."""
+
+    columns: dataset.Columns = {name: [] for name in metro.ACCESS_COLUMNS}
+    for row in data.itertuples():
+        location = metro.transform_to_point(row.GEOMETRY)
+        values: List = [row.FID,
+                        row.NOM_ACCES,
+                        row.CODI_GRUP_ESTACIO,
+                        row.NOM_ESTACIO,
+                        row.NOM_TIPUS_ACCESSIBILITAT,
+                        row.NUM_ASCENSORS,
+                        location.x_coord,
+                        location.y_coord]
+        for name, value in zip(metro.ACCESS_COLUMNS, values):
+            columns[name].append(plain(value))
+    return columns
+
+
+# Conversion of each CSV file and the binary file it is converted into.
+CONVERSIONS: Dict[str, Callable[[pd.DataFrame], dataset.Columns]] = {
+    'restaurants.csv': restaurant_columns,
+    'estacions.csv': station_columns,
+    'accessos.csv': access_columns}
+DATASETS: Dict[str, str] = {rs.RESTAURANTS_CSV: rs.RESTAURANTS_FILE,
+                            metro.STATIONS_CSV: metro.STATIONS_FILE,
+                            metro.ACCESSES_CSV: metro.ACCESSES_FILE}
+
+
+def convert(source: str, filename: str) -> None:
+    """Converts the CSV file source (named as one of the keys of
+    CONVERSIONS) into the binary file filename."""
+
+    conversion = CONVERSIONS[os.path.basename(source)]
+    columns: dataset.Columns = conversion(read_csv(source))
+    dataset.write_table(filename, columns)
+
+
+def main() -> None:
+    for source, filename in DATASETS.items():
+        convert(source, filename)
+        print("%s -> %s" % (source, filename))
+
+
+if __name__ == '__main__':
+    main()
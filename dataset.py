@@ -0,0 +1,222 @@
+import os
+import json
+import mmap
+import zlib
+import struct
+import atomicfile
+import numpy as np
+from typing import Dict, List, Tuple
+from typing_extensions import TypeAlias
+
+
+"""
+Module that contains the code related to the binary format of the datasets
+of the bot (restaurants, stations and accesses). Each dataset is converted
+once from its CSV file (see the convert module) into a columnar file that
+is memory-mapped when loaded, so neither the CSV files nor pandas are
+needed to start the bot.
+
+Layout of a file (little endian): the magic bytes, the version of the
+format and the length of a JSON header with the number of rows and, for
+each column, its name, kind and offsets. Then, aligned to 8 bytes, the
+column blocks: an int64 or float64 array for numeric columns, or an int64
+array of rows + 1 offsets into the string heap for string columns, and a
+uint8 array with the null flags of each column. The string heap (UTF-8)
+is at the end.
+"""
+
+
+MAGIC: bytes = b'MBDS'
+VERSION: int = 1
+
+# Kinds of columns.
+INT: str = 'i'
+FLOAT: str = 'f'
+STRING: str = 's'
+
+# Magic, version and length of the JSON header.
+PREFIX = struct.Struct('<4sII')
+ALIGNMENT: int = 8
+
+# Values of a column, as Python objects (None for null values).
+Values: TypeAlias = List
+Columns: TypeAlias = Dict[str, Values]
+
+
+def column_kind(values: Values) -> str:
+    """Returns the kind of column that can store the given values: INT if
+    they are all integers, FLOAT if they are all numbers and STRING if they
+    are all strings (None is accepted in any column)."""
+
+    types = {type(value) for value in values if value is not None}
+    if types <= {int}:
+        return INT
+    if types <= {int, float}:
+        return FLOAT
+    if types <= {str}:
+        return STRING
+    raise ValueError("Column with values of types %s" %
+                     sorted(t.__name__ for t in types))
+
+
+def aligned(offset: int) -> int:
+    """Returns the first multiple of ALIGNMENT not smaller than offset."""
+
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_table(filename: str, columns: Columns) -> None:
+    """Writes the columns (all of them with the same number of values) into
+    a binary file. The file is replaced atomically."""
+
+    rows: int = len(next(iter(columns.values()), []))
+    blocks: List[Tuple[str, bytes]] = []
+    heap = bytearray()
+    header: Dict = {'rows': rows, 'columns': []}
+
+    for name, values in columns.items():
+        if len(values) != rows:
+            raise ValueError("Column %s has %d values instead of %d" %
+                             (name, len(values), rows))
+        kind: str = column_kind(values)
+        nulls = np.array([value is None for value in values], dtype=np.uint8)
+        if kind == STRING:
+            offsets = np.empty(rows + 1, dtype='<i8')
+            for i, value in enumerate(values):
+                offsets[i] = len(heap)
+                heap += b'' if value is None else value.encode('utf-8')
+            offsets[rows] = len(heap)
+            data: bytes = offsets.tobytes()
+        else:
+            dtype: str = '<i8' if kind == INT else '<f8'
+            data = np.array([0 if value is None else value
+                             for value in values], dtype=dtype).tobytes()
+        header['columns'].append({'name': name, 'kind': kind})
+        blocks.append(('data', data))
+        blocks.append(('nulls', nulls.tobytes()))
+
+    # The offsets of the blocks depend on the length of the header, which
+    # depends on the offsets: they are computed with a placeholder length
+    # until the length does not change.
+    length: int = 0
+    while True:
+        offset: int = aligned(PREFIX.size + length)
+        for i, (key, block) in enumerate(blocks):
+            header['columns'][i // 2][key] = offset
+            offset = aligned(offset + len(block))
+        header['heap'] = offset
+        encoded: bytes = json.dumps(header).encode('utf-8')
+        if len(encoded) <= length:
+            break
+        length = len(encoded)
+
+    with atomicfile.atomic_write(filename) as file:
+        file.write(PREFIX.pack(MAGIC, VERSION, length))
+        file.write(encoded.ljust(length))
+        for key, block in blocks:
+            file.write(b'\0' * (aligned(file.tell()) - file.tell()))
+            file.write(block)
+        file.write(b'\0' * (aligned(file.tell()) - file.tell()))
+        file.write(heap)
+
+
+class Table:
+    """Binary file written by write_table, memory-mapped. Attaching it only
+    reads its header; numeric columns are views of the mapped file and
+    strings are only decoded when requested."""
+
+    def __init__(self, filename: str) -> None:
+        with open(filename, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, length = PREFIX.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a dataset file" % filename)
+        if version != VERSION:
+            raise ValueError("%s has version %d instead of %d" %
+                             (filename, version, VERSION))
+        header: Dict = json.loads(
+            self._map[PREFIX.size:PREFIX.size + length].decode('utf-8'))
+
+        self.rows: int = header['rows']
+        self._columns: Dict[str, Dict] = {column['name']: column
+                                          for column in header['columns']}
+        self._heap: int = header['heap']
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def fingerprint(self) -> int:
+        """Returns the CRC-32 of the whole file, which changes whenever the
+        file is converted again with different contents."""
+
+        return zlib.crc32(self._map)
+
+    def names(self) -> List[str]:
+        """Returns the names of the columns."""
+
+        return list(self._columns)
+
+    def column(self, name: str) -> np.ndarray:
+        """Returns the array of the column (the offsets into the string heap
+        for string columns), without copying it."""
+
+        column: Dict = self._columns[name]
+        dtype: str = '<f8' if column['kind'] == FLOAT else '<i8'
+        count: int = self.rows + 1 if column['kind'] == STRING else self.rows
+        return np.frombuffer(self._map, dtype=dtype, count=count,
+                             offset=column['data'])
+
+    def nulls(self, name: str) -> np.ndarray:
+        """Returns the null flags of the column."""
+
+        return np.frombuffer(self._map, dtype=np.bool_, count=self.rows,
+                             offset=self._columns[name]['nulls'])
+
+    def values(self, name: str) -> Values:
+        """Returns the values of the column as Python objects."""
+
+        kind: str = self._columns[name]['kind']
+        nulls: List[bool] = self.nulls(name).tolist()
+        if kind != STRING:
+            values: Values = self.column(name).tolist()
+        else:
+            offsets: List[int] = self.column(name).tolist()
+            heap: int = self._heap
+            values = [str(self._map[heap + start:heap + end], 'utf-8')
+                      for start, end in zip(offsets, offsets[1:])]
+        return [None if null else value
+                for value, null in zip(values, nulls)]
+
+    def rows_of(self, names: List[str]) -> List[Tuple]:
+        """Returns the rows of the table, as tuples of the values of the
+        given columns."""
+
+        return list(zip(*(self.values(name) for name in names)))
+
+
+def is_current(filename: str, source: str) -> bool:
+    """Returns True if the binary file exists, has the current version and
+    is not older than the source file it was converted from (if the source
+    exists)."""
+
+    if not os.path.exists(filename):
+        return False
+    with open(filename, 'rb') as file:
+        prefix: bytes = file.read(PREFIX.size)
+    if len(prefix) < PREFIX.size or \
+            PREFIX.unpack(prefix)[:2] != (MAGIC, VERSION):
+        return False
+    return not os.path.exists(source) or \
+        os.path.getmtime(filename) >= os.path.getmtime(source)
+
+
+def load(filename: str, source: str) -> Table:
+    """Attaches the binary file, converting the source CSV file first if the
+    binary file is missing or out of date."""
+
+    if not is_current(filename, source):
+        # Only this path needs the converter (and pandas).
+        import convert
+        convert.convert(source, filename)
+    return Table(filename)
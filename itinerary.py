@@ -0,0 +1,146 @@
+import city
+import routing
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from typing_extensions import TypeAlias
+
+
+"""
+Module that contains the code related to the explanation of the routes:
+the edges of a path of the City graph are grouped into legs (walk along a
+street, enter the metro by an access, ride a line, change lines, exit) that
+can be sent to the user as text, without drawing the map.
+"""
+
+
+# Kinds of legs.
+WALK: str = 'walk'
+ENTER: str = 'enter'
+RIDE: str = 'ride'
+TRANSFER: str = 'transfer'
+EXIT: str = 'exit'
+
+UNNAMED_STREET: str = "No name registered"
+
+
+@dataclass
+class Leg:
+    """Part of a route made of consecutive edges of the same kind: the
+    Streets with the same name, the edges from a crossing to a Station
+    through an Access (or from a Station to a crossing), the tracks of the
+    same line or a transfer between lines."""
+
+    kind: str  # One of WALK, ENTER, RIDE, TRANSFER and EXIT.
+    name: str  # Street, access, line or station (of a transfer).
+    distance: float  # Meters.
+    time: float  # Minutes.
+    start: str = ""  # Station where a ride starts or line before a transfer.
+    end: str = ""  # Station where a ride ends or line after a transfer.
+    stops: int = 0  # Tracks between stations ridden.
+
+
+Itinerary: TypeAlias = List[Leg]
+
+
+def street_name(name) -> str:
+    """Returns the name of a Street (OSM edges merged by osmnx may have a
+    list of names)."""
+
+    if isinstance(name, list):
+        return " / ".join(str(part) for part in name)
+    return str(name) if name else UNNAMED_STREET
+
+
+def edge_leg(g: city.CityGraph, u: city.NodeID, v: city.NodeID,
+             eattr: Dict) -> Optional[Leg]:
+    """Returns the leg made of the edge from u to v of g, with attributes
+    eattr, or None if the edge is not part of any leg (the edges from the
+    source and to the destination)."""
+
+    kind: routing.EdgeType = routing.edge_type(eattr['type'])
+    distance: float = eattr['distance']
+    time: float = eattr['travel_time']
+
+    if kind == routing.EdgeType.STREET:
+        return Leg(WALK, street_name(eattr.get('name')), distance, time)
+    if kind == routing.EdgeType.ACCESS_ENTRY:
+        if city.node_type(g, v) == "Access":
+            return Leg(ENTER, g.nodes[v]['name'], distance, time)
+        return Leg(EXIT, g.nodes[u]['name'], distance, time)
+    if kind == routing.EdgeType.ACCESS_ROUTE:
+        if city.node_type(g, v) == "Station":
+            return Leg(ENTER, g.nodes[u]['name'], distance, time,
+                       end=g.nodes[v]['name'])
+        return Leg(EXIT, g.nodes[v]['name'], distance, time,
+                   start=g.nodes[u]['name'])
+    if kind == routing.EdgeType.METRO:
+        return Leg(RIDE, eattr['type'][len(routing.METRO_EDGE_PREFIX):],
+                   distance, time, g.nodes[u]['name'], g.nodes[v]['name'],
+                   1)
+    if kind == routing.EdgeType.TRANSFER:
+        return Leg(TRANSFER, g.nodes[u]['name'], distance, time,
+                   g.nodes[u]['line'], g.nodes[v]['line'])
+    return None
+
+
+def build_itinerary(g: city.CityGraph, p: city.Path) -> Itinerary:
+    """Returns the legs of the path p of g, in a single pass over its
+    edges. If g is reduced, p is better not expanded (see city.expand_path):
+    each Street between two remaining nodes is then a single edge."""
+
+    legs: Itinerary = []
+    for u, v in city.get_edges_from_path(p):
+        leg: Optional[Leg] = edge_leg(g, u, v,
+                                      city.segment_attributes(g, u, v))
+        if leg is None:
+            continue
+        last: Optional[Leg] = legs[-1] if legs else None
+        if last is None or last.kind != leg.kind or last.name != leg.name \
+                or leg.kind == TRANSFER:
+            legs.append(leg)
+            continue
+
+        # The edge continues the last leg.
+        last.distance += leg.distance
+        last.time += leg.time
+        last.start = last.start or leg.start
+        last.end = leg.end or last.end
+        last.stops += leg.stops
+    return legs
+
+
+def format_time(minutes: float) -> str:
+    """Returns the time rounded to minutes, as text."""
+
+    return "%d min" % round(minutes) if minutes >= 0.5 else "<1 min"
+
+
+def describe_leg(leg: Leg) -> str:
+    """Returns the instruction of the leg."""
+
+    if leg.kind == WALK:
+        return "🚶 Walk along %s for %d m (%s)." % (
+            leg.name, round(leg.distance), format_time(leg.time))
+    if leg.kind == ENTER:
+        return "🚇 Enter %s by the access %s (%s)." % (
+            leg.end, leg.name, format_time(leg.time))
+    if leg.kind == RIDE:
+        return "🚆 Take %s at %s and ride %d %s to %s (%s)." % (
+            leg.name, leg.start, leg.stops,
+            "stop" if leg.stops == 1 else "stops", leg.end,
+            format_time(leg.time))
+    if leg.kind == TRANSFER:
+        return "🔁 Change from %s to %s at %s (%s)." % (
+            leg.start, leg.end, leg.name, format_time(leg.time))
+    return "🚪 Exit %s by the access %s (%s)." % (
+        leg.start, leg.name, format_time(leg.time))
+
+
+def describe(legs: Itinerary) -> str:
+    """Returns the numbered instructions of the legs, one per line, followed
+    by the total time."""
+
+    lines: List[str] = ["%d. %s" % (i + 1, describe_leg(leg))
+                        for i, leg in enumerate(legs)]
+    lines.append("Total: %s." % format_time(sum(leg.time for leg in legs)))
+    return "\n".join(lines)
@@ -0,0 +1,354 @@
+import bot
+import json
+import time
+import random
+import storage
+import argparse
+import resource
+import threading
+import numpy as np
+from queue import Queue
+from collections import Counter, defaultdict
+from staticmap import StaticMap
+from telegram import Bot, Update
+from telegram.ext import Dispatcher
+from telegram.utils.request import Request
+from typing import Dict, List, Optional, Tuple, Union
+from typing_extensions import TypeAlias
+
+
+"""
+Module that contains the load generator of the bot: streams of updates
+(synthetic sessions of users or recorded ones) are replayed into a
+dispatcher with the handlers of the bot, that answers through a fake
+Telegram transport, and the throughput, the latency of each command and the
+peak memory are measured. Usage example:
+
+    python3 loadtest.py --users 100 --concurrency 8 --rate 50
+"""
+
+
+# Update of the Telegram Bot API, as received in JSON.
+UpdateData: TypeAlias = Dict
+Stream: TypeAlias = List[UpdateData]
+
+# Latencies (in seconds) of the updates of each kind.
+Latencies: TypeAlias = Dict[str, List[float]]
+
+# Area of Barcelona where the locations of the synthetic users are.
+MIN_LON, MAX_LON = 2.12, 2.20
+MIN_LAT, MAX_LAT = 41.37, 41.43
+
+# Identity of the fake bot.
+BOT_TOKEN: str = "123456:LOADTEST"
+BOT_USER: Dict = {'id': 123456, 'is_bot': True, 'first_name': "Metro-Bot",
+                  'username': "metro_bot"}
+
+# First id of the synthetic users.
+FIRST_USER_ID: int = 1000
+
+
+class FakeRequest(Request):
+    """Stand-in for the HTTP transport of telegram.Bot. Every request to
+    the API is answered locally (after delay seconds) with a minimal valid
+    response, and counted by method."""
+
+    __slots__ = ('delay', 'calls', '_lock', '_message_id')
+
+    def __init__(self, delay: float = 0.0) -> None:
+        super().__init__()
+        self.delay: float = delay
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._message_id: int = 0
+
+    def post(self, url: str, data: Dict,
+             timeout: Optional[float] = None) -> Union[Dict, bool]:
+        """Answers the request to the method at the end of url."""
+
+        method: str = url.rsplit('/', 1)[1]
+        with self._lock:
+            self.calls[method] += 1
+            self._message_id += 1
+            message_id: int = self._message_id
+        if self.delay > 0:
+            time.sleep(self.delay)
+
+        if method == 'getMe':
+            return BOT_USER
+        if method.startswith('send'):
+            return {'message_id': message_id, 'date': int(time.time()),
+                    'chat': {'id': int(data['chat_id']), 'type': 'private'}}
+        return True
+
+
+def build_dispatcher(request: FakeRequest) -> Dispatcher:
+    """Returns a dispatcher with the handlers of the bot that answers
+    through the given transport. The handlers are run synchronously in the
+    thread that processes each update (even those that the bot runs
+    asynchronously), so that the latency of an update covers all its
+    work."""
+
+    dispatcher = Dispatcher(Bot(BOT_TOKEN, request=request), Queue(),
+                            use_context=True)
+    bot.add_handlers(dispatcher)
+    for handlers in dispatcher.handlers.values():
+        for handler in handlers:
+            handler.run_async = False
+    return dispatcher
+
+
+def message_update(update_id: int, user_id: int, **fields) -> UpdateData:
+    """Returns an update with a message of the given user with the given
+    fields (text, location...)."""
+
+    user: Dict = {'id': user_id, 'is_bot': False,
+                  'first_name': "User %d" % user_id}
+    message: Dict = {'message_id': update_id, 'date': int(time.time()),
+                     'chat': {'id': user_id, 'type': 'private',
+                              'first_name': user['first_name']},
+                     'from': user}
+    message.update(fields)
+    return {'update_id': update_id, 'message': message}
+
+
+def command_update(update_id: int, user_id: int, text: str) -> UpdateData:
+    """Returns an update with the given command (e.g. '/find pizza')."""
+
+    length: int = len(text.split()[0])
+    return message_update(update_id, user_id, text=text,
+                          entities=[{'type': 'bot_command', 'offset': 0,
+                                     'length': length}])
+
+
+def location_update(update_id: int, user_id: int, lon: float,
+                    lat: float) -> UpdateData:
+    """Returns an update with a location sent by the given user."""
+
+    return message_update(update_id, user_id,
+                          location={'longitude': lon, 'latitude': lat})
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> UpdateData:
+    """Returns an update with the click of the given user in an inline
+    button with the given data."""
+
+    update: UpdateData = message_update(update_id, user_id)
+    message: Dict = update.pop('message')
+    user, message['from'] = message['from'], BOT_USER
+    update['callback_query'] = {'id': str(update_id),
+                                'from': user,
+                                'chat_instance': str(user_id),
+                                'message': message,
+                                'data': data}
+    return update
+
+
+def query_terms(restaurants: List) -> List[str]:
+    """Returns the words of the names of the restaurants that can be used
+    as queries of /find."""
+
+    return sorted({word for restaurant in restaurants
+                   for word in str(restaurant.name).split()
+                   if len(word) >= 4})
+
+
+def synthetic_stream(users: int, terms: List[str],
+                     rng: random.Random) -> Stream:
+    """Returns the updates of the sessions of the given number of users,
+    interleaved as if they were all using the bot at the same time. Each
+    session sends /start, a location, /find, a click in the button to see
+    the next page of results, /info, /guide, /steps and /routes."""
+
+    sessions: List[List[Tuple[str, Tuple]]] = []
+    for user_id in range(FIRST_USER_ID, FIRST_USER_ID + users):
+        num: int = rng.randint(1, 3)
+        lon: float = rng.uniform(MIN_LON, MAX_LON)
+        lat: float = rng.uniform(MIN_LAT, MAX_LAT)
+        term: str = rng.choice(terms)
+        sessions.append([
+            ('command', (user_id, "/start")),
+            ('location', (user_id, lon, lat)),
+            ('command', (user_id, "/find " + term)),
+            ('callback', (user_id, bot.page_data(bot.PAGE_SIZE,
+                                                 bot.search_id(term)))),
+            ('command', (user_id, "/info %d" % num)),
+            ('command', (user_id, "/guide %d" % num)),
+            ('command', (user_id, "/steps %d" % num)),
+            ('command', (user_id, "/routes %d" % num))])
+
+    builders = {'command': command_update, 'location': location_update,
+                'callback': callback_update}
+    stream: Stream = []
+    for step in range(len(sessions[0]) if sessions else 0):
+        for session in sessions:
+            kind, args = session[step]
+            stream.append(builders[kind](len(stream) + 1, *args))
+    return stream
+
+
+def save_stream(stream: Stream, filename: str) -> None:
+    """Saves the stream of updates as a file with one JSON update per
+    line."""
+
+    with open(filename, 'w') as file:
+        for update in stream:
+            file.write(json.dumps(update) + '\n')
+
+
+def load_stream(filename: str) -> Stream:
+    """Loads a stream of updates saved with save_stream (or recorded from
+    the Bot API, one JSON update per line)."""
+
+    with open(filename) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def update_kind(update: UpdateData) -> str:
+    """Returns the kind of the update: the command ('/find'...),
+    'location', 'callback' or 'text'."""
+
+    if 'callback_query' in update:
+        return 'callback'
+    message: Dict = update.get('message', {})
+    if 'location' in message:
+        return 'location'
+    text: str = message.get('text', "")
+    return text.split()[0] if text.startswith('/') else 'text'
+
+
+def update_user(update: UpdateData) -> int:
+    """Returns the id of the user that sent the update."""
+
+    if 'callback_query' in update:
+        return update['callback_query']['from']['id']
+    return update['message']['chat']['id']
+
+
+def replay(dispatcher: Dispatcher, stream: Stream, concurrency: int,
+           rate: float) -> Tuple[Latencies, float]:
+    """Processes the stream of updates with the given number of threads and
+    returns the latencies of the updates of each kind and the elapsed time.
+    The updates of each user are processed in order by the same thread. If
+    rate is positive, the i-th update arrives i / rate seconds after the
+    start and its latency includes the time it waited to be processed;
+    otherwise the updates are processed as fast as possible."""
+
+    queues: List[List[Tuple[int, UpdateData]]] = [[]
+                                                  for _ in range(concurrency)]
+    for i, update in enumerate(stream):
+        queues[update_user(update) % concurrency].append((i, update))
+
+    latencies: Latencies = defaultdict(list)
+    lock = threading.Lock()
+    start: float = time.perf_counter()
+
+    def work(queue: List[Tuple[int, UpdateData]]) -> None:
+        for i, data in queue:
+            arrival: float = time.perf_counter()
+            if rate > 0:
+                arrival = start + i / rate
+                time.sleep(max(0.0, arrival - time.perf_counter()))
+            dispatcher.process_update(Update.de_json(data, dispatcher.bot))
+            latency: float = time.perf_counter() - arrival
+            with lock:
+                latencies[update_kind(data)].append(latency)
+
+    threads = [threading.Thread(target=work, args=(queue,))
+               for queue in queues]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies, time.perf_counter() - start
+
+
+def peak_rss() -> float:
+    """Returns the peak resident memory of the process in MB."""
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def report(latencies: Latencies, elapsed: float, request: FakeRequest,
+           startup_rss: float) -> None:
+    """Prints the results of a replay."""
+
+    total: int = sum(len(values) for values in latencies.values())
+    print("%d updates in %.2f s: %.1f updates/s" %
+          (total, elapsed, total / elapsed))
+    print("%-10s %6s %9s %9s %9s %9s" %
+          ("kind", "count", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+    for kind in sorted(latencies):
+        values = np.array(latencies[kind]) * 1000
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        print("%-10s %6d %9.1f %9.1f %9.1f %9.1f" %
+              (kind, len(values), p50, p95, p99, values.max()))
+    print("API calls:", dict(request.calls))
+    print("Peak RSS: %.1f MB (%.1f MB after startup)" %
+          (peak_rss(), startup_rss))
+
+
+def draw_blank_tiles() -> None:
+    """Makes the maps be drawn over blank tiles instead of downloading the
+    OSM tiles, to run the load tests offline."""
+
+    StaticMap._draw_base_layer = lambda self, image: None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test of Metro-Bot.")
+    parser.add_argument('--users', type=int, default=50,
+                        help="users of the synthetic stream")
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="threads that process the updates")
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help="updates per second (0: as fast as possible)")
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help="seconds taken by each call to the API")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--replay', help="file with the stream to replay")
+    parser.add_argument('--record', help="file where the stream is saved")
+    parser.add_argument('--sqlite', help="database of the users' store "
+                        "(by default the users are not persisted)")
+    parser.add_argument('--offline', action='store_true',
+                        help="do not download the OSM tiles")
+    parser.add_argument('--prefetch', action='store_true',
+                        help="prefetch the guides of the restaurants of "
+                        "/info")
+    parser.add_argument('--routing', choices=bot.ROUTING_MODES,
+                        default=bot.ROUTING_MODE,
+                        help="routing of /guide and /steps")
+    args = parser.parse_args()
+
+    if args.offline:
+        draw_blank_tiles()
+    bot.PREFETCH_GUIDES = args.prefetch
+    bot.ROUTING_MODE = args.routing
+    bot.users = storage.UserStore() if args.sqlite is None \
+        else storage.SQLiteUserStore(args.sqlite, bot.dataset_fingerprint)
+
+    stream: Stream
+    if args.replay is not None:
+        stream = load_stream(args.replay)
+    else:
+        stream = synthetic_stream(args.users, query_terms(bot.restaurants),
+                                  random.Random(args.seed))
+    if args.record is not None:
+        save_stream(stream, args.record)
+
+    request = FakeRequest(args.delay)
+    dispatcher: Dispatcher = build_dispatcher(request)
+    startup_rss: float = peak_rss()
+    latencies, elapsed = replay(dispatcher, stream, args.concurrency,
+                                args.rate)
+    bot.users.close()
+    report(latencies, elapsed, request, startup_rss)
+    if args.prefetch:
+        print("Prefetched guides: %d used, %d missed" %
+              (bot.guides.hits, bot.guides.misses))
+    bot.guides.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
+import dataset
 import networkx
 import numpy as np
-import pandas as pd
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 import matplotlib.pyplot as plt
 from dataclasses import dataclass
 from haversine import haversine, Unit
@@ -52,6 +52,8 @@ class Access:
     nom_acces: str
     codi_grup_estacio: int
     nom_estacio: str
+    nom_tipus_accessibilitat: str
+    num_ascensors: int
     geometry: Tuple
 
 
@@ -59,6 +61,48 @@ Stations: TypeAlias = List[Station]
 Accesses: TypeAlias = List[Access]
 MetroGraph: TypeAlias = networkx.Graph
 
+# Binary files of the stations and accesses (see the dataset module),
+# converted from the CSV files, and their columns: the attributes of the
+# Stations and Accesses, with the coordinates of the geometry as x and y.
+STATIONS_FILE: str = 'estacions.dat'
+STATIONS_CSV: str = 'estacions.csv'
+STATION_COLUMNS: Tuple[str, ...] = ('fid', 'codi_grup_estacio',
+                                    'nom_estacio', 'codi_linia', 'nom_linia',
+                                    'color_linia', 'x', 'y')
+ACCESSES_FILE: str = 'accessos.dat'
+ACCESSES_CSV: str = 'accessos.csv'
+ACCESS_COLUMNS: Tuple[str, ...] = ('fid', 'nom_acces', 'codi_grup_estacio',
+                                   'nom_estacio', 'nom_tipus_accessibilitat',
+                                   'num_ascensors', 'x', 'y')
+
+
+@dataclass
+class MetroTable:
+    """Precomputed shortest travel times (in minutes) and next hops between
+    every pair of nodes (Stations and Accesses) of the Metro graph. Nodes
+    are identified by their position in nodes."""
+
+    nodes: List[str]  # fid of each node.
+    index: Dict[str, int]  # Position of each fid.
+    times: np.ndarray  # float64 (M, M) matrix of travel times.
+    next_hop: np.ndarray  # int16 (M, M) matrix, next node from i to j.
+
+    def time(self, src: str, dst: str) -> float:
+        """Returns the travel time between the two given nodes."""
+
+        return float(self.times[self.index[src], self.index[dst]])
+
+    def path(self, src: str, dst: str) -> List[str]:
+        """Returns the fastest path between the two given nodes."""
+
+        i: int = self.index[src]
+        j: int = self.index[dst]
+        path: List[str] = [src]
+        while i != j:
+            i = int(self.next_hop[i, j])
+            path.append(self.nodes[i])
+        return path
+
 
 def transform_to_float(coordinate: str) -> float:
     """Transforms a given string (a real number with a parenthesis in one of
@@ -94,47 +138,29 @@ def transform_to_point(geometry: str) -> Point:
 
 
 def read_stations() -> Stations:
-    """Reads the estacions.csv file and creates a DataFrame, from which, for
-    each row, a new Station is created and then added to the list of
-    stations. Finally it returns the list of stations."""
+    """Loads the stations from their binary file (converting estacions.csv
+    first if needed), creating a new Station for each row. Finally it
+    returns the list of stations."""
 
     stations: Stations = []
 
-    csv_file = pd.read_csv('estacions.csv',  encoding='latin1', sep=';')
-    data = pd.DataFrame(csv_file)
-
-    for row in data.itertuples():
-        location = transform_to_point(row.GEOMETRY)
-        station = Station(row.FID,
-                          row.CODI_GRUP_ESTACIO,
-                          row.NOM_ESTACIO,
-                          row.CODI_LINIA,
-                          row.NOM_LINIA,
-                          row.COLOR_LINIA,
-                          [location.x_coord, location.y_coord])
-        stations.append(station)
+    table: dataset.Table = dataset.load(STATIONS_FILE, STATIONS_CSV)
+    for *attributes, x, y in table.rows_of(STATION_COLUMNS):
+        stations.append(Station(*attributes, [x, y]))
 
     return stations
 
 
 def read_accesses() -> Accesses:
-    """Reads the accessos.csv file and creates a DataFrame, from which, for
-    each row, a new Access is created and then added to the list of
-    accesses. Finally it returns the list of accesses."""
+    """Loads the accesses from their binary file (converting accessos.csv
+    first if needed), creating a new Access for each row. Finally it
+    returns the list of accesses."""
 
     accesses: Accesses = []
 
-    csv_file = pd.read_csv('accessos.csv',  encoding='latin1', sep=';')
-    data = pd.DataFrame(csv_file)
-
-    for row in data.itertuples():
-        location = transform_to_point(row.GEOMETRY)
-        access = Access(row.FID,
-                        row.NOM_ACCES,
-                        row.CODI_GRUP_ESTACIO,
-                        row.NOM_ESTACIO,
-                        [location.x_coord, location.y_coord])
-        accesses.append(access)
+    table: dataset.Table = dataset.load(ACCESSES_FILE, ACCESSES_CSV)
+    for *attributes, x, y in table.rows_of(ACCESS_COLUMNS):
+        accesses.append(Access(*attributes, [x, y]))
 
     return accesses
 
@@ -162,6 +188,8 @@ def add_access_to_metro(Metro: MetroGraph, access: Access) -> None:
                    name=access.nom_acces,
                    station_name=access.nom_estacio,
                    group=access.codi_grup_estacio,
+                   accessibility=access.nom_tipus_accessibilitat,
+                   elevators=access.num_ascensors,
                    pos=access.geometry,
                    color="#000000")
 
@@ -294,17 +322,43 @@ def get_metro_graph() -> MetroGraph:
     """Creates and returns a graph with Stations and Accesses as nodes
     connected by different types of edges depending on the conections."""
 
-    Metro = MetroGraph()
+    return build_metro_graph(read_stations(), read_accesses())
 
-    stations: Stations = read_stations()
-    add_stations(Metro, stations)
 
-    accesses: Accesses = read_accesses()
+def build_metro_graph(stations: Stations, accesses: Accesses) -> MetroGraph:
+    """Same as get_metro_graph, with the Stations and Accesses already
+    read."""
+
+    Metro = MetroGraph()
+    add_stations(Metro, stations)
     add_accesses(Metro, stations, accesses)
 
     return Metro
 
 
+def build_metro_table(g: MetroGraph) -> MetroTable:
+    """Computes the MetroTable of the Metro graph g, before it is merged into
+    the City graph. Since g is undirected, the next hop from any node to j is
+    its predecessor in the shortest path tree rooted at j."""
+
+    nodes: List[str] = list(g.nodes)
+    index: Dict[str, int] = {node: i for i, node in enumerate(nodes)}
+    m: int = len(nodes)
+
+    times = np.full((m, m), np.inf, dtype=np.float64)
+    next_hop = np.full((m, m), -1, dtype=np.int16)
+
+    for j, root in enumerate(nodes):
+        pred, dist = networkx.dijkstra_predecessor_and_distance(
+            g, root, weight='travel_time')
+        for node, time in dist.items():
+            i: int = index[node]
+            times[i, j] = time
+            next_hop[i, j] = index[pred[node][0]] if pred[node] else j
+
+    return MetroTable(nodes, index, times, next_hop)
+
+
 def show(g: MetroGraph) -> None:
     """Opens a new window showing the graphic representation of the
     given graph g."""
@@ -0,0 +1,131 @@
+import time
+import threading
+from dataclasses import dataclass
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional
+
+
+"""
+Module that contains the code related to the speculative precomputation of
+the answers of the bot: work that a user will probably ask for next (e.g.
+the route to the restaurant shown with /info, before /guide) is started in
+the background and its result is kept in a small cache of each user until
+it is claimed, replaced or expired.
+"""
+
+
+# Results kept for each user.
+RESULTS_PER_USER: int = 2
+
+# Computations waiting to be run, for all the users.
+MAX_PENDING: int = 16
+
+# Seconds after which an unclaimed result is dropped.
+RESULT_TTL: float = 10 * 60
+
+
+@dataclass
+class Entry:
+    """Result (possibly not computed yet) of a key of a user."""
+
+    future: Future
+    created: float  # time.monotonic() when it was submitted.
+
+
+class Prefetcher:
+    """Cache of speculative results of each user, computed by a single
+    background thread (so that they only use the time left by the handlers
+    of the bot). Every result is identified by a key that must change
+    whenever the result would, e.g. the coordinates of the user and the
+    restaurant of a route."""
+
+    def __init__(self, results_per_user: int = RESULTS_PER_USER,
+                 max_pending: int = MAX_PENDING,
+                 ttl: float = RESULT_TTL) -> None:
+        self.results_per_user: int = results_per_user
+        self.max_pending: int = max_pending
+        self.ttl: float = ttl
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: Dict[int, OrderedDict] = {}
+        self._lock = threading.Lock()
+        # The thread is only started with the first submission.
+        self._executor = ThreadPoolExecutor(max_workers=1,
+                                            thread_name_prefix='prefetch')
+
+    def submit(self, user_id: int, key: Hashable, function: Callable,
+               *args) -> bool:
+        """Starts computing function(*args) in the background as the result
+        of key for the user, unless it is already cached. The computations
+        of the user that have not started yet are cancelled (the user has
+        moved on) and the oldest results beyond results_per_user are
+        dropped. Returns False if too many computations are pending."""
+
+        with self._lock:
+            entries: OrderedDict = self._entries.setdefault(user_id,
+                                                            OrderedDict())
+            if key in entries:
+                entries.move_to_end(key)
+                return True
+
+            for other in list(entries):
+                if entries[other].future.cancel():
+                    del entries[other]
+            if self._pending() >= self.max_pending:
+                return False
+
+            entries[key] = Entry(self._executor.submit(function, *args),
+                                 time.monotonic())
+            while len(entries) > self.results_per_user:
+                entries.popitem(last=False)[1].future.cancel()
+            return True
+
+    def claim(self, user_id: int, key: Hashable) -> Optional[Future]:
+        """Removes the result of key for the user from the cache and returns
+        its future (that may be still running), or None if there is no
+        result or its computation has not started yet (then it is cancelled,
+        since computing it directly is faster than waiting for its turn)."""
+
+        with self._lock:
+            entries: Optional[OrderedDict] = self._entries.get(user_id)
+            entry: Optional[Entry] = None if entries is None \
+                else entries.pop(key, None)
+            if entry is None or entry.future.cancel():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry.future
+
+    def discard(self, user_id: int) -> None:
+        """Drops all the results of the user, e.g. when they become stale."""
+
+        with self._lock:
+            for entry in self._entries.pop(user_id, {}).values():
+                entry.future.cancel()
+
+    def evict(self) -> None:
+        """Drops the results older than ttl."""
+
+        now: float = time.monotonic()
+        with self._lock:
+            for user_id, entries in list(self._entries.items()):
+                for key, entry in list(entries.items()):
+                    if now - entry.created > self.ttl:
+                        entry.future.cancel()
+                        del entries[key]
+                if not entries:
+                    del self._entries[user_id]
+
+    def shutdown(self) -> None:
+        """Cancels the pending computations and stops the thread."""
+
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _pending(self) -> int:
+        """Returns the number of computations that have not finished (called
+        with the lock held)."""
+
+        return sum(not entry.future.done()
+                   for entries in self._entries.values()
+                   for entry in entries.values())
@@ -1,5 +1,11 @@
+import os
+import math
 import city
 import metro
+import random
+import routing
+import routetest
+import osmnx as ox
 import restaurants as rs
 
 
@@ -90,10 +96,249 @@ def restaurants_test() -> None:
         print(restaurant)  # prints all the attributes for matched restaurant.
 
 
+def routing_test() -> None:
+    """Checks, on seeded random pairs of coordinates of Barcelona, that the
+    bidirectional search of the routing module finds the same travel times
+    as city.find_path, also over the reduced City graph, and compares the
+    nodes settled by the searches."""
+
+    Streets: city.OsmnxGraph = city.get_osmnx_graph()
+    Barcelona: city.CityGraph = city.build_city_graph(
+        Streets, metro.get_metro_graph(), reduce=False)
+    city.compact_node_attributes(Barcelona)
+    rg: routing.RoutingGraph = routing.build_routing_graph(Barcelona)
+
+    Reduced: city.CityGraph = city.build_city_graph(Streets,
+                                                    metro.get_metro_graph())
+    city.compact_node_attributes(Reduced)
+    reduced_rg: routing.RoutingGraph = routing.build_routing_graph(Reduced)
+    print("Nodes of the City graph:", len(rg), "reduced:", len(reduced_rg))
+
+    random.seed(2022)
+    bidirectional_settled: int = 0
+    dijkstra_settled: int = 0
+    for _ in range(100):
+        src: city.Coord = [random.uniform(2.10, 2.22),
+                           random.uniform(41.35, 41.45)]
+        dst: city.Coord = [random.uniform(2.10, 2.22),
+                           random.uniform(41.35, 41.45)]
+
+        city.find_path(Streets, Barcelona, src, dst)
+        time: float = city.travel_time(Barcelona)
+        city.remove_src_and_dst_nodes(Barcelona)
+
+        source: int = rg.registry.dense(
+            ox.distance.nearest_nodes(Streets, src[0], src[1]))
+        target: int = rg.registry.dense(
+            ox.distance.nearest_nodes(Streets, dst[0], dst[1]))
+        bidirectional_time, path, settled = routing.bidirectional_path(
+            rg, source, target)
+        bidirectional_settled += settled
+        dijkstra_settled += routing.dijkstra_path(rg, source, target)[2]
+
+        assert abs(bidirectional_time - time) < 1e-9, (src, dst)
+        assert path[0] == source and path[-1] == target
+
+        reduced_time, reduced_path = routing.find_route(reduced_rg, Streets,
+                                                        src, dst)
+        reduced_path = city.expand_path(Reduced, reduced_path)
+        assert abs(reduced_time - time) < 1e-9, (src, dst)
+        assert reduced_path[0] == rg.registry.external(source)
+        assert reduced_path[-1] == rg.registry.external(target)
+
+    print("Nodes settled by the bidirectional search:", bidirectional_settled)
+    print("Nodes settled by the unidirectional search:", dijkstra_settled)
+
+
+def schedule_test() -> None:
+    """Checks that the departures of every line never get earlier when the
+    arrival at the platform gets later (the waiting is FIFO), along two days
+    and finely around the start of every band of headways."""
+
+    for line, headways in routing.HEADWAYS.items():
+        minutes = [step / 4 for step in range(2 * 24 * 60 * 4)]
+        for start, _ in headways:
+            for day in (0, routing.MINUTES_PER_DAY):
+                minutes.extend(day + start + step / 100
+                               for step in range(-1000, 1000))
+        minutes.sort()
+
+        previous: float = -math.inf
+        for minute in minutes:
+            departure: float = routing.next_departure(line, minute)
+            assert departure >= minute, (line, minute)
+            assert departure >= previous, (line, minute)
+            previous = departure
+    print("Departures are FIFO on every line")
+
+
+def corpus_test() -> None:
+    """Checks every routing engine against the corpus of golden routes of
+    the routetest module (generating it the first time) and prints the
+    latencies of each engine."""
+
+    Streets: city.OsmnxGraph = city.get_osmnx_graph()
+    Barcelona: city.CityGraph = city.build_city_graph(
+        Streets, metro.get_metro_graph(), reduce=False)
+    Metro: metro.MetroGraph = metro.get_metro_graph()
+    table: metro.MetroTable = metro.build_metro_table(Metro)
+    Reduced: city.CityGraph = city.build_city_graph(Streets, Metro)
+
+    corpus: routetest.Corpus
+    if os.path.exists(routetest.CORPUS_FILE):
+        corpus = routetest.load_corpus(routetest.CORPUS_FILE, Barcelona)
+    else:
+        corpus = routetest.generate_corpus(Streets, Barcelona, 2000, 2022)
+        routetest.save_corpus(routetest.CORPUS_FILE, corpus, Barcelona, 2022)
+
+    results = routetest.check_engines(
+        Barcelona, corpus, routetest.build_engines(Barcelona, Reduced,
+                                                   table))
+    routetest.report(corpus, results)
+    for name, result in results.items():
+        assert not result.mismatches, name
+
+
+def table_test() -> None:
+    """Checks, on seeded random pairs of crossings of the reduced City
+    graph, that the routes composed with the MetroTable are paths of the
+    graph with the travel time found, never faster than the fastest route
+    of the bidirectional search, and prints how much slower they are."""
+
+    Streets: city.OsmnxGraph = city.get_osmnx_graph()
+    Metro: metro.MetroGraph = metro.get_metro_graph()
+    table: metro.MetroTable = metro.build_metro_table(Metro)  # Not merged.
+    Reduced: city.CityGraph = city.build_city_graph(Streets, Metro)
+    rg: routing.RoutingGraph = routing.build_routing_graph(Reduced)
+    crossings = [node for node in range(len(rg))
+                 if rg.registry.types[node] == city.NodeType.CROSSING]
+
+    random.seed(2022)
+    slower: int = 0
+    delay: float = 0.0
+    for _ in range(200):
+        source, target = random.sample(crossings, 2)
+        time, path = routing.table_path(rg, table, source, target)
+        fastest: float = routing.bidirectional_path(rg, source, target)[0]
+        assert time >= fastest - 1e-9, (source, target)
+        if time == math.inf:
+            continue
+
+        assert path[0] == source and path[-1] == target
+        path_time: float = 0.0
+        for u, v in city.get_edges_from_path(routing.external_path(rg,
+                                                                   path)):
+            path_time += Reduced[u][v]['travel_time']
+        assert abs(path_time - time) < 1e-9, (source, target)
+        slower += time > fastest + 1e-9
+        delay += time - fastest
+
+    print("Routes of the table slower than the fastest ones:", slower,
+          "of 200, by %.2f min in total" % delay)
+
+
+def pareto_test() -> None:
+    """Checks, on seeded random pairs of coordinates of Barcelona, that the
+    first route of routing.find_routes is the fastest one, that none of the
+    routes dominates another one and that the accessible routes only use
+    accessible accesses, and prints how many routes are found."""
+
+    Streets: city.OsmnxGraph = city.get_osmnx_graph()
+    Reduced: city.CityGraph = city.build_city_graph(Streets,
+                                                    metro.get_metro_graph())
+    city.compact_node_attributes(Reduced)
+    rg: routing.RoutingGraph = routing.build_routing_graph(Reduced)
+
+    random.seed(2022)
+    total: int = 0
+    for _ in range(50):
+        src: city.Coord = [random.uniform(2.10, 2.22),
+                           random.uniform(41.35, 41.45)]
+        dst: city.Coord = [random.uniform(2.10, 2.22),
+                           random.uniform(41.35, 41.45)]
+
+        fastest: float = routing.find_route(rg, Streets, src, dst)[0]
+        routes = routing.find_routes(rg, Streets, src, dst)
+        assert abs(routes[0].time - fastest) < 1e-9, (src, dst)
+        for a in routes:
+            for b in routes:
+                assert a is b or not routing.dominates(
+                    (a.time, a.walking, a.transfers),
+                    (b.time, b.walking, b.transfers)), (src, dst)
+        total += len(routes)
+
+        for route in routing.find_routes(rg, Streets, src, dst, True):
+            assert route.time >= fastest - 1e-9, (src, dst)
+            for node in route.path:
+                accessibility = Reduced.nodes[node].get('accessibility') \
+                    if node in Reduced else None
+                assert accessibility in (None, routing.ACCESSIBLE), node
+
+    print("Pareto routes found:", total, "for 50 pairs")
+
+
+def time_dependent_test() -> None:
+    """Checks, on seeded random pairs of crossings of the reduced City graph
+    and random departures, that waiting for the trains never makes a route
+    faster than the fastest static route, and that it is as fast when the
+    trains leave at once (no headways, boarding time or transfer penalty).
+    Prints how many routes get slower."""
+
+    Streets: city.OsmnxGraph = city.get_osmnx_graph()
+    Reduced: city.CityGraph = city.build_city_graph(Streets,
+                                                    metro.get_metro_graph())
+    rg: routing.RoutingGraph = routing.build_routing_graph(Reduced)
+    crossings = [node for node in range(len(rg))
+                 if rg.registry.types[node] == city.NodeType.CROSSING]
+
+    random.seed(2022)
+    pairs = [(random.sample(crossings, 2),
+              random.uniform(0, routing.MINUTES_PER_DAY))
+             for _ in range(100)]
+
+    def check(same: bool) -> int:
+        slower: int = 0
+        for (source, target), departure in pairs:
+            sources: routing.Seeds = routing.street_seeds(
+                rg, rg.registry.external(source))
+            targets: routing.Seeds = routing.street_seeds(
+                rg, rg.registry.external(target))
+            fastest: float = routing.bidirectional_search(rg, sources,
+                                                          targets)[0]
+            time, path = routing.time_dependent_search(rg, sources, targets,
+                                                       departure)
+            assert time >= fastest - 1e-9, (source, target, departure)
+            assert not same or abs(time - fastest) < 1e-9, (source, target)
+            assert path[0] == source and path[-1] == target
+            slower += time > fastest + 1e-9
+        return slower
+
+    print("Routes slower when waiting for the trains:", check(False),
+          "of", len(pairs))
+
+    saved = (routing.BOARDING_TIME, routing.TRANSFER_PENALTY,
+             routing.SCHEDULES, routing.CONVENTIONAL_SCHEDULE)
+    routing.BOARDING_TIME = routing.TRANSFER_PENALTY = 0.0
+    routing.SCHEDULES = {}
+    routing.CONVENTIONAL_SCHEDULE = routing.build_schedule([(0, 0)])
+    try:
+        check(True)
+    finally:
+        (routing.BOARDING_TIME, routing.TRANSFER_PENALTY, routing.SCHEDULES,
+         routing.CONVENTIONAL_SCHEDULE) = saved
+
+
 def main():
     city_test()
     metro_test()
     restaurants_test()
+    routing_test()
+    schedule_test()
+    corpus_test()
+    table_test()
+    pareto_test()
+    time_dependent_test()
 
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
-import numpy as np
-import pandas as pd
-from dataclasses import dataclass
-from typing import List, Optional
+import dataset
+import threading
+import unicodedata
+from dataclasses import dataclass, fields
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 from fuzzysearch import find_near_matches
 from typing_extensions import TypeAlias
 
@@ -40,6 +42,96 @@ class Restaurant:
 # List of restaurants
 Restaurants: TypeAlias = List[Restaurant]
 
+# Binary file of the restaurants (see the dataset module), converted from
+# RESTAURANTS_CSV, with a column for each attribute of the Restaurants.
+RESTAURANTS_FILE: str = 'restaurants.dat'
+RESTAURANTS_CSV: str = 'restaurants.csv'
+RESTAURANT_COLUMNS: Tuple[str, ...] = tuple(attribute.name for attribute
+                                            in fields(Restaurant))
+
+# Positions of some restaurants inside the list of all the restaurants.
+Indices: TypeAlias = List[int]
+
+# Normalized terms of a search.
+Query: TypeAlias = Tuple[str, ...]
+
+# Separator of the parameters in the search key of a restaurant. Since it
+# has two characters, a match (with at most one edit) can't span two
+# parameters.
+KEY_SEPARATOR: str = '\0\0'
+
+
+class SearchCache:
+    """Bounded LRU cache of search results. Each entry maps a normalized
+    query to the indices of the matching restaurants, so the cached
+    restaurants are never copied. The cache is bound to one list of
+    restaurants, whose search keys it keeps, and only answers searches made
+    over that same list. It is shared by the handlers running in different
+    threads, so its entries are only accessed holding its lock."""
+
+    def __init__(self, size: int) -> None:
+        self.size: int = size  # Maximum number of entries.
+        self.hits: int = 0
+        self.misses: int = 0
+        self.dataset: Optional[Restaurants] = None
+        self.keys: List[str] = []
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def reset(self, restaurants: Optional[Restaurants]) -> None:
+        """Empties the cache and binds it to the given list of restaurants,
+        computing their search keys."""
+
+        keys: List[str] = [] if restaurants is None \
+            else [search_key(restaurant) for restaurant in restaurants]
+        with self._lock:
+            self._entries.clear()
+            self.dataset = restaurants
+            self.keys = keys
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, key: Query) -> Optional[Indices]:
+        """Returns the indices stored for the given key (marking them as
+        the most recently used) or None if they are not in the cache."""
+
+        with self._lock:
+            indices: Optional[Indices] = self._entries.get(key)
+            if indices is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return indices
+
+    def put(self, key: Query, indices: Indices) -> None:
+        """Stores the indices for the given key, evicting the least
+        recently used entry if the cache is full."""
+
+        with self._lock:
+            self._entries[key] = indices
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the hit/miss counters of the cache, useful to tune its
+        size."""
+
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            entries: int = len(self._entries)
+        lookups: int = hits + misses
+        return {'size': self.size,
+                'entries': entries,
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': hits / lookups if lookups else 0.0}
+
+
+# Cache shared by all the searches over the restaurants given by read().
+search_cache = SearchCache(256)
+
 
 def convert_to_coord(coord: str) -> str:
     """Given a string containing a coordinate following
@@ -65,37 +157,100 @@ def convert_to_coord(coord: str) -> str:
 
 
 def read() -> Restaurants:
-    """Reads the restaurants.csv file and creates a DataFrame, from which, for
-    each row, a new Restaurant is created and then added to the list of
+    """Loads the restaurants from their binary file (converting
+    restaurants.csv first if needed) and returns the list of
     restaurants."""
 
-    restaurants: Restaurants = []
+    return read_dataset()[0]
+
+
+def read_dataset() -> Tuple[Restaurants, int]:
+    """Same as read, but also returns the fingerprint of the binary file
+    (see dataset.Table.fingerprint): the positions of the restaurants in
+    the list only stay the same while it does not change."""
+
+    table: dataset.Table = dataset.load(RESTAURANTS_FILE, RESTAURANTS_CSV)
+    restaurants: Restaurants = [Restaurant(*row) for row
+                                in table.rows_of(RESTAURANT_COLUMNS)]
+
+    # Results cached for the previous dataset are no longer valid, and the
+    # search keys of the new one are computed.
+    search_cache.reset(restaurants)
+
+    return restaurants, table.fingerprint()
+
+
+def normalize(text: str) -> str:
+    """Returns the given text casefolded and without accents, so that
+    'Gràcia' and 'gracia' are considered the same word."""
+
+    decomposed: str = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def normalize_query(terms: List[str]) -> Query:
+    """Returns the normalized form of a query made of several terms. Since
+    the restaurants have to match every term, their order does not matter
+    and they are sorted."""
+
+    return tuple(sorted(set(normalize(term) for term in terms)))
+
+
+def search_key(restaurant: Restaurant) -> str:
+    """Returns the text where the queries are searched for the restaurant:
+    its parameters normalized, with their words separated by single spaces
+    and joined by KEY_SEPARATOR. The town (the same for every restaurant)
+    and the coordinates are left out, since they would match queries such
+    as 'bar' or '41' for every restaurant."""
+
+    parameters = [restaurant.name,
+                  restaurant.institution_name,
+                  restaurant.addresses_road_name,
+                  restaurant.addresses_start_street_number,
+                  restaurant.addresses_neighborhood_name,
+                  restaurant.addresses_district_name,
+                  restaurant.addresses_zip_code,
+                  restaurant.values_value]
+    return KEY_SEPARATOR.join(" ".join(normalize(str(parameter)).split())
+                              for parameter in parameters
+                              if parameter is not None)
+
+
+def matches(query: str, key: str) -> bool:
+    """Returns True if the (normalized) query, or something similar, appears
+    in some of the parameters of the restaurant with the given search
+    key."""
+
+    # An exact match is much cheaper to find than a similar one (with the
+    # fuzzysearch function 'find_near_matches()').
+    return query in key or find_near_matches(query, key, max_l_dist=1) != []
+
 
-    csv_file = pd.read_csv('restaurants.csv', encoding='latin1', sep=';')
-    raw_data = pd.DataFrame(csv_file)
+def search(terms: List[str], restaurants: Restaurants) -> Indices:
+    """Given a query made of several terms and a list of restaurants, the
+    function returns the indices of the restaurants that contain every term
+    (or something similar) in some of their parameters. Results of searches
+    over the restaurants given by read() are cached."""
 
-    # Assignation of None value to the NA values in the raw DataFrame.
-    data = raw_data.replace(to_replace=np.nan, value=None)
+    key: Query = normalize_query(terms)
+    if key == ():  # An empty query matches no restaurant.
+        return []
 
-    for row in data.itertuples():
-        # The coordinates are converted to the right format.
-        latitude = convert_to_coord(str(row.geo_epgs_4326_x))
-        longitude = convert_to_coord(str(row.geo_epgs_4326_y))
-        restaurant = Restaurant(row.name,
-                                row.institution_name,
-                                row.addresses_road_name,
-                                row.addresses_start_street_number,
-                                row.addresses_neighborhood_name,
-                                row.addresses_district_name,
-                                row.addresses_zip_code,
-                                row.addresses_town,
-                                row.values_value,
-                                longitude,
-                                latitude)
+    cached: bool = restaurants is search_cache.dataset
+    if cached:
+        indices: Optional[Indices] = search_cache.get(key)
+        if indices is not None:
+            return indices
 
-        restaurants.append(restaurant)
+    keys: List[str] = search_cache.keys if cached \
+        else [search_key(restaurant) for restaurant in restaurants]
+    indices = list(range(len(restaurants)))
+    for query in key:
+        indices = [i for i in indices if matches(query, keys[i])]
 
-    return restaurants
+    if cached:
+        search_cache.put(key, indices)
+    return indices
 
 
 def find(query: str, restaurants: Restaurants) -> Restaurants:
@@ -103,30 +258,4 @@ def find(query: str, restaurants: Restaurants) -> Restaurants:
     another list of restaurants that contains that query or similar in some
     of its parameters."""
 
-    matching_restaurants: Restaurants = []
-
-    for restaurant in restaurants:
-        # A list with all the parameters of "restaurant" is created.
-        restaurant_parameters = [str(restaurant.name),
-                                 str(restaurant.institution_name),
-                                 str(restaurant.addresses_road_name),
-                                 str(restaurant.addresses_start_street_number),
-                                 str(restaurant.addresses_neighborhood_name),
-                                 str(restaurant.addresses_district_name),
-                                 str(restaurant.addresses_zip_code),
-                                 str(restaurant.addresses_town),
-                                 str(restaurant.values_value),
-                                 str(restaurant.longitude),
-                                 str(restaurant.latitude)]
-        # The query string is searched in the elements of the parameter list
-        # using the fuzzysearch function 'find_near_matches()'.
-        for parameter in restaurant_parameters:
-            found: bool = (find_near_matches(query, str(parameter),
-                                             max_l_dist=1) != [])
-
-            if (parameter != "None") and found:
-                matching_restaurants.append(restaurant)
-                # Once a matching parameter is found, this loop stops.
-                break
-
-    return matching_restaurants
+    return [restaurants[i] for i in search([query], restaurants)]
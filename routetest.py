@@ -0,0 +1,320 @@
+import os
+import sys
+import city
+import json
+import time
+import metro
+import random
+import routing
+import argparse
+import networkx
+import numpy as np
+from dataclasses import dataclass, asdict, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from typing_extensions import TypeAlias
+
+
+"""
+Module that contains the regression test of the routes: a seeded corpus of
+pairs of locations of Barcelona with the golden travel time and path of the
+route between them, found by city.find_path (networkx). Every routing
+engine must find the same travel times and the same paths (or, if there are
+ties, paths with the same travel time), and the latency of each engine is
+measured. The corpus is generated once and stored in a file, so that later
+changes of the engines are checked against it. Usage example:
+
+    python3 routetest.py --pairs 2000 --seed 2022
+"""
+
+
+# File where the corpus is stored.
+CORPUS_FILE: str = "routes.jsonl"
+
+# Area of Barcelona where the locations of the corpus are.
+MIN_LON, MAX_LON = 2.10, 2.22
+MIN_LAT, MAX_LAT = 41.35, 41.45
+
+# Largest difference between two travel times that are considered equal
+# (the engines add the times of the edges in different orders).
+TOLERANCE: float = 1e-9
+
+# Engines that may find slower routes than the golden ones (but never
+# faster ones): their routes only have to be valid paths, and how much
+# slower they are is reported.
+APPROXIMATE_ENGINES: Set[str] = {'table'}
+
+
+@dataclass
+class GoldenRoute:
+    """Pair of locations of the corpus with the fastest route between them
+    found by city.find_path: its travel time (in minutes) and its path
+    between the crossings nearest to both locations."""
+
+    src: city.Coord
+    dst: city.Coord
+    time: float
+    path: city.Path
+
+
+Corpus: TypeAlias = List[GoldenRoute]
+
+# Routing engine: returns the travel time and the path (as in the City graph
+# before its reduction) of the fastest route between two crossings.
+Engine: TypeAlias = Callable[[city.NodeID, city.NodeID],
+                             Tuple[float, city.Path]]
+
+
+@dataclass
+class EngineResult:
+    """Results of an engine over the corpus."""
+
+    latencies: List[float]  # Seconds taken by each route.
+    ties: int  # Routes with another path of the same travel time.
+    mismatches: List[int]  # Positions of the routes that differ.
+    # Minutes slower than the golden route of each route (approximate
+    # engines only).
+    deviations: List[float] = field(default_factory=list)
+
+
+def graph_summary(g: city.CityGraph) -> Dict:
+    """Returns the numbers of nodes and edges of g, to recognize the graph a
+    corpus was generated from."""
+
+    return {'nodes': g.number_of_nodes(), 'edges': g.number_of_edges()}
+
+
+def path_time(g: city.CityGraph, p: city.Path) -> float:
+    """Returns the travel time of the path p of g, adding the times of its
+    edges in order (as the Dijkstra of networkx does)."""
+
+    minutes: float = 0.0
+    for u, v in city.get_edges_from_path(p):
+        minutes += g.edges[u, v]['travel_time']
+    return minutes
+
+
+def routable_nodes(g: city.CityGraph) -> Set[city.NodeID]:
+    """Returns the nodes of the connected components of g with a Station,
+    i.e. those that are kept when g is reduced."""
+
+    return {node for component in networkx.connected_components(g)
+            if any(city.node_type(g, node) == "Station"
+                   for node in component)
+            for node in component}
+
+
+def random_location(rng: random.Random) -> city.Coord:
+    """Returns a random location of the area of the corpus."""
+
+    return [rng.uniform(MIN_LON, MAX_LON), rng.uniform(MIN_LAT, MAX_LAT)]
+
+
+def generate_corpus(streets: city.OsmnxGraph, g: city.CityGraph, pairs: int,
+                    seed: int) -> Corpus:
+    """Returns a corpus with the given number of pairs of random locations
+    (generated with the seed) and their golden routes, found by
+    city.find_path over the City graph g, that must not be reduced. The
+    pairs without a route or whose crossings are not connected to the metro
+    are discarded."""
+
+    rng = random.Random(seed)
+    routable: Set[city.NodeID] = routable_nodes(g)
+    corpus: Corpus = []
+    while len(corpus) < pairs:
+        src: city.Coord = random_location(rng)
+        dst: city.Coord = random_location(rng)
+        try:
+            path: Optional[city.Path] = city.find_path(streets, g, src, dst)
+            if path is not None and path[1] in routable \
+                    and path[-2] in routable:
+                corpus.append(GoldenRoute(src, dst, path_time(g, path),
+                                          path[1:-1]))
+        except networkx.NetworkXNoPath:
+            pass
+        finally:
+            city.remove_src_and_dst_nodes(g)
+    return corpus
+
+
+def save_corpus(filename: str, corpus: Corpus, g: city.CityGraph,
+                seed: int) -> None:
+    """Saves the corpus generated from g with the seed as a file with a
+    JSON header followed by one JSON route per line."""
+
+    with open(filename, 'w') as file:
+        file.write(json.dumps(dict(graph_summary(g), seed=seed)) + '\n')
+        for route in corpus:
+            file.write(json.dumps(asdict(route)) + '\n')
+
+
+def load_corpus(filename: str, g: city.CityGraph) -> Corpus:
+    """Loads a corpus saved with save_corpus. Raises ValueError if it was
+    generated from a City graph different from g."""
+
+    with open(filename) as file:
+        header: Dict = json.loads(file.readline())
+        header.pop('seed')
+        if header != graph_summary(g):
+            raise ValueError("%s was generated from another City graph "
+                             "(%s instead of %s)" %
+                             (filename, header, graph_summary(g)))
+        return [GoldenRoute(**json.loads(line)) for line in file
+                if line.strip()]
+
+
+def build_engines(g: city.CityGraph, reduced: city.CityGraph,
+                  table: metro.MetroTable) -> Dict[str, Engine]:
+    """Returns the routing engines to check, by name: networkx, the
+    unidirectional and the bidirectional searches of the routing module,
+    all of them over the City graph g, and the routing of the bot over the
+    reduced City graph, exact and composed with the MetroTable of the Metro
+    graph. Other engines are checked by adding them here (and to
+    APPROXIMATE_ENGINES if they are not exact)."""
+
+    rg: routing.RoutingGraph = routing.build_routing_graph(g)
+    reduced_rg: routing.RoutingGraph = routing.build_routing_graph(reduced)
+
+    def networkx_engine(source: city.NodeID,
+                        target: city.NodeID) -> Tuple[float, city.Path]:
+        return networkx.single_source_dijkstra(g, source, target,
+                                               weight='travel_time')
+
+    def array_engine(search: Callable) -> Engine:
+        def engine(source: city.NodeID,
+                   target: city.NodeID) -> Tuple[float, city.Path]:
+            minutes, path, _ = search(rg, rg.registry.dense(source),
+                                      rg.registry.dense(target))
+            return minutes, routing.external_path(rg, path)
+        return engine
+
+    def reduced_engine(table: Optional[metro.MetroTable]) -> Engine:
+        def engine(source: city.NodeID,
+                   target: city.NodeID) -> Tuple[float, city.Path]:
+            minutes, path = routing.crossing_route(reduced_rg, source,
+                                                   target, table)
+            return minutes, city.expand_path(reduced, path)
+        return engine
+
+    return {'networkx': networkx_engine,
+            'dijkstra': array_engine(routing.dijkstra_path),
+            'bidirectional': array_engine(routing.bidirectional_path),
+            'reduced': reduced_engine(None),
+            'table': reduced_engine(table)}
+
+
+def valid_path(g: city.CityGraph, p: city.Path, route: GoldenRoute,
+               minutes: float) -> bool:
+    """Returns True if p is a path of g between the crossings of the route
+    with a travel time of the given minutes."""
+
+    return p[:1] == route.path[:1] and p[-1:] == route.path[-1:] \
+        and all(g.has_edge(u, v) for u, v in city.get_edges_from_path(p)) \
+        and abs(path_time(g, p) - minutes) <= TOLERANCE
+
+
+def check_engine(g: city.CityGraph, corpus: Corpus, engine: Engine,
+                 exact: bool = True) -> EngineResult:
+    """Finds the route of every pair of the corpus with the engine and
+    compares it with the golden one. A route matches if it has the same
+    travel time and the same path or, if the path is different, the path
+    is a path of g between the same crossings with the same travel time.
+    If the engine is not exact, a route matches if it is a path of g
+    between the same crossings that is not faster than the golden one."""
+
+    result = EngineResult([], 0, [])
+    for i, route in enumerate(corpus):
+        start: float = time.perf_counter()
+        minutes, path = engine(route.path[0], route.path[-1])
+        result.latencies.append(time.perf_counter() - start)
+
+        if not exact:
+            result.deviations.append(minutes - route.time)
+            if minutes < route.time - TOLERANCE or \
+                    not valid_path(g, path, route, minutes):
+                result.mismatches.append(i)
+        elif abs(minutes - route.time) > TOLERANCE:
+            result.mismatches.append(i)
+        elif path != route.path:
+            if valid_path(g, path, route, route.time):
+                result.ties += 1
+            else:
+                result.mismatches.append(i)
+    return result
+
+
+def check_engines(g: city.CityGraph, corpus: Corpus,
+                  engines: Dict[str, Engine]) -> Dict[str, EngineResult]:
+    """Checks every engine against the corpus."""
+
+    return {name: check_engine(g, corpus, engine,
+                               name not in APPROXIMATE_ENGINES)
+            for name, engine in engines.items()}
+
+
+def report(corpus: Corpus, results: Dict[str, EngineResult]) -> None:
+    """Prints the results of the engines."""
+
+    print("%d routes" % len(corpus))
+    print("%-14s %10s %6s %9s %9s %9s %9s" %
+          ("engine", "mismatches", "ties", "p50 ms", "p95 ms", "p99 ms",
+           "max ms"))
+    for name, result in results.items():
+        values = np.array(result.latencies) * 1000
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        print("%-14s %10d %6d %9.3f %9.3f %9.3f %9.3f" %
+              (name, len(result.mismatches), result.ties, p50, p95, p99,
+               values.max()))
+        for i in result.mismatches[:5]:
+            print("    %s -> %s" % (corpus[i].src, corpus[i].dst))
+
+    for name, result in results.items():
+        if not result.deviations:
+            continue
+        deviations = np.array(result.deviations)
+        found = np.isfinite(deviations)
+        slower = deviations[found] > TOLERANCE
+        print("%s: %d of %d routes slower than the golden ones, by %.2f "
+              "min on average (%.1f%% of the total time) and %.2f min at "
+              "most, %d routes not found" %
+              (name, slower.sum(), len(deviations),
+               deviations[found][slower].mean() if slower.any() else 0.0,
+               100 * deviations[found].sum() /
+               sum(route.time for route, ok in zip(corpus, found) if ok),
+               deviations[found].max(), (~found).sum()))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Regression test of the routes of Metro-Bot.")
+    parser.add_argument('--pairs', type=int, default=2000,
+                        help="pairs of locations of a new corpus")
+    parser.add_argument('--seed', type=int, default=2022)
+    parser.add_argument('--corpus', default=CORPUS_FILE,
+                        help="file of the corpus (generated if missing)")
+    parser.add_argument('--generate', action='store_true',
+                        help="generate the corpus even if it exists")
+    args = parser.parse_args()
+
+    streets: city.OsmnxGraph = city.get_osmnx_graph()
+    g: city.CityGraph = city.build_city_graph(
+        streets, metro.get_metro_graph(), reduce=False)
+    metro_graph: metro.MetroGraph = metro.get_metro_graph()
+    table: metro.MetroTable = metro.build_metro_table(metro_graph)
+    reduced: city.CityGraph = city.build_city_graph(streets, metro_graph)
+
+    corpus: Corpus
+    if args.generate or not os.path.exists(args.corpus):
+        corpus = generate_corpus(streets, g, args.pairs, args.seed)
+        save_corpus(args.corpus, corpus, g, args.seed)
+    else:
+        corpus = load_corpus(args.corpus, g)
+
+    results: Dict[str, EngineResult] = check_engines(
+        g, corpus, build_engines(g, reduced, table))
+    report(corpus, results)
+    if any(result.mismatches for result in results.values()):
+        sys.exit("Some routes differ from the corpus")
+
+
+if __name__ == '__main__':
+    main()
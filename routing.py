@@ -0,0 +1,1051 @@
+import math
+import heapq
+import threading
+import numpy as np
+import osmnx as ox
+from math import inf
+from array import array
+from enum import IntEnum
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional, Set, Tuple
+from typing_extensions import TypeAlias
+import city
+import metro
+
+
+"""
+Module that contains the code related to the array based representation of
+the City graph and the routing algorithms that work over it. Nodes are
+identified by their dense ids of the NodeRegistry of the City graph.
+"""
+
+
+class EdgeType(IntEnum):
+    """Types of the edges of the City graph."""
+
+    STREET = 0
+    ACCESS_ENTRY = 1
+    ACCESS_ROUTE = 2
+    TRANSFER = 3
+    METRO = 4
+    OTHER = 5  # Edges from/to the source and destination.
+
+
+# Names of the edge types, as stored in the 'type' attribute of the edges
+# (metro edges are named "Metro line nº <line>").
+EDGE_TYPES: Dict[str, EdgeType] = {
+    "Street": EdgeType.STREET,
+    "Access entry": EdgeType.ACCESS_ENTRY,
+    "Access route": EdgeType.ACCESS_ROUTE,
+    "Connection between two different lines": EdgeType.TRANSFER}
+METRO_EDGE_PREFIX: str = "Metro line nº "
+
+# Minutes needed to get into a train once on the platform, and extra
+# minutes of walking along the corridors of a transfer between lines.
+BOARDING_TIME: float = 0.5
+TRANSFER_PENALTY: float = 1.0
+
+# Headways (minutes between trains) of the metro lines along the day. Each
+# band is (starting minute of the day, headway) and lasts until the next
+# one starts. An infinite headway means there is no service.
+CONVENTIONAL_HEADWAYS: List[Tuple[float, float]] = [
+    (0, inf), (5 * 60, 6), (7 * 60, 3), (9.5 * 60, 4.5), (17 * 60, 3.5),
+    (20.5 * 60, 6)]
+AUTOMATIC_HEADWAYS: List[Tuple[float, float]] = [
+    (0, inf), (5 * 60, 8), (7 * 60, 7), (9.5 * 60, 9), (17 * 60, 7),
+    (20.5 * 60, 10)]
+HEADWAYS: Dict[str, List[Tuple[float, float]]] = {
+    "L1": CONVENTIONAL_HEADWAYS,
+    "L2": CONVENTIONAL_HEADWAYS,
+    "L3": CONVENTIONAL_HEADWAYS,
+    "L4": CONVENTIONAL_HEADWAYS,
+    "L5": CONVENTIONAL_HEADWAYS,
+    "L9N": AUTOMATIC_HEADWAYS,
+    "L9S": AUTOMATIC_HEADWAYS,
+    "L10N": AUTOMATIC_HEADWAYS,
+    "L10S": AUTOMATIC_HEADWAYS,
+    "L11": AUTOMATIC_HEADWAYS,
+    "FM": [(0, inf), (5 * 60, 15), (22 * 60, inf)]}
+
+MINUTES_PER_DAY: float = 24 * 60
+
+# Value of the 'accessibility' attribute of the accesses that can be used
+# by people with reduced mobility.
+ACCESSIBLE: str = "Accessible"
+
+# Meters walked per minute along the Streets (see city.add_street), to know
+# the distance walked along part of a Street.
+WALKING_SPEED: float = 100.0
+
+# Bounds of the multi-criteria search: how many times slower than the
+# fastest route a route can be, labels kept per node, line changes allowed,
+# labels created in total and routes returned.
+MAX_DELAY: float = 1.5
+MAX_LABELS_PER_NODE: int = 6
+MAX_TRANSFERS: int = 3
+MAX_LABELS: int = 500000
+MAX_ROUTES: int = 4
+
+# Difference of walked distance (meters) that is considered too small to
+# keep two different routes.
+EPSILON_WALKING: float = 100.0
+
+# Number of accesses near the source and the destination that are tried in
+# the routes composed with the MetroTable.
+NEARBY_ACCESSES: int = 8
+
+# Largest generation of a search Workspace (its stamps are unsigned 32-bit
+# integers).
+MAX_GENERATION: int = 2**32 - 1
+
+# List of dense node ids, in order of traversal.
+DensePath: TypeAlias = List[int]
+
+# Nodes where a search starts (dense ids), with their initial times.
+Seeds: TypeAlias = List[Tuple[int, float]]
+
+# Trains of a line along a day: for each band of headways with service, the
+# minute of its first train, the headway and the minute of its last train.
+Schedule: TypeAlias = List[Tuple[float, float, float]]
+
+
+@dataclass
+class Route:
+    """Representation of a Route of a Pareto set, with its three
+    criteria."""
+
+    time: float  # Minutes.
+    walking: float  # Meters walked.
+    transfers: int  # Number of line changes.
+    path: List  # Dense ids (ids of the City graph in find_routes).
+
+
+@dataclass(frozen=True, eq=False)
+class RoutingGraph:
+    """Array (CSR) representation of a City graph. The edges leaving the node
+    i are the positions indptr[i]:indptr[i + 1] of the edge arrays. Since the
+    City graph is undirected, every edge appears once in each direction.
+
+    A RoutingGraph is immutable (its arrays are read-only and assigning its
+    attributes raises), so it can be shared by searches running in several
+    threads."""
+
+    registry: city.NodeRegistry
+    indptr: np.ndarray  # int32 array of N + 1 offsets.
+    heads: np.ndarray  # int32 array of the destination of each edge.
+    travel_time: np.ndarray  # float64 array, in minutes.
+    distance: np.ndarray  # float64 array, in meters.
+    types: np.ndarray  # int8 array of EdgeType.
+    lines: np.ndarray  # int16 array of indices into line_names (or -1).
+    line_names: Tuple[str, ...]
+    accessible: np.ndarray  # bool array, False for non-accessible accesses.
+    # Crossings contracted into Streets: ends of their Street (dense ids),
+    # each one followed by the travel time to it.
+    contracted: Dict[city.NodeID, Tuple[int, float, int, float]]
+
+    def __post_init__(self) -> None:
+        arrays: Dict[str, np.ndarray] = {'indptr': self.indptr,
+                                         'heads': self.heads,
+                                         'travel_time': self.travel_time,
+                                         'distance': self.distance,
+                                         'types': self.types,
+                                         'lines': self.lines,
+                                         'accessible': self.accessible}
+        for name, values in arrays.items():
+            values.setflags(write=False)
+            # Memoryviews of the arrays (sharing their memory), since
+            # indexing them from the search loops is much faster than
+            # indexing numpy.
+            object.__setattr__(self, 'view_' + name, memoryview(values))
+        for values in (self.registry.types, self.registry.coords,
+                       self.registry.colors):
+            values.setflags(write=False)
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def neighbours(self, node: int) -> range:
+        """Returns the positions of the edges that leave the node."""
+
+        return range(self.view_indptr[node], self.view_indptr[node + 1])
+
+
+def edge_type(name: str) -> EdgeType:
+    """Returns the EdgeType of an edge from the name of its type."""
+
+    if name.startswith(METRO_EDGE_PREFIX):
+        return EdgeType.METRO
+    return EDGE_TYPES.get(name, EdgeType.OTHER)
+
+
+def build_routing_graph(g: city.CityGraph) -> RoutingGraph:
+    """Returns the RoutingGraph of the City graph g, using the registry of g
+    (or a new one if g has not been compacted)."""
+
+    registry: city.NodeRegistry = g.graph.get('registry') or \
+        city.build_node_registry(g)
+    n: int = len(registry)
+
+    tails: List[int] = []
+    heads: List[int] = []
+    times: List[float] = []
+    distances: List[float] = []
+    types: List[int] = []
+    lines: List[int] = []
+    line_names: List[str] = []
+    line_index: Dict[str, int] = {}
+
+    for u, v, eattr in g.edges(data=True):
+        kind: EdgeType = edge_type(eattr['type'])
+        line: int = -1
+        if kind == EdgeType.METRO:
+            name: str = eattr['type'][len(METRO_EDGE_PREFIX):]
+            if name not in line_index:
+                line_index[name] = len(line_names)
+                line_names.append(name)
+            line = line_index[name]
+
+        i, j = registry.dense(u), registry.dense(v)
+        for tail, head in ((i, j), (j, i)):
+            tails.append(tail)
+            heads.append(head)
+            times.append(eattr['travel_time'])
+            distances.append(eattr['distance'])
+            types.append(kind)
+            lines.append(line)
+
+    accessible = np.ones(n, dtype=np.bool_)
+    for node, accessibility in g.nodes(data='accessibility'):
+        if accessibility is not None and accessibility != ACCESSIBLE:
+            accessible[registry.dense(node)] = False
+
+    contracted: Dict[city.NodeID, Tuple[int, float, int, float]] = {}
+    for node in g.graph.get('contracted', {}):
+        u, to_u, v, to_v = city.street_offsets(g, node)
+        contracted[node] = (registry.dense(u), to_u, registry.dense(v), to_v)
+
+    # The edges are sorted by their tail to build the CSR offsets.
+    order = np.argsort(np.array(tails, dtype=np.int32), kind='stable')
+    counts = np.bincount(np.array(tails, dtype=np.int64), minlength=n)
+    indptr = np.zeros(n + 1, dtype=np.int32)
+    np.cumsum(counts, out=indptr[1:])
+
+    return RoutingGraph(registry,
+                        indptr,
+                        np.array(heads, dtype=np.int32)[order],
+                        np.array(times, dtype=np.float64)[order],
+                        np.array(distances, dtype=np.float64)[order],
+                        np.array(types, dtype=np.int8)[order],
+                        np.array(lines, dtype=np.int16)[order],
+                        tuple(line_names),
+                        accessible,
+                        contracted)
+
+
+def headway(line: str, minute: float) -> float:
+    """Returns the minutes between trains of the line at the given minute of
+    the day."""
+
+    minute %= MINUTES_PER_DAY
+    current: float = inf
+    for start, minutes in HEADWAYS.get(line, CONVENTIONAL_HEADWAYS):
+        if start > minute:
+            break
+        current = minutes
+    return current
+
+
+def build_schedule(headways: List[Tuple[float, float]]) -> Schedule:
+    """Returns the Schedule of a line with the given headways. The trains of
+    each band continue from the last train of the previous band (or start
+    with the band if there was no service), so they form a single sorted
+    sequence of departures."""
+
+    schedule: Schedule = []
+    last: Optional[float] = None
+    for i, (start, minutes) in enumerate(headways):
+        end: float = headways[i + 1][0] if i + 1 < len(headways) \
+            else MINUTES_PER_DAY
+        if minutes == inf:
+            last = None
+            continue
+        if minutes == 0:  # A train always ready to leave.
+            schedule.append((start, 0.0, end))
+            last = None
+            continue
+        first: float = start if last is None else last + minutes
+        if first >= end:
+            continue
+        last = first + math.ceil((end - first) / minutes - 1) * minutes
+        schedule.append((first, minutes, last))
+    return schedule
+
+
+SCHEDULES: Dict[str, Schedule] = {line: build_schedule(headways)
+                                  for line, headways in HEADWAYS.items()}
+CONVENTIONAL_SCHEDULE: Schedule = build_schedule(CONVENTIONAL_HEADWAYS)
+
+
+def next_departure(line: str, minute: float) -> float:
+    """Returns the minute (counted from the same day as minute) of the first
+    train of the line that leaves at the given minute or later."""
+
+    schedule: Schedule = SCHEDULES.get(line, CONVENTIONAL_SCHEDULE)
+    if not schedule:
+        return inf
+    day: float = math.floor(minute / MINUTES_PER_DAY) * MINUTES_PER_DAY
+    time: float = minute - day
+    for first, minutes, last in schedule:
+        if time <= last and minutes == 0:
+            return max(minute, day + first)
+        if time <= last:
+            trains: int = max(0, math.ceil((time - first) / minutes))
+            return max(minute, day + first + trains * minutes)
+    return day + MINUTES_PER_DAY + schedule[0][0]  # First train of tomorrow.
+
+
+def waiting_time(line: str, minute: float) -> float:
+    """Returns the minutes to wait for the next train of the line when
+    arriving at the platform at the given minute of the day. The departures
+    of the line are a single sorted sequence (see build_schedule), so
+    arriving later never means leaving earlier (the waiting is FIFO)."""
+
+    return next_departure(line, minute) - minute
+
+
+def time_dependent_path(rg: RoutingGraph, source: int, target: int,
+                        departure: float) -> Tuple[float, DensePath]:
+    """Returns the travel time (in minutes) and the path of the fastest route
+    from source to target leaving at the minute of the day departure, taking
+    into account the waiting time for the trains of each line and the
+    penalties of boarding and transferring.
+
+    The search is a time-dependent Dijkstra over (node, on board) states: a
+    station is reached on board after a metro edge, so continuing along the
+    line costs no waiting, while boarding from the platform does."""
+
+    return time_dependent_search(rg, [(source, 0.0)], [(target, 0.0)],
+                                 departure)
+
+
+def time_dependent_search(rg: RoutingGraph, sources: Seeds, targets: Seeds,
+                          departure: float) -> Tuple[float, DensePath]:
+    """Same as time_dependent_path, but the route starts at one of the
+    sources and ends at one of the targets, whose initial times are walked
+    before and after the search (as in bidirectional_search). The states
+    are kept in the Workspace of the thread: the side of a state is whether
+    it is on board."""
+
+    indptr, heads = rg.view_indptr, rg.view_heads
+    weights, types, lines = rg.view_travel_time, rg.view_types, rg.view_lines
+    metro: int = EdgeType.METRO
+    transfer: int = EdgeType.TRANSFER
+    workspace: Workspace = get_workspace(rg)
+    generation: int = workspace.begin()
+    times, parents = workspace.times, workspace.parents
+    reached, settled = workspace.reached, workspace.settled
+    ends: Dict[int, float] = seed_times(targets)
+
+    # The heap and the parents hold states 2 * node + on_board.
+    heap: List[Tuple[float, int]] = workspace.heap()
+    for root, time in seed_times(sources).items():
+        times[0][root] = departure + time
+        parents[0][root] = -1
+        reached[0][root] = generation
+        heap.append((departure + time, 2 * root))
+    heapq.heapify(heap)
+
+    arrival: float = inf
+    final: int = -1
+    try:
+        while heap and heap[0][0] < arrival:
+            time, state = heapq.heappop(heap)
+            node, on_board = state >> 1, state & 1
+            if settled[on_board][node] == generation:
+                continue
+            settled[on_board][node] = generation
+            if node in ends and time + ends[node] < arrival:
+                arrival = time + ends[node]
+                final = state
+
+            for e in range(indptr[node], indptr[node + 1]):
+                kind: int = types[e]
+                new_time: float = time + weights[e]
+                new_on_board: int = 0
+                if kind == metro:
+                    new_on_board = 1
+                    if not on_board:
+                        line: str = rg.line_names[lines[e]]
+                        new_time += BOARDING_TIME + \
+                            waiting_time(line, time + BOARDING_TIME)
+                elif kind == transfer:
+                    new_time += TRANSFER_PENALTY
+
+                head: int = heads[e]
+                if reached[new_on_board][head] != generation or \
+                        new_time < times[new_on_board][head]:
+                    reached[new_on_board][head] = generation
+                    times[new_on_board][head] = new_time
+                    parents[new_on_board][head] = state
+                    heapq.heappush(heap, (new_time, 2 * head + new_on_board))
+
+        if final == -1:
+            return inf, []
+
+        path: DensePath = []
+        state = final
+        while state != -1:
+            path.append(state >> 1)
+            state = parents[state & 1][state >> 1]
+        path.reverse()
+        return arrival - departure, path
+    finally:
+        workspace.release(heap)
+
+
+def external_path(rg: RoutingGraph, path: DensePath) -> List:
+    """Returns the path with the original ids of the City graph nodes."""
+
+    return [rg.registry.external(node) for node in path]
+
+
+def dominates(a: Tuple[float, float, int],
+              b: Tuple[float, float, int]) -> bool:
+    """Returns True if the criteria a are at least as good as b in every
+    criterion."""
+
+    return a[0] <= b[0] and a[1] <= b[1] and a[2] <= b[2]
+
+
+def almost_dominates(a: Tuple[float, float, int],
+                     b: Tuple[float, float, int]) -> bool:
+    """Returns True if the criteria a are at least as good as b in every
+    criterion, ignoring walked distances smaller than EPSILON_WALKING (so
+    the fastest route is never discarded)."""
+
+    return a[0] <= b[0] and a[1] <= b[1] + EPSILON_WALKING and a[2] <= b[2]
+
+
+def seed_times(seeds: Seeds) -> Dict[int, float]:
+    """Returns the smallest initial time of each node of the seeds."""
+
+    times: Dict[int, float] = {}
+    for root, time in seeds:
+        times[root] = min(time, times.get(root, inf))
+    return times
+
+
+def bounded_times(rg: RoutingGraph, targets: Seeds, sources: Seeds,
+                  accessible_only: bool = False) -> Dict[int, float]:
+    """Returns the shortest travel times from every node to the targets
+    (plus their initial times), as long as they are at most MAX_DELAY times
+    the time from the first source reached (nodes further away are not
+    included)."""
+
+    indptr, heads = rg.view_indptr, rg.view_heads
+    weights, accessible = rg.view_travel_time, rg.view_accessible
+
+    times: Dict[int, float] = {}
+    best: Dict[int, float] = seed_times(targets)
+    heap: List[Tuple[float, int]] = [(time, root)
+                                     for root, time in best.items()]
+    heapq.heapify(heap)
+    starts: Dict[int, float] = seed_times(sources)
+    bound: float = inf
+
+    while heap:
+        time, node = heapq.heappop(heap)
+        if node in times:
+            continue
+        if time > bound:
+            break
+        times[node] = time
+        if node in starts and bound == inf:
+            bound = (time + starts[node]) * MAX_DELAY
+
+        for e in range(indptr[node], indptr[node + 1]):
+            head: int = heads[e]
+            if accessible_only and not accessible[head]:
+                continue
+            new_time: float = time + weights[e]
+            if new_time < best.get(head, inf):
+                best[head] = new_time
+                heapq.heappush(heap, (new_time, head))
+
+    return times
+
+
+def pareto_filter(routes: List[Route]) -> List[Route]:
+    """Returns the routes sorted by their criteria (time first) without the
+    routes (almost) dominated by a previous one, so that none of the routes
+    left dominates another one."""
+
+    kept: List[Route] = []
+    for route in sorted(routes, key=lambda route: (route.time, route.walking,
+                                                   route.transfers)):
+        criteria = (route.time, route.walking, route.transfers)
+        if not any(almost_dominates((other.time, other.walking,
+                                     other.transfers), criteria)
+                   for other in kept):
+            kept.append(route)
+    return kept
+
+
+def pareto_paths(rg: RoutingGraph, source: int, target: int,
+                 accessible_only: bool = False) -> List[Route]:
+    """Returns the Pareto set of routes from source to target minimizing the
+    travel time, the walked distance and the number of line changes (sorted
+    by time, the first one is the fastest route). If accessible_only, the
+    non-accessible accesses are avoided.
+
+    The search is a bounded multi-label Dijkstra: labels (almost) dominated
+    by another label of the same node or of the target are discarded, and so
+    are labels that cannot reach the target in less than MAX_DELAY times
+    the fastest route (using the exact remaining times as lower bounds).
+    The number of labels per node (the slowest ones are dropped first), of
+    transfers and of labels in total are also capped to keep the latency
+    bounded."""
+
+    return pareto_search(rg, [(source, 0.0)], [(target, 0.0)],
+                         accessible_only)
+
+
+def pareto_search(rg: RoutingGraph, sources: Seeds, targets: Seeds,
+                  accessible_only: bool = False) -> List[Route]:
+    """Same as pareto_paths, but the routes start at one of the sources and
+    end at one of the targets, whose initial times are walked (e.g. along
+    part of a Street, see street_seeds)."""
+
+    indptr, heads = rg.view_indptr, rg.view_heads
+    weights, distances = rg.view_travel_time, rg.view_distance
+    types, accessible = rg.view_types, rg.view_accessible
+    metro: int = EdgeType.METRO
+    transfer: int = EdgeType.TRANSFER
+
+    remaining: Dict[int, float] = bounded_times(rg, targets, sources,
+                                                accessible_only)
+    starts: Dict[int, float] = {root: time for root, time
+                                in seed_times(sources).items()
+                                if root in remaining}
+    if not starts:
+        return []
+    bound: float = min(time + remaining[root]
+                       for root, time in starts.items()) * MAX_DELAY
+    ends: Dict[int, float] = seed_times(targets)
+
+    # Labels are stored by their position in these lists.
+    label_node: List[int] = []
+    label_criteria: List[Tuple[float, float, int]] = []
+    label_parent: List[int] = []
+
+    bags: Dict[int, List[int]] = {}  # Live labels of each node.
+    heap: List[Tuple[float, float, int, int]] = []
+    for root, time in starts.items():
+        bags[root] = [len(label_node)]
+        heap.append((time, time * WALKING_SPEED, 0, len(label_node)))
+        label_node.append(root)
+        label_criteria.append(heap[-1][:3])
+        label_parent.append(-1)
+    heapq.heapify(heap)
+    results: List[int] = []
+    # Criteria of each result, including the walk from its target.
+    result_criteria: Dict[int, Tuple[float, float, int]] = {}
+
+    while heap:
+        time, walking, transfers, label = heapq.heappop(heap)
+        node: int = label_node[label]
+        if label not in bags[node]:  # Removed by a later label.
+            continue
+        if node in ends:
+            results.append(label)
+            result_criteria[label] = (time + ends[node],
+                                      walking + ends[node] * WALKING_SPEED,
+                                      transfers)
+            continue
+
+        for e in range(indptr[node], indptr[node + 1]):
+            head: int = heads[e]
+            if head not in remaining or \
+                    (accessible_only and not accessible[head]):
+                continue
+            kind: int = types[e]
+            new_criteria = (time + weights[e],
+                            walking if kind == metro
+                            else walking + distances[e],
+                            transfers + (kind == transfer))
+            if new_criteria[2] > MAX_TRANSFERS or \
+                    new_criteria[0] + remaining[head] > bound:
+                continue
+
+            # Lower bound of the criteria of the label at the target.
+            optimistic = (new_criteria[0] + remaining[head],
+                          new_criteria[1], new_criteria[2])
+            if any(almost_dominates(result_criteria[r], optimistic)
+                   for r in results):
+                continue
+            bag: List[int] = bags.setdefault(head, [])
+            if any(almost_dominates(label_criteria[other], new_criteria)
+                   for other in bag):
+                continue
+            if len(label_node) >= MAX_LABELS:  # The search stops here.
+                heap.clear()
+                break
+
+            bag[:] = [other for other in bag
+                      if not dominates(new_criteria, label_criteria[other])]
+            if len(bag) >= MAX_LABELS_PER_NODE:
+                # The slowest label is dropped, so the fastest route is
+                # never lost.
+                slowest: int = max(bag, key=label_criteria.__getitem__)
+                if label_criteria[slowest] <= new_criteria:
+                    continue
+                bag.remove(slowest)
+
+            new_label: int = len(label_node)
+            label_node.append(head)
+            label_criteria.append(new_criteria)
+            label_parent.append(label)
+            bag.append(new_label)
+            heapq.heappush(heap, new_criteria + (new_label,))
+
+    routes: List[Route] = []
+    for label in results:
+        path: DensePath = []
+        end: int = label
+        while end != -1:
+            path.append(label_node[end])
+            end = label_parent[end]
+        path.reverse()
+        routes.append(Route(*result_criteria[label], path))
+
+    return pareto_filter(routes)[:MAX_ROUTES]
+
+
+def walk_to_accesses(rg: RoutingGraph, sources: Seeds, targets: Set[int],
+                     k: int) -> Tuple[Dict[int, float], Dict[int, int],
+                                      List[int]]:
+    """Dijkstra from the sources only along Streets that stops once k
+    accesses (or one of the targets) are reached. Returns the walking times,
+    the parents of the settled nodes and the accesses found."""
+
+    indptr, heads = rg.view_indptr, rg.view_heads
+    weights, types = rg.view_travel_time, rg.view_types
+    node_types = memoryview(rg.registry.types)
+    access: int = city.NodeType.ACCESS
+    walking = {int(EdgeType.STREET), int(EdgeType.ACCESS_ENTRY),
+               int(EdgeType.OTHER)}
+
+    times: Dict[int, float] = {}
+    best: Dict[int, float] = {}
+    for root, time in sources:
+        best[root] = min(time, best.get(root, inf))
+    parent: Dict[int, int] = {}
+    accesses: List[int] = []
+    heap: List[Tuple[float, int]] = [(time, root)
+                                     for root, time in best.items()]
+    heapq.heapify(heap)
+
+    while heap and len(accesses) < k:
+        time, node = heapq.heappop(heap)
+        if node in times:
+            continue
+        times[node] = time
+        if node in targets:
+            break
+        if node_types[node] == access:  # The walk ends at the access.
+            accesses.append(node)
+            continue
+
+        for e in range(indptr[node], indptr[node + 1]):
+            if types[e] not in walking:
+                continue
+            head: int = heads[e]
+            new_time: float = time + weights[e]
+            if new_time < best.get(head, inf):
+                best[head] = new_time
+                parent[head] = node
+                heapq.heappush(heap, (new_time, head))
+
+    return times, parent, accesses
+
+
+def walked_path(parent: Dict[int, int], node: int) -> DensePath:
+    """Returns the path from the root of a search to the node."""
+
+    path: DensePath = [node]
+    while node in parent:
+        node = parent[node]
+        path.append(node)
+    path.reverse()
+    return path
+
+
+def table_path(rg: RoutingGraph, table: metro.MetroTable, source: int,
+               target: int) -> Tuple[float, DensePath]:
+    """Returns the travel time and the path of the fastest route from source
+    to target composed of a walk to one of the NEARBY_ACCESSES nearest
+    accesses, a trip through the Metro looked up in the table and a walk
+    from one of the accesses nearest to the target. If the walk from the
+    source reaches the target first, the route is just that walk.
+
+    The route is approximate: it is never faster than the fastest one (it
+    is a path of the graph), but it may be slower, e.g. if the fastest
+    route uses an access further away or walks along the tracks."""
+
+    return table_search(rg, table, [(source, 0.0)], [(target, 0.0)])
+
+
+def table_search(rg: RoutingGraph, table: metro.MetroTable, sources: Seeds,
+                 targets: Seeds) -> Tuple[float, DensePath]:
+    """Same as table_path, but each walk starts from several nodes, each one
+    with its own initial time (as in bidirectional_search)."""
+
+    target_times: Dict[int, float] = {}
+    for root, time in targets:
+        target_times[root] = min(time, target_times.get(root, inf))
+    src_times, src_parent, src_accesses = walk_to_accesses(
+        rg, sources, set(target_times), NEARBY_ACCESSES)
+    reached: List[int] = [node for node in target_times if node in src_times]
+    if reached:
+        end: int = min(reached,
+                       key=lambda node: src_times[node] + target_times[node])
+        return src_times[end] + target_times[end], walked_path(src_parent,
+                                                               end)
+
+    dst_times, dst_parent, dst_accesses = walk_to_accesses(
+        rg, list(target_times.items()), {root for root, _ in sources},
+        NEARBY_ACCESSES)
+    if not src_accesses or not dst_accesses:
+        return inf, []
+
+    external = rg.registry.external
+    rows = [table.index[external(a)] for a in src_accesses]
+    cols = [table.index[external(b)] for b in dst_accesses]
+    totals = np.array([src_times[a] for a in src_accesses])[:, None] + \
+        table.times[np.ix_(rows, cols)] + \
+        np.array([dst_times[b] for b in dst_accesses])[None, :]
+    i, j = np.unravel_index(np.argmin(totals), totals.shape)
+    if totals[i, j] == inf:
+        return inf, []
+
+    path: DensePath = walked_path(src_parent, src_accesses[i])
+    for fid in table.path(external(src_accesses[i]),
+                          external(dst_accesses[j]))[1:]:
+        path.append(rg.registry.dense(fid))
+    path.extend(reversed(walked_path(dst_parent, dst_accesses[j])[:-1]))
+
+    return float(totals[i, j]), path
+
+
+class Workspace:
+    """Scratch state of the searches of one thread over one RoutingGraph:
+    tentative times, parents and settled flags of the nodes (one set for
+    each direction of a search) and a pool of heaps. The arrays are
+    allocated once and stamped with generations: an entry is only valid if
+    its stamp is the generation of the current search, so starting a search
+    invalidates the previous one in O(1) and each search only touches the
+    nodes it reaches."""
+
+    def __init__(self, rg: RoutingGraph) -> None:
+        n: int = len(rg)
+        self.graph: RoutingGraph = rg
+        self.generation: int = 0
+        self.times: Tuple[array, array] = (array('d', [inf]) * n,
+                                           array('d', [inf]) * n)
+        self.parents: Tuple[array, array] = (array('i', [-1]) * n,
+                                             array('i', [-1]) * n)
+        # Generation in which each node was reached and settled.
+        self.reached: Tuple[array, array] = (array('I', [0]) * n,
+                                             array('I', [0]) * n)
+        self.settled: Tuple[array, array] = (array('I', [0]) * n,
+                                             array('I', [0]) * n)
+        self._heaps: List[List] = []
+
+    def begin(self) -> int:
+        """Starts a new search and returns its generation. The stamps are
+        only cleared when the generation counter wraps around."""
+
+        if self.generation == MAX_GENERATION:
+            for stamps in self.reached + self.settled:
+                stamps[:] = array('I', [0]) * len(stamps)
+            self.generation = 0
+        self.generation += 1
+        return self.generation
+
+    def heap(self) -> List:
+        """Returns an empty heap from the pool."""
+
+        return self._heaps.pop() if self._heaps else []
+
+    def release(self, *heaps: List) -> None:
+        """Returns the heaps to the pool."""
+
+        for heap in heaps:
+            heap.clear()
+            self._heaps.append(heap)
+
+
+# Workspace of each thread.
+_workspaces = threading.local()
+
+
+def get_workspace(rg: RoutingGraph) -> Workspace:
+    """Returns the Workspace of the current thread for the graph rg."""
+
+    workspace: Optional[Workspace] = getattr(_workspaces, 'workspace', None)
+    if workspace is None or workspace.graph is not rg:
+        workspace = Workspace(rg)
+        _workspaces.workspace = workspace
+    return workspace
+
+
+def workspace_path(parents: array, node: int) -> DensePath:
+    """Returns the path from the root of a search to the node, following
+    the parents stored in a Workspace."""
+
+    path: DensePath = [node]
+    while parents[node] != -1:
+        node = parents[node]
+        path.append(node)
+    path.reverse()
+    return path
+
+
+def bidirectional_path(rg: RoutingGraph, source: int,
+                       target: int) -> Tuple[float, DensePath, int]:
+    """Returns the travel time and the path of the fastest route from source
+    to target, and the number of nodes settled to find it. Two Dijkstra
+    searches grow alternately from source and from target (the graph is
+    undirected, so the backward search uses the same edges) and stop once
+    the sum of the smallest keys of both queues reaches the best meeting
+    time found so far."""
+
+    return bidirectional_search(rg, [(source, 0.0)], [(target, 0.0)])
+
+
+def bidirectional_search(rg: RoutingGraph, sources: Seeds,
+                         targets: Seeds) -> Tuple[float, DensePath, int]:
+    """Same as bidirectional_path, but each search starts from several
+    nodes, each one with its own initial time (as if they were joined to a
+    virtual source or target). The path starts at one of the sources and
+    ends at one of the targets."""
+
+    indptr, heads = rg.view_indptr, rg.view_heads
+    weights = rg.view_travel_time
+    workspace: Workspace = get_workspace(rg)
+    generation: int = workspace.begin()
+    times, parents = workspace.times, workspace.parents
+    reached, settled = workspace.reached, workspace.settled
+
+    # Index 0 is the forward search and 1 the backward one.
+    heaps: Tuple[List, List] = (workspace.heap(), workspace.heap())
+    for side, seeds in ((0, sources), (1, targets)):
+        for root, time in seeds:
+            if reached[side][root] != generation or \
+                    time < times[side][root]:
+                times[side][root] = time
+                parents[side][root] = -1
+                reached[side][root] = generation
+                heapq.heappush(heaps[side], (time, root))
+
+    meeting_time: float = inf
+    meeting: int = sources[0][0]
+    for root, _ in targets:
+        if reached[0][root] == generation and \
+                times[0][root] + times[1][root] < meeting_time:
+            meeting_time = times[0][root] + times[1][root]
+            meeting = root
+    count: int = 0
+    try:
+        while heaps[0] and heaps[1] and \
+                heaps[0][0][0] + heaps[1][0][0] < meeting_time:
+            # The search with the smallest queue is grown.
+            side: int = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+            time, node = heapq.heappop(heaps[side])
+            if settled[side][node] == generation:
+                continue
+            settled[side][node] = generation
+            count += 1
+
+            own, other = times[side], times[1 - side]
+            own_reached, other_reached = reached[side], reached[1 - side]
+            own_parents, heap = parents[side], heaps[side]
+            for e in range(indptr[node], indptr[node + 1]):
+                head: int = heads[e]
+                new_time: float = time + weights[e]
+                if own_reached[head] != generation or new_time < own[head]:
+                    own_reached[head] = generation
+                    own[head] = new_time
+                    own_parents[head] = node
+                    heapq.heappush(heap, (new_time, head))
+                if other_reached[head] == generation and \
+                        new_time + other[head] < meeting_time:
+                    meeting_time = new_time + other[head]
+                    meeting = head
+
+        if meeting_time == inf:
+            return inf, [], count
+
+        path: DensePath = workspace_path(parents[0], meeting)
+        path.extend(reversed(workspace_path(parents[1], meeting)[:-1]))
+        return meeting_time, path, count
+    finally:
+        workspace.release(*heaps)
+
+
+def dijkstra_path(rg: RoutingGraph, source: int,
+                  target: int) -> Tuple[float, DensePath, int]:
+    """Returns the travel time and the path of the fastest route from source
+    to target, and the number of nodes settled to find it, with a
+    unidirectional Dijkstra that stops when the target is settled."""
+
+    indptr, heads = rg.view_indptr, rg.view_heads
+    weights = rg.view_travel_time
+    workspace: Workspace = get_workspace(rg)
+    generation: int = workspace.begin()
+    times, parents = workspace.times[0], workspace.parents[0]
+    reached, settled = workspace.reached[0], workspace.settled[0]
+    heap: List = workspace.heap()
+
+    times[source] = 0.0
+    parents[source] = -1
+    reached[source] = generation
+    heap.append((0.0, source))
+    count: int = 0
+    try:
+        while heap:
+            time, node = heapq.heappop(heap)
+            if settled[node] == generation:
+                continue
+            settled[node] = generation
+            count += 1
+            if node == target:
+                return time, workspace_path(parents, target), count
+
+            for e in range(indptr[node], indptr[node + 1]):
+                head: int = heads[e]
+                new_time: float = time + weights[e]
+                if reached[head] != generation or new_time < times[head]:
+                    reached[head] = generation
+                    times[head] = new_time
+                    parents[head] = node
+                    heapq.heappush(heap, (new_time, head))
+
+        return inf, [], count
+    finally:
+        workspace.release(heap)
+
+
+def nearest_crossing(rg: RoutingGraph, streets: city.OsmnxGraph,
+                     coord: city.Coord) -> city.NodeID:
+    """Same as city.nearest_crossing, for the City graph of rg."""
+
+    node: city.NodeID = ox.distance.nearest_nodes(streets, coord[0], coord[1])
+    if node not in rg.registry and node not in rg.contracted:
+        node = rg.registry.nearest(coord, city.NodeType.CROSSING)
+    return node
+
+
+def street_seeds(rg: RoutingGraph, node: city.NodeID) -> Seeds:
+    """Returns the seeds of a search from (or to) the crossing node: the
+    node itself or, if it was contracted, the ends of its Street."""
+
+    if node in rg.contracted:
+        u, to_u, v, to_v = rg.contracted[node]
+        return [(u, to_u), (v, to_v)]
+    return [(rg.registry.dense(node), 0.0)]
+
+
+def find_route(rg: RoutingGraph, streets: city.OsmnxGraph, src: city.Coord,
+               dst: city.Coord, table: Optional[metro.MetroTable] = None,
+               departure: Optional[float] = None
+               ) -> Tuple[float, city.Path]:
+    """Returns the travel time and the path (with the ids of the City graph)
+    of the fastest route between the crossings nearest to the coordinates
+    src and dst. Unlike city.find_path, no graph is modified. If the City
+    graph was reduced, the ends of the path may be contracted crossings
+    (see city.expand_path). If a MetroTable of the Metro graph merged into
+    the City graph is given, the route is composed with it (see table_path)
+    instead of searched exactly, unless no route can be composed. If the
+    minute of the day departure is given, the route waits for the trains
+    instead (see time_dependent_path)."""
+
+    return crossing_route(rg, nearest_crossing(rg, streets, src),
+                          nearest_crossing(rg, streets, dst), table,
+                          departure)
+
+
+def crossing_route(rg: RoutingGraph, source: city.NodeID,
+                   target: city.NodeID,
+                   table: Optional[metro.MetroTable] = None,
+                   departure: Optional[float] = None
+                   ) -> Tuple[float, city.Path]:
+    """Same as find_route, between the crossings source and target (ids of
+    the City graph, that may have been contracted)."""
+
+    if source == target:
+        return 0.0, [source]
+    sources: Seeds = street_seeds(rg, source)
+    targets: Seeds = street_seeds(rg, target)
+    time, path = inf, []
+    if departure is not None:
+        time, path = time_dependent_search(rg, sources, targets, departure)
+    elif table is not None:
+        time, path = table_search(rg, table, sources, targets)
+    if not path:
+        time, path, _ = bidirectional_search(rg, sources, targets)
+    direct: Optional[float] = street_time(rg, source, target)
+    if direct is not None and direct <= time:
+        return direct, [source, target]
+    return time, crossing_path(rg, path, source, target)
+
+
+def find_routes(rg: RoutingGraph, streets: city.OsmnxGraph, src: city.Coord,
+                dst: city.Coord, accessible_only: bool = False
+                ) -> List[Route]:
+    """Returns the Pareto set of routes (see pareto_paths) between the
+    crossings nearest to the coordinates src and dst, with the paths with
+    the ids of the City graph (as find_route)."""
+
+    source: city.NodeID = nearest_crossing(rg, streets, src)
+    target: city.NodeID = nearest_crossing(rg, streets, dst)
+    if source == target:
+        return [Route(0.0, 0.0, 0, [source])]
+
+    routes: List[Route] = [
+        replace(route, path=crossing_path(rg, route.path, source, target))
+        for route in pareto_search(rg, street_seeds(rg, source),
+                                   street_seeds(rg, target), accessible_only)]
+    direct: Optional[float] = street_time(rg, source, target)
+    if direct is not None:
+        routes.append(Route(direct, direct * WALKING_SPEED, 0,
+                            [source, target]))
+    return pareto_filter(routes)[:MAX_ROUTES]
+
+
+def street_time(rg: RoutingGraph, source: city.NodeID,
+                target: city.NodeID) -> Optional[float]:
+    """Returns the time to walk between the crossings source and target
+    along their Street if both were contracted into the same one, and None
+    otherwise."""
+
+    if source in rg.contracted and target in rg.contracted:
+        u, to_u, v, _ = rg.contracted[source]
+        other_u, other_to_u, other_v, _ = rg.contracted[target]
+        if (u, v) == (other_u, other_v):
+            return abs(to_u - other_to_u)
+    return None
+
+
+def crossing_path(rg: RoutingGraph, path: DensePath, source: city.NodeID,
+                  target: city.NodeID) -> city.Path:
+    """Returns the path (with the ids of the City graph) of a route found
+    from the seeds of the crossings source and target, which are added at
+    its ends if they were contracted."""
+
+    route: city.Path = external_path(rg, path)
+    if route and source in rg.contracted:
+        route.insert(0, source)
+    if route and target in rg.contracted:
+        route.append(target)
+    return route
@@ -0,0 +1,117 @@
+import time
+import logging
+from dataclasses import dataclass
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, \
+    wait
+from typing import Any, Callable, Dict, List, Set, Tuple
+from typing_extensions import TypeAlias
+
+
+"""
+Module that contains the code related to the startup pipeline of the bot:
+the loading of the datasets and the construction of the graphs, described
+as stages that depend on the results of other stages. The stages whose
+dependencies are done run concurrently in a pool of threads, and the wall
+time of each stage is recorded.
+"""
+
+
+# Threads of the pool that runs the stages.
+WORKERS: int = 4
+
+
+@dataclass
+class Stage:
+    """Step of the startup. Its function is called with the results of its
+    dependencies (names of other stages), in order, and returns the result
+    of the stage."""
+
+    name: str
+    function: Callable
+    dependencies: Tuple[str, ...] = ()
+
+
+# Start and end of each stage, in seconds since the start of the pipeline.
+Times: TypeAlias = Dict[str, Tuple[float, float]]
+
+
+def check_stages(stages: List[Stage]) -> None:
+    """Raises ValueError if two stages have the same name, a stage depends
+    on a stage that does not exist or the dependencies have a cycle."""
+
+    names: Dict[str, Stage] = {}
+    for stage in stages:
+        if stage.name in names:
+            raise ValueError("Repeated stage %s" % stage.name)
+        names[stage.name] = stage
+    for stage in stages:
+        for dependency in stage.dependencies:
+            if dependency not in names:
+                raise ValueError("Stage %s depends on the unknown stage %s" %
+                                 (stage.name, dependency))
+
+    # Stages are removed once all their dependencies have been removed.
+    done: Set[str] = set()
+    remaining: List[Stage] = list(stages)
+    while remaining:
+        ready: List[Stage] = [stage for stage in remaining
+                              if set(stage.dependencies) <= done]
+        if not ready:
+            raise ValueError("Cycle among the stages %s" %
+                             [stage.name for stage in remaining])
+        done.update(stage.name for stage in ready)
+        remaining = [stage for stage in remaining if stage.name not in done]
+
+
+def run_stages(stages: List[Stage],
+               workers: int = WORKERS) -> Tuple[Dict[str, Any], Times]:
+    """Runs the stages, each one as soon as its dependencies are done, with
+    the given number of threads. Returns the result and the times of each
+    stage. If a stage raises an exception, the stages not started yet are
+    cancelled and the exception is raised once the running ones end."""
+
+    check_stages(stages)
+    results: Dict[str, Any] = {}
+    times: Times = {}
+    start: float = time.perf_counter()
+
+    def run(stage: Stage) -> Any:
+        began: float = time.perf_counter() - start
+        result: Any = stage.function(*(results[dependency]
+                                       for dependency in stage.dependencies))
+        times[stage.name] = (began, time.perf_counter() - start)
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers,
+                            thread_name_prefix='startup') as executor:
+        waiting: List[Stage] = list(stages)
+        running: Dict[Future, Stage] = {}
+        while waiting or running:
+            for stage in [stage for stage in waiting
+                          if all(dependency in results
+                                 for dependency in stage.dependencies)]:
+                waiting.remove(stage)
+                running[executor.submit(run, stage)] = stage
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                if future.exception() is not None:
+                    for other in running:
+                        other.cancel()
+                    raise future.exception()
+                results[stage.name] = future.result()
+
+    return results, times
+
+
+def log_times(times: Times) -> None:
+    """Logs (at info level) the wall time of each stage, in the order they
+    started."""
+
+    for name, (began, ended) in sorted(times.items(),
+                                       key=lambda item: item[1]):
+        logging.info("%-12s %7.3f s (from %.3f s to %.3f s)",
+                     name, ended - began, began, ended)
+    logging.info("%-12s %7.3f s", "startup",
+                 max(ended for _, ended in times.values()))
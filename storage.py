@@ -0,0 +1,188 @@
+import time
+import logging
+import sqlite3
+import threading
+from array import array
+from typing import Dict, Optional, Tuple
+from typing_extensions import TypeAlias
+
+
+"""
+Module that contains the code related to the persistence of the state of the
+bot users (name, last search and coordinates), so that it survives restarts
+of the bot.
+"""
+
+
+# State of a user, as stored in the bot's user dictionary.
+User: TypeAlias = Dict
+
+# Compact encoding of a user: (name, query, longitude, latitude, results,
+# fingerprint of the dataset of the results).
+Row: TypeAlias = Tuple[str, str, float, float, Optional[bytes],
+                       Optional[int]]
+
+
+def encode_user(user: User, dataset: Optional[int]) -> Row:
+    """Encodes the state of a user into a row. The coordinates are stored as
+    floats and the results as the raw bytes of the array of indices (or None
+    if they were evicted), along with the fingerprint of the dataset of the
+    restaurants they are positions of."""
+
+    results: Optional[array] = user['User restaurants']
+    lon, lat = user['Coordinates']
+    return (user['Name'], user['Query'], float(lon), float(lat),
+            None if results is None else results.tobytes(), dataset)
+
+
+def decode_user(row: Row, dataset: Optional[int]) -> User:
+    """Decodes a row into the state of a user. The results are dropped (and
+    searched again from the query when needed) if they were stored for
+    another dataset of the restaurants."""
+
+    name, query, lon, lat, blob, fingerprint = row
+    results: Optional[array] = None
+    if blob is not None and fingerprint == dataset:
+        results = array('i')
+        results.frombytes(blob)
+    return {'Name': name,
+            'Query': query,
+            'User restaurants': results,
+            'Coordinates': [lon, lat],
+            'Last seen': time.monotonic()}
+
+
+class UserStore:
+    """Interface of a persistence layer for the state of the users. The
+    default implementation keeps nothing, so the bot works as if there was
+    no persistence at all."""
+
+    def load(self, user_id: int) -> Optional[User]:
+        """Returns the stored state of the user or None if there is none."""
+
+        return None
+
+    def save(self, user_id: int, user: User) -> None:
+        """Stores the state of the user."""
+
+        pass
+
+    def close(self) -> None:
+        """Writes any pending change and releases the store."""
+
+        pass
+
+
+class SQLiteUserStore(UserStore):
+    """User store backed by a SQLite database. Writes are write-behind: save()
+    only encodes the user and queues the row, and a background thread writes
+    the queued rows in batches, so no handler ever waits for the disk. Only
+    the last state of each user is kept in the queue, and it stays there
+    until it has been committed. The users are loaded through a second
+    connection, that (in WAL mode) does not wait for the writes.
+
+    The results are stored with the fingerprint of the current dataset of
+    the restaurants, and only loaded back while it does not change."""
+
+    def __init__(self, filename: str, dataset: Optional[int] = None,
+                 flush_interval: float = 2.0,
+                 batch_size: int = 512) -> None:
+        self.dataset: Optional[int] = dataset  # Fingerprint.
+        self.flush_interval: float = flush_interval  # Seconds.
+        self.batch_size: int = batch_size  # Rows that force a flush.
+        self._pending: Dict[int, Row] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed: bool = False
+
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS users ("
+                         "user_id INTEGER PRIMARY KEY, name TEXT, "
+                         "query TEXT, lon REAL, lat REAL, results BLOB, "
+                         "dataset INTEGER)")
+        columns = [column[1] for column
+                   in self._db.execute("PRAGMA table_info(users)")]
+        if 'dataset' not in columns:  # Written before the fingerprints.
+            self._db.execute("ALTER TABLE users ADD COLUMN dataset INTEGER")
+        self._db.commit()
+        self._db_lock = threading.Lock()
+        self._reader = sqlite3.connect(filename, check_same_thread=False)
+        self._reader_lock = threading.Lock()
+
+        self._writer = threading.Thread(target=self._run, daemon=True)
+        self._writer.start()
+
+    def load(self, user_id: int) -> Optional[User]:
+        """Returns the stored state of the user. A state still waiting to be
+        written (or being written) is returned without reading the
+        database."""
+
+        with self._lock:
+            row: Optional[Row] = self._pending.get(user_id)
+        if row is None:
+            with self._reader_lock:
+                row = self._reader.execute(
+                    "SELECT name, query, lon, lat, results, dataset "
+                    "FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return None if row is None else decode_user(row, self.dataset)
+
+    def save(self, user_id: int, user: User) -> None:
+        """Queues the state of the user to be written."""
+
+        row: Row = encode_user(user, self.dataset)
+        with self._lock:
+            self._pending[user_id] = row
+            full: bool = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def flush(self) -> None:
+        """Writes all the queued rows in a single transaction. The rows are
+        dequeued once committed, unless the user has been saved again
+        meanwhile (every save queues a new row)."""
+
+        with self._lock:
+            pending: Dict[int, Row] = dict(self._pending)
+        if not pending:
+            return
+
+        with self._db_lock:
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO users "
+                    "(user_id, name, query, lon, lat, results, dataset) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(user_id,) + row for user_id, row in pending.items()])
+                self._db.commit()
+            except sqlite3.Error:
+                self._db.rollback()
+                raise
+
+        with self._lock:
+            for user_id, row in pending.items():
+                if self._pending.get(user_id) is row:
+                    del self._pending[user_id]
+
+    def close(self) -> None:
+        """Stops the writer thread, writes the queued rows and closes the
+        database."""
+
+        self._closed = True
+        self._wake.set()
+        self._writer.join()
+        self.flush()
+        self._db.close()
+        self._reader.close()
+
+    def _run(self) -> None:
+        """Body of the writer thread. If a write fails, the rows stay queued
+        and are written with the next flush."""
+
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logging.exception("Could not write the users")